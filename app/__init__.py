@@ -1,9 +1,49 @@
+import logging
+import os
+
 from flask import Flask
 
 def create_app():
     app = Flask(__name__)
-    
+
+    # DEBUG logs every prompt and reply; keep it off in production, where the hot path should not format them.
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    app.config["SESSION_STORE_URL"] = os.environ.get("SESSION_STORE_URL", "memory")
+    app.config["SESSION_TTL_SECONDS"] = int(os.environ.get("SESSION_TTL_SECONDS", 3600))
+    app.config["SESSION_MAX_ENTRIES"] = int(os.environ.get("SESSION_MAX_ENTRIES", 10000))
+
+    from .session_store import create_session_store
+    app.extensions["order_sessions"] = create_session_store(
+        app.config["SESSION_STORE_URL"],
+        ttl=app.config["SESSION_TTL_SECONDS"],
+        max_sessions=app.config["SESSION_MAX_ENTRIES"]
+    )
+
+    app.config["ORDER_JOURNAL_PATH"] = os.environ.get("ORDER_JOURNAL_PATH", os.path.join(app.instance_path, "orders.jsonl"))
+
+    from .order_journal import OrderJournal
+    app.extensions["order_journal"] = OrderJournal(app.config["ORDER_JOURNAL_PATH"])
+
+    # Completed orders are batched for delivery; see app/dispatch.py for the DISPATCH_* settings.
+    # The store is shared by every worker, so they all see the same batches.
+    app.config["DISPATCH_STORE_URL"] = os.environ.get("DISPATCH_STORE_URL", "sqlite:///" + os.path.join(app.instance_path, "dispatch.db"))
+
+    from .dispatch import create_dispatcher
+    app.extensions["dispatcher"] = create_dispatcher(app.config["DISPATCH_STORE_URL"])
+    app.extensions["dispatcher"].restore(app.extensions["order_journal"])
+
+    # One chat turn per session at a time; duplicate submits share its reply.
+    from .admission import SessionFlights
+    app.extensions["chat_flights"] = SessionFlights(max_age=float(os.environ.get("CHAT_DEADLINE_SECONDS", 20)) + 10)
+
     from .routes import main
     app.register_blueprint(main)
 
+    # Models otherwise load lazily on first use; see gunicorn.conf.py.
+    if os.environ.get("PRELOAD_MODELS") == "1":
+        from .lifecycle import preload
+        preload()
+
     return app
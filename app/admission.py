@@ -0,0 +1,260 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from . import metrics
+
+# Lower numbers are admitted first: a customer about to pay outranks one still browsing.
+STAGE_PRIORITY = {
+    "awaiting_delivery_details": 0,
+    "awaiting_confirmation": 0,
+    "awaiting_special_requests": 1,
+    "awaiting_amendment": 1,
+    "awaiting_item_details": 1,
+}
+BROWSING_PRIORITY = 2
+
+
+# --- Token Bucket ---
+
+class TokenBucket:
+    """Allows `rate` calls per second on average and bursts of up to `burst`. A rate of 0 means unlimited."""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self):
+        if not self.rate:
+            return True
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def time_until(self, tokens):
+        """Seconds until `tokens` tokens will have been available, ignoring other takers."""
+        if not self.rate:
+            return 0.0
+        self._refill()
+        return max(0.0, (tokens - self._tokens) / self.rate)
+
+
+# --- Admission Queue ---
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "enqueued_at", "state")
+
+    def __init__(self, priority, seq, enqueued_at):
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = enqueued_at
+        self.state = "waiting"  # -> "admitted" or "shed"
+
+
+class AdmissionController:
+    """
+    Gates model calls behind the API quota.
+
+    A call is admitted when a token is available from the bucket and fewer
+    than `max_in_flight` calls are running. Callers wait in a bounded queue
+    ordered by stage priority, then arrival. A caller is shed, so the turn can
+    fall back to a deterministic reply at once, when:
+    - the queue is full and it ranks below everyone queued (or a
+      higher-priority arrival evicts it), or
+    - its estimated wait plus a typical model call would overrun its deadline,
+      checked on arrival and again while it waits.
+    """
+
+    def __init__(self, rate=0.0, burst=1, max_in_flight=32, queue_size=64, turn_deadline=20.0,
+                 initial_service_time=2.0, clock=time.monotonic):
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.turn_deadline = turn_deadline
+        self._clock = clock
+        # Moving average of model call time, used to predict deadline misses.
+        self._service_time = initial_service_time
+        self._in_flight = 0
+        self._queue = []  # (priority, seq, waiter)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stats = {"admitted": 0, "shed_queue_full": 0, "shed_deadline": 0, "evicted": 0}
+
+    def deadline_for(self, started=None):
+        """Absolute deadline for a turn that started at `started` (default now)."""
+        return (self._clock() if started is None else started) + self.turn_deadline
+
+    def acquire(self, stage, deadline):
+        """
+        Blocks until the call may run. Returns the admission time, to be passed to
+        release(), or None when the call was shed.
+        """
+        priority = STAGE_PRIORITY.get(stage, BROWSING_PRIORITY)
+        with self._cond:
+            now = self._clock()
+            waiter = _Waiter(priority, next(self._seq), now)
+            if not self._enqueue(waiter):
+                return self._shed("shed_queue_full")
+            if self._estimated_finish(waiter, now) > deadline:
+                self._remove(waiter)
+                return self._shed("shed_deadline")
+
+            while True:
+                self._grant()
+                if waiter.state == "admitted":
+                    metrics.ADMISSION_WAIT_SECONDS.observe(self._clock() - waiter.enqueued_at)
+                    return self._clock()
+                if waiter.state == "shed":
+                    return self._shed("evicted")
+                now = self._clock()
+                if self._estimated_finish(waiter, now) > deadline:
+                    self._remove(waiter)
+                    return self._shed("shed_deadline")
+                # Tokens refill without anyone calling release(), so wake up for them too.
+                timeout = deadline - now
+                token_wait = self.bucket.time_until(1)
+                if token_wait > 0:
+                    timeout = min(timeout, token_wait)
+                self._cond.wait(timeout=max(0.001, timeout))
+
+    def release(self, admitted_at):
+        with self._cond:
+            self._in_flight -= 1
+            self._service_time = 0.8 * self._service_time + 0.2 * (self._clock() - admitted_at)
+            self._grant()
+            self._cond.notify_all()
+
+    def _enqueue(self, waiter):
+        if len(self._queue) >= self.queue_size:
+            worst = max(self._queue)
+            if worst[0] <= waiter.priority:
+                return False
+            self._queue.remove(worst)
+            heapq.heapify(self._queue)
+            worst[2].state = "shed"
+            self._cond.notify_all()
+        heapq.heappush(self._queue, (waiter.priority, waiter.seq, waiter))
+        return True
+
+    def _remove(self, waiter):
+        self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+        heapq.heapify(self._queue)
+
+    def _grant(self):
+        granted = False
+        while self._queue and self._in_flight < self.max_in_flight and self.bucket.try_take():
+            _, _, head = heapq.heappop(self._queue)
+            head.state = "admitted"
+            self._in_flight += 1
+            self._stats["admitted"] += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _estimated_finish(self, waiter, now):
+        """When the waiter's model call would finish: after the callers ahead of it are served, plus one call."""
+        ahead = sum(1 for priority, seq, _ in self._queue if (priority, seq) < (waiter.priority, waiter.seq))
+        token_wait = self.bucket.time_until(ahead + 1)
+        slot_wait = 0.0
+        if self._in_flight + ahead >= self.max_in_flight:
+            slot_wait = (self._in_flight + ahead - self.max_in_flight + 1) / self.max_in_flight * self._service_time
+        return now + max(token_wait, slot_wait) + self._service_time
+
+    def _shed(self, reason):
+        self._stats[reason] += 1
+        metrics.ADMISSION_SHED.inc(reason=reason)
+        return None
+
+    def stats(self):
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot.update(in_flight=self._in_flight, queued=len(self._queue), service_time_seconds=round(self._service_time, 3))
+        return snapshot
+
+
+def create_admission_controller():
+    """
+    Builds the controller from environment variables: LLM_QUOTA_PER_MINUTE (0 = unlimited)
+    and LLM_QUOTA_BURST size the token bucket; ADMISSION_* bound concurrency, queue and deadline.
+    """
+    return AdmissionController(
+        rate=float(os.environ.get("LLM_QUOTA_PER_MINUTE", 1000)) / 60,
+        burst=int(os.environ.get("LLM_QUOTA_BURST", 20)),
+        max_in_flight=int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", 32)),
+        queue_size=int(os.environ.get("ADMISSION_QUEUE_SIZE", 64)),
+        turn_deadline=float(os.environ.get("CHAT_DEADLINE_SECONDS", 20))
+    )
+
+
+# --- Per-Session Turns ---
+
+class _Flight:
+    __slots__ = ("message", "started", "done", "result")
+
+    def __init__(self, message, started):
+        self.message = message
+        self.started = started
+        self.done = threading.Event()
+        self.result = None
+
+
+class SessionFlights:
+    """
+    Allows one in-flight chat turn per session.
+
+    join() makes the caller the leader of a new turn, a follower of an
+    identical in-flight turn (a double-click or retry), whose result it
+    shares, or reports the session as busy with a different message.
+    A turn older than `max_age` seconds is presumed abandoned (e.g. a stream
+    the client never read) and no longer blocks the session.
+    """
+
+    LEADER = "leader"
+    FOLLOWER = "follower"
+    BUSY = "busy"
+
+    def __init__(self, max_age=30.0, clock=time.monotonic):
+        self.max_age = max_age
+        self._clock = clock
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {"turns": 0, "coalesced": 0, "busy": 0}
+
+    def join(self, session_id, message):
+        """Returns (role, flight)."""
+        with self._lock:
+            now = self._clock()
+            flight = self._flights.get(session_id)
+            if flight is None or now - flight.started > self.max_age:
+                flight = self._flights[session_id] = _Flight(message, now)
+                self._stats["turns"] += 1
+                return self.LEADER, flight
+            if flight.message == message:
+                self._stats["coalesced"] += 1
+                return self.FOLLOWER, flight
+            self._stats["busy"] += 1
+            return self.BUSY, flight
+
+    def finish(self, session_id, flight, result):
+        """Publishes the leader's result to followers and frees the session."""
+        flight.result = result
+        with self._lock:
+            if self._flights.get(session_id) is flight:
+                del self._flights[session_id]
+        flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._flights))
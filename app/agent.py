@@ -1,30 +1,33 @@
-# agent.py (corrected generate_response function)
-
-import google.generativeai as genai
+import functools
+import logging
+import os
 import re
 import json
-import os
-import traceback
+import time
+from . import metrics
 from .order_manager import calculate_price, find_item
+from .menu_catalog import CATALOG
+from .history import HistoryWindow, estimate_tokens
+from .llm_client import LLMUnavailable, create_llm_client
+from .reply_cache import create_reply_cache
+from .admission import create_admission_controller
+from .order_parser import QUESTION_PATTERN, SIZE_FULL_NAMES, order_parser, parse_order, parse_size
+from .clarification import apply_answers, build_form, fill_typed_options, first_required, parse_submission
+from .dietary import RESTRICTIONS, dietary_index, parse_categories, parse_restrictions
 
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY", "API KEY HERE"))
+logger = logging.getLogger(__name__)
 
-menu_path = os.path.join(os.path.dirname(__file__), "menu.json")
-with open(menu_path, "r") as f:
-    MENU_DATA = json.load(f)
+MENU_DATA = CATALOG.data
 
-model = genai.GenerativeModel("gemini-2.0-flash")
+llm_client = create_llm_client()
 
-SIZE_FULL_NAMES = {
-    "s": "Small",
-    "m": "Medium",
-    "l": "Large",
-    "single": "Single",
-    "double": "Double",
-    "regular": "Regular",
-    "500ml": "500ml",
-    "1l": "1 Liter"
-}
+history_window = HistoryWindow()
+
+# Model replies for repeatable turns; None when REPLY_CACHE_SIZE=0
+reply_cache = create_reply_cache()
+
+# Quota, priority and deadline gate in front of every model call
+admission = create_admission_controller()
 
 # --- Helper Functions ---
 
@@ -45,16 +48,25 @@ def _get_order_summary_text(structured_order, collected_special=None, include_pr
             # Correctly adds size to summary for any item that has a size
             if item_size_option != "N/A":
                 item_display += f" ({SIZE_FULL_NAMES.get(item_size_option.lower(), item_size_option).upper()})"
+
+            details = [f"{item['crust']} crust"] if item.get("crust") not in (None, "normal") else []
+            details.extend(item[key] for key in ("protein", "sauce") if item.get(key))
+            if item.get("addons"):
+                details.append("with " + " and ".join(item["addons"]))
+            if details:
+                item_display += ": " + ", ".join(details)
             
             summary_lines.append(item_display)
 
-            items_for_price_calc.append({
+            price_line = {
                 "name": item.get("name"),
                 "id": item.get("id"),
                 "category": item.get("category"),
                 "size": item.get("size"),
                 "quantity": item.get("quantity", 1)
-            })
+            }
+            price_line.update({key: item[key] for key in ("crust", "protein", "addons") if key in item})
+            items_for_price_calc.append(price_line)
 
     summary_text = ""
     if summary_lines:
@@ -77,8 +89,15 @@ def _get_order_summary_text(structured_order, collected_special=None, include_pr
 
 def _get_menu_text():
     """Generates a hardcoded text menu from MENU_DATA to prevent hallucination."""
+    return _menu_text_for_version(CATALOG.version)
+
+@functools.lru_cache(maxsize=4)
+def _menu_text_for_version(menu_version):
     menu_text = "Here is our menu:\n\n"
     for category, items in MENU_DATA.items():
+        # Only item lists belong in the menu text; restaurant metadata and option tables do not.
+        if not isinstance(items, list):
+            continue
         menu_text += f"**{category.title()}**:\n"
         for item in items:
             if isinstance(item, dict):
@@ -88,8 +107,33 @@ def _get_menu_text():
     menu_text += "\n"
     return menu_text.strip()
 
-# --- Main build_system_prompt ---
-def build_system_prompt(current_state):
+# --- System Prompt ---
+
+# Bump whenever the static instructions below change, so cached prefixes are rebuilt.
+PROMPT_VERSION = 1
+
+# Order state fields the model needs; `messages` is left out because it is sent as chat turns.
+STATE_PROJECTION_KEYS = (
+    "stage",
+    "structured_order",
+    "clarification_index",
+    "collected_special",
+    "collected_confirmation",
+    "collected_name",
+    "collected_phone",
+    "collected_address"
+)
+
+def static_prompt_key():
+    """Identifies the current static prefix: changes with PROMPT_VERSION or the menu version."""
+    return f"v{PROMPT_VERSION}-{CATALOG.version}"
+
+def static_prompt_prefix():
+    """The persona, menu and process rules. Identical across turns for a given static_prompt_key()."""
+    return _build_static_prompt_prefix(static_prompt_key())
+
+@functools.lru_cache(maxsize=4)
+def _build_static_prompt_prefix(prompt_key):
     prompt = (
         "You are Mamma Mia's friendly, helpful, polite, and efficient AI assistant. "
         "Your core task is to take customer orders for pizza, pasta, and drinks for delivery only. "
@@ -111,13 +155,25 @@ def build_system_prompt(current_state):
         "7.  **Final Summary & Farewell:** When you have ALL delivery details, provide a complete summary of their order, special requests, and delivery details, including the **total calculated price**. This final summary will be generated by the system, but your final conversational closing should be polite and warm.\n\n"
     )
 
+    prompt += (
+        "**Crucial:** After acknowledging special requests (or lack thereof), proceed directly to the summary for confirmation. "
+        "Do NOT include the JSON from 'Current Order State for Internal Reference' in your response. It is for your internal reference only.\n"
+    )
+    return prompt
+
+def _state_projection(current_state):
+    """Compact JSON of the order state without the conversation history."""
+    return json.dumps({key: current_state.get(key) for key in STATE_PROJECTION_KEYS}, separators=(",", ":"))
+
+def build_dynamic_prompt(current_state):
+    """The per-turn part of the system prompt: order summary, compact state and turn instructions."""
+    prompt = ""
     if current_state["stage"] in ["awaiting_confirmation", "awaiting_delivery_details", "completed", "awaiting_amendment"]:
-        prompt += f"\n**Current Order Status for Customer Confirmation:**\n{_get_order_summary_text(current_state['structured_order'], current_state['collected_special'], include_price=True)}\n"
+        prompt += f"**Current Order Status for Customer Confirmation:**\n{_get_order_summary_text(current_state['structured_order'], current_state['collected_special'], include_price=True)}\n\n"
     elif current_state["stage"] == "awaiting_special_requests":
-        prompt += f"\n**Current Order Items (for Special Request context):**\n{_get_order_summary_text(current_state['structured_order'])}\n"
-
+        prompt += f"**Current Order Items (for Special Request context):**\n{_get_order_summary_text(current_state['structured_order'])}\n\n"
 
-    prompt += f"\n**Current Order State for Internal Reference:** {json.dumps(current_state, indent=2)}\n"
+    prompt += f"**Current Order State for Internal Reference:** {_state_projection(current_state)}\n"
     prompt += "Based on this state and the conversation history, what should be your next response? Remember to be conversational and helpful."
     
     # This is the new, more dynamic instruction. It uses the state to guide the response.
@@ -125,18 +181,367 @@ def build_system_prompt(current_state):
       prompt += "\n\n**Crucial:** A special request has been collected. You must start your reply by acknowledging it (e.g., 'Okay, I've noted your special request for...')."
     else:
       prompt += "\n\n**Crucial:** No special requests have been collected. You should start your reply by stating this (e.g., 'Okay, no special requests.')."
-    
-    prompt += "\n\n**Crucial:** After acknowledging special requests (or lack thereof), proceed directly to the summary for confirmation. Do NOT include the JSON from 'Current Order State for Internal Reference' in your response. It is for your internal reference only."
 
     return prompt
-    # The n
 
+# --- Main build_system_prompt ---
+def build_system_prompt(current_state):
+    return static_prompt_prefix() + "\n" + build_dynamic_prompt(current_state)
+
+
+AMENDMENT_PATTERN = re.compile(r"\b(remove|change|add)\b", re.IGNORECASE)
+
+# --- Stage Handlers ---
+# Each handler runs before the model is called. It updates the state and returns
+# (reply, state). A reply of None means the turn needs generated text from the model.
+
+SPECIAL_REQUESTS_QUESTION = "Wonderful! Now that we have all the details, do you have any special requests? For example, dietary needs (e.g., vegan, halal, gluten-free) or modifications (e.g., extra cheese, no onions)?"
+
+# "form" asks for every missing item option in one form that script.js renders;
+# "sequential" asks for one item's size per turn.
+CLARIFICATION_MODE = os.environ.get("CLARIFICATION_MODE", "form")
+
+OPTIONS_FORM_PROMPT = "Ah, bellissima! Please choose the options for your items below and hit 'Confirm options'. You can also just tell me the sizes one at a time."
+
+MENU_DONE_MESSAGE = "The customer has finished selecting items from the menu."
+
+def _handle_amendment(state, new_user_message):
+    if "ranch/bbq pizza" in new_user_message.lower() and state["collected_special"]:
+        # Hardcoded example for now, should be generalized later
+        # Check if a new item has been added and a special request exists
+        last_item = state["structured_order"]["items"][-1] if state["structured_order"]["items"] else None
+        if last_item and last_item.get("size"):
+            return f"Alright! So that's one {SIZE_FULL_NAMES.get(last_item['size'], last_item['size']).upper()} {last_item['name']}. We previously noted a special request for '{state['collected_special']}'. Would you like these requests to apply to this new item as well?", state
+    return None, state
+
+def _handle_item_details(state, new_user_message):
+    answers = parse_submission(new_user_message)
+    if answers is not None:
+        return _handle_options_submission(state, answers)
+
+    # On entering the stage, ask for every missing option at once.
+    entering = not new_user_message or new_user_message.startswith(MENU_DONE_MESSAGE)
+    if CLARIFICATION_MODE == "form" and entering:
+        form = build_form(state["structured_order"])
+        if form is not None:
+            state["clarification_form"] = form
+            state["clarification_index"] = 0
+            return OPTIONS_FORM_PROMPT, state
+
+    reply, state = _ask_next_size(state, new_user_message)
+    if state["stage"] == "awaiting_special_requests":
+        # Every size is set; typed replies then answer the other required options (protein, sauce).
+        return _ask_required_options(state, new_user_message, reply)
+    # Typed answers fill in the same options; keep the form showing only what is still missing.
+    if state.get("clarification_form") is not None:
+        state["clarification_form"] = build_form(state["structured_order"])
+    return reply, state
+
+def _ask_required_options(state, new_user_message, next_stage_reply):
+    """Moves on to special requests only once build_form finds nothing missing; otherwise asks for the first missing options."""
+    if not new_user_message.startswith(MENU_DONE_MESSAGE):
+        fill_typed_options(state["structured_order"], new_user_message)
+    form = build_form(state["structured_order"])
+    if form is None:
+        state["clarification_form"] = None
+        return next_stage_reply, state
+
+    state["stage"] = "awaiting_item_details"
+    state["clarification_form"] = form
+    form_item, fields = first_required(form)
+    wanted = " and ".join(field["label"].lower() for field in fields)
+    options = "; ".join(f"{field['label']}: {', '.join(option['label'] for option in field['options'])}" for field in fields)
+    return f"Ah, bellissima! What {wanted} would you like for the {form_item['name']}? ({options})", state
+
+def _handle_options_submission(state, answers):
+    items, errors = apply_answers(state["structured_order"], answers)
+    if errors:
+        state["clarification_form"] = build_form(state["structured_order"], errors)
+        return "Some of those options need another look:\n" + "\n".join(f"- {message}" for message in errors.values()), state
+
+    state["structured_order"]["items"] = items
+    state["clarification_form"] = None
+    state["clarification_index"] = 0
+    state["stage"] = "awaiting_special_requests"
+    return f"Perfect!\n\n{_get_order_summary_text(state['structured_order'])}\n\n{SPECIAL_REQUESTS_QUESTION}", state
+
+def _ask_next_size(state, new_user_message):
+    item_for_clarification = None
+    for current_check_idx in range(state["clarification_index"], len(state["structured_order"]["items"])):
+        potential_item = state["structured_order"]["items"][current_check_idx]
+        menu_item_details = find_item(potential_item["category"], potential_item["id"])
+
+        if menu_item_details and \
+           potential_item["category"] not in ["drinks"] and \
+           "sizes" in menu_item_details and \
+           len(menu_item_details["sizes"]) > 1 and \
+           "size" not in potential_item:
+            item_for_clarification = potential_item
+            state["clarification_index"] = current_check_idx
+            break
+    
+    if item_for_clarification is None:
+        state["stage"] = "awaiting_special_requests"
+        state["clarification_index"] = 0 
+        return SPECIAL_REQUESTS_QUESTION, state
+
+    menu_item_details = find_item(item_for_clarification["category"], item_for_clarification["id"])
+    if not menu_item_details:
+        return "I'm having trouble finding details for that item. Can you please specify which item you're referring to?", state
+
+    available_size_options_raw = [s["size"].lower() for s in menu_item_details.get("sizes", [])]
+    size_found = None
+
+    if not new_user_message.startswith(MENU_DONE_MESSAGE):
+        size_found = parse_size(new_user_message, available_size_options_raw)
+
+    if not size_found:
+        formatted_options = [SIZE_FULL_NAMES.get(s_opt['size'].lower(), s_opt['size']) for s_opt in menu_item_details.get('sizes', [])]
+        options_str = ', '.join(formatted_options)
+        return f"Ah, bellissima! What size would you like for the {item_for_clarification['name']}? (Available: {options_str})", state
+
+    state["structured_order"]["items"][state["clarification_index"]]["size"] = size_found
+    state["clarification_index"] += 1
+
+    next_item_to_ask = None
+    for i in range(state["clarification_index"], len(state["structured_order"]["items"])):
+        next_potential_item = state["structured_order"]["items"][i]
+        next_menu_details = find_item(next_potential_item["category"], next_potential_item["id"])
+
+        if next_menu_details and \
+           "sizes" in next_menu_details and \
+           len(next_menu_details["sizes"]) > 1 and \
+           "size" not in next_potential_item:
+            next_item_to_ask = next_potential_item
+            state["clarification_index"] = i
+            break
+
+    if next_item_to_ask:
+        next_menu_details = find_item(next_item_to_ask["category"], next_item_to_ask["id"])
+        formatted_options = [SIZE_FULL_NAMES.get(s_opt['size'].lower(), s_opt['size']) for s_opt in next_menu_details.get('sizes', [])]
+        options_str = ', '.join(formatted_options)
+        return f"Got it! A {SIZE_FULL_NAMES.get(size_found, size_found).upper()} {item_for_clarification['name']}. And for the {next_item_to_ask['name']}, what size would you like? (Available: {options_str})", state
+
+    state["stage"] = "awaiting_special_requests"
+    state["clarification_index"] = 0
+    return SPECIAL_REQUESTS_QUESTION, state
+
+def _handle_free_text_order(state, new_user_message):
+    # "two large hawaiian and a limonata" is turned into items locally; anything else goes to the model.
+    items = parse_order(new_user_message)
+    if not items:
+        return None, state
+    state["structured_order"] = {"items": items}
+    state["stage"] = "awaiting_item_details"
+    state["clarification_index"] = 0
+    next_question, state = _handle_item_details(state, "")
+    return f"Got it!\n\n{_get_order_summary_text(state['structured_order'])}\n\n{next_question}", state
+
+def _handle_special_requests(state, new_user_message):
+    state["collected_special"] = new_user_message.strip()
+    state["stage"] = "awaiting_confirmation"
+    order_summary = _get_order_summary_text(state["structured_order"], state["collected_special"], include_price=True)
+    
+    if new_user_message.strip().lower() in ["no", "none", "n/a", "no special requests"]:
+        opener = "Okay, no special requests. Before we proceed, let me confirm your order:"
+    else:
+        opener = f"Okay, I've noted your request for '{new_user_message.strip()}'. Before we proceed, let me confirm your order:"
+
+    # Dietary requests are checked against the cart here rather than left for the kitchen to spot.
+    conflicts = dietary_index().check_order(state["structured_order"], parse_restrictions(new_user_message))
+    if conflicts:
+        opener = "Please note:\n" + "\n".join(_dietary_conflict_lines(conflicts)) + "\n\n" + opener
+
+    return f"{opener}\n\n{order_summary}\n\nDoes everything look correct?", state
+
+def _handle_confirmation(state, new_user_message):
+    if new_user_message.lower() in ["yes", "y", "correct", "confirm", "all correct", "that's correct"]:
+        state["collected_confirmation"] = True
+        state["stage"] = "awaiting_delivery_details"
+    # The model phrases the follow-up: a request for delivery details, or a clarification.
+    return None, state
+
+def _handle_delivery_details(state, new_user_message):
+    extracted_name = re.search(r"my name is (.+?)(?:\.|$)", new_user_message, re.IGNORECASE)
+    extracted_phone = re.search(r"(?:\D|^)(\d{3}[-.\s]?\d{3}[-.\s]?\d{4})(?:\D|$)", new_user_message)
+    extracted_address = re.search(r"address is (.+?)(?:$|\.|\,)", new_user_message, re.IGNORECASE)
+
+    if extracted_name:
+        state["collected_name"] = extracted_name.group(1).strip()
+    if extracted_phone:
+        state["collected_phone"] = extracted_phone.group(1).strip()
+    if extracted_address:
+         state["collected_address"] = extracted_address.group(1).strip()
+
+    if not (state["collected_name"] and state["collected_phone"] and state["collected_address"]):
+        # The model asks for whichever details are still missing.
+        return None, state
+
+    state["stage"] = "completed"
+    order_summary_text = _get_order_summary_text(state["structured_order"], state["collected_special"], include_price=True)
+    
+    final_reply_to_user = (
+        f"Thank you for your order, {state['collected_name']}!\n\n"
+        f"Here is your full order summary:\n"
+        f"{order_summary_text}\n\n"
+        f"**Delivery to:** {state['collected_address']}\n"
+        f"**Phone:** {state['collected_phone']}\n\n"
+        "Your order is being prepared and will be delivered shortly. Enjoy your delicious meal!"
+    )
+
+    state = {
+        "stage": "start",
+        "structured_order": { "items": [] },
+        "clarification_index": 0,
+        "clarification_form": None,
+        "collected_special": None,
+        "collected_confirmation": None,
+        "collected_name": None,
+        "collected_phone": None,
+        "collected_address": None
+    }
+    return final_reply_to_user, state
+
+def _completed_order_record(state):
+    """The confirmed order and delivery details, as persisted once the order completes."""
+    items = state["structured_order"].get("items", [])
+    total_price, price_error = calculate_price(items)
+    return {
+        "items": items,
+        "special_requests": state["collected_special"],
+        "name": state["collected_name"],
+        "phone": state["collected_phone"],
+        "address": state["collected_address"],
+        "total": total_price,
+        "price_error": price_error
+    }
 
-def generate_response(messages, new_user_message, current_state=None):
+# --- Dietary Questions ---
+
+# "Is my order ...?" checks the cart rather than the menu.
+ORDER_REFERENCE_PATTERN = re.compile(r"\b(my order|my food|my items|my cart|this order|it)\b", re.IGNORECASE)
+
+CATEGORY_TITLES = {"pizzas": "Pizzas", "pastas": "Pastas", "drinks": "Drinks"}
+
+# Stages where a dietary message is an answer to the bot's question rather than a question.
+DIETARY_ANSWER_STAGES = ("awaiting_special_requests", "awaiting_confirmation")
+
+def _dietary_conflict_lines(conflicts):
+    lines = []
+    for conflict in conflicts:
+        kind, value = RESTRICTIONS[conflict["restriction"]]
+        problem = f"contains {value}" if kind == "free_of" else f"isn't marked {value}"
+        line = f"- The {conflict['name']} {problem}"
+        lines.append(line + ", but we can make it gluten-free on request." if conflict["on_request"] else line + ".")
+    return lines
+
+def _handle_dietary_question(state, new_user_message):
+    """
+    Answers allergen and dietary questions from the compiled menu index, for
+    named items, the customer's order or the whole menu. Returns None for any
+    other message.
+    """
+    if not QUESTION_PATTERN.search(new_user_message):
+        return None
+    restrictions = parse_restrictions(new_user_message)
+    if not restrictions:
+        return None
+    index = dietary_index()
+    wanted = " and ".join(restrictions)
+
+    # "Is there no dairy in the alfredo?" is about the alfredo, so negations count here.
+    mentioned = order_parser().parse(new_user_message, skip_negated=False)
+    if not mentioned and ORDER_REFERENCE_PATTERN.search(new_user_message):
+        mentioned = state["structured_order"].get("items", [])
+    if mentioned:
+        conflicts = index.check_order({"items": mentioned}, restrictions)
+        if not conflicts:
+            names = " and ".join(f"the {item['name']}" for item in mentioned)
+            return f"Good news: {names} {'is' if len(mentioned) == 1 else 'are'} {wanted}."
+        return "\n".join(_dietary_conflict_lines(conflicts))
+
+    categories = parse_categories(new_user_message)
+    keys = index.keys_in(index.matching(restrictions, categories))
+    if not keys:
+        where = " or ".join(CATEGORY_TITLES.get(category, category).lower() for category in categories)
+        reply = f"Sorry, none of our {where} are marked {wanted}." if categories else f"Sorry, nothing on our menu is marked {wanted}."
+    else:
+        by_category = {}
+        for category, item_id in keys:
+            by_category.setdefault(category, []).append(find_item(category, item_id)["name"])
+        reply = f"Here's what's {wanted}:\n" + "\n".join(
+            f"- **{CATEGORY_TITLES.get(category, category)}:** {', '.join(names)}" for category, names in by_category.items()
+        )
+    if "gluten-free" in restrictions:
+        on_request = index.matching([r for r in restrictions if r != "gluten-free"], categories) & index.gluten_free_on_request
+        if on_request:
+            names = ", ".join(find_item(*key)["name"] for key in index.keys_in(on_request))
+            reply += f"\n\nWe can also make these gluten-free on request: {names}."
+    return reply
+
+STAGE_HANDLERS = {
+    "start": _handle_free_text_order,
+    "awaiting_order": _handle_free_text_order,
+    "awaiting_amendment": _handle_amendment,
+    "awaiting_item_details": _handle_item_details,
+    "awaiting_special_requests": _handle_special_requests,
+    "awaiting_confirmation": _handle_confirmation,
+    "awaiting_delivery_details": _handle_delivery_details,
+}
+
+# --- Model Call ---
+
+FALLBACK_REPLY = "Sorry, I didn’t catch that. Could you try again?"
+
+def _build_chat_history(messages, new_user_message, state):
+    """Assembles the Gemini request. Returns (chat_history, history tokens saved)."""
+    started = time.perf_counter()
+    chat_history = []
+
+    # The static prefix is its own leading part so every request for a menu version starts
+    # with identical content, which is what Gemini context caching keys on.
+    chat_history.append({"role": "user", "parts": [static_prompt_prefix(), build_dynamic_prompt(state)]})
+
+    windowed_history, history_tokens_saved = history_window.build(messages, state)
+    chat_history.extend(windowed_history)
+
+    chat_history.append({"role": "user", "parts": [new_user_message]})
+
+    metrics.PROMPT_BUILD_SECONDS.observe(time.perf_counter() - started)
+    parts = [part for entry in chat_history for part in entry["parts"]]
+    metrics.PROMPT_CHARS.observe(sum(len(part) for part in parts))
+    metrics.PROMPT_TOKENS.observe(sum(estimate_tokens(part) for part in parts))
+    metrics.HISTORY_TOKENS_SAVED.inc(history_tokens_saved)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Sending to Gemini: stage=%s clarification_index=%s message=%r history_tokens_saved=%s",
+                     state["stage"], state["clarification_index"], new_user_message, history_tokens_saved)
+
+    return chat_history, history_tokens_saved
+
+def degraded_reply(state):
+    """A deterministic reply for turns that needed the model while it is unavailable."""
+    if state["stage"] == "awaiting_delivery_details":
+        missing = [label for label, key in (("your name (e.g. 'My name is ...')", "collected_name"), ("your phone number", "collected_phone"), ("your delivery address (e.g. 'My address is ...')", "collected_address")) if not state.get(key)]
+        return "Thank you! To deliver your order, please tell me " + ", ".join(missing) + "."
+    if state["stage"] in ["awaiting_confirmation", "awaiting_amendment"]:
+        order_summary = _get_order_summary_text(state["structured_order"], state["collected_special"], include_price=True)
+        return f"Here is your order so far:\n\n{order_summary}\n\nPlease reply 'yes' to confirm it, or use 'Start Over' to change it."
+    return "Please choose what you'd like from our interactive menu, then hit the 'Done with Order' button to proceed with your choices."
+
+
+def iter_response(messages, new_user_message, current_state=None, stream=False):
+    """
+    Runs one turn, yielding ("delta", text) events while the model streams and
+    finally ("result", result) with the same result dict as generate_response().
+
+    With stream=False the model reply arrives in one piece and no deltas are yielded.
+    """
     state = current_state if current_state is not None else {
         "stage": "start",
         "structured_order": { "items": [] },
         "clarification_index": 0,
+        "clarification_form": None,
         "collected_special": None,
         "collected_confirmation": None,
         "collected_name": None,
@@ -144,206 +549,126 @@ def generate_response(messages, new_user_message, current_state=None):
         "collected_address": None
     }
 
+    entry_stage = state["stage"]
+    deadline = admission.deadline_for()
     try:
-        # --- NEW LOGIC: Handle initial welcome message and stage change ---
         if state["stage"] == "start" and not messages:
             state["stage"] = "awaiting_order" # Change state to prevent a second greeting
-            return {
+            metrics.STAGE_TRANSITIONS.inc(from_stage="start", to_stage="awaiting_order")
+            yield "result", {
                 "reply": "Hello! Welcome to Mamma Mia's Pizza, Pasta & Drinks! Please choose what you'd like from our interactive menu. Once you're done, hit the 'Done with Order' button to proceed with your choices.",
                 "structured_order": state.get("structured_order"),
                 "state": state
             }
+            return
         
         if new_user_message.lower() in ["where is it?", "it's not", "not showing"]:
-            return {
+            yield "result", {
                 "reply": "Ah, no problem! It seems the interactive menu isn't visible. Let me list the menu items for you while we get that sorted out.\n\n" + _get_menu_text(),
                 "structured_order": state.get("structured_order"),
                 "state": state
             }
+            return
         
-        chat_history = []
-        
-        # New logic to handle entering the amendment stage
-        is_amendment_request = "remove" in new_user_message.lower() or \
-           "change" in new_user_message.lower() or \
-           ("add" in new_user_message.lower() and new_user_message.lower() != "i'd like to add")
+        # Allergen and dietary questions are answered from the menu index, except where
+        # "make it gluten free" is the customer's answer (a special request or a change at confirmation).
+        final_reply_to_user = None
+        if state["stage"] not in DIETARY_ANSWER_STAGES:
+            final_reply_to_user = _handle_dietary_question(state, new_user_message)
+        completed_order = None
+
+        # Whole words only: "address" must not read as "add".
+        is_amendment_request = AMENDMENT_PATTERN.search(new_user_message) is not None and \
+           new_user_message.lower() != "i'd like to add"
         
-        if is_amendment_request and state["stage"] not in ["start", "awaiting_amendment"]:
+        if final_reply_to_user is None and is_amendment_request and state["stage"] not in ["start", "awaiting_amendment"]:
             state["stage"] = "awaiting_amendment"
-            
-        system_prompt_content = build_system_prompt(state)
-        chat_history.append({"role": "user", "parts": [system_prompt_content]})
-
-        for msg in messages:
-            chat_history.append({"role": "user", "parts": [msg["user"]]})
-            chat_history.append({"role": "model", "parts": [msg["bot"]]})
-
-        chat_history.append({"role": "user", "parts": [new_user_message]})
-
-        print("\n--- Sending to Gemini (Current State & History) ---\n")
-        print(f"Current Stage: {state['stage']}")
-        print(f"Current Clarification Index: {state['clarification_index']}")
-        print("User message for LLM:", new_user_message)
 
-        response = model.generate_content(chat_history)
-        gemini_reply = response.text.strip() if hasattr(response, "text") and response.text else "Sorry, I didn’t catch that. Could you try again?"
-        print("Gemini raw reply:", gemini_reply)
-
-        final_reply_to_user = gemini_reply
-
-        # --- NEW CODE FOR AMENDMENT STAGE ---
-        if state["stage"] == "awaiting_amendment" and "ranch/bbq pizza" in new_user_message.lower() and state["collected_special"]:
-            # Hardcoded example for now, should be generalized later
-            # Check if a new item has been added and a special request exists
-            last_item = state["structured_order"]["items"][-1] if state["structured_order"]["items"] else None
-            if last_item and last_item.get("size"):
-                final_reply_to_user = f"Alright! So that's one {SIZE_FULL_NAMES.get(last_item['size'], last_item['size']).upper()} {last_item['name']}. We previously noted a special request for '{state['collected_special']}'. Would you like these requests to apply to this new item as well?"
+        # Deterministic stage handlers run first; the model is only called when one needs generated text.
+        handler = STAGE_HANDLERS.get(state["stage"]) if final_reply_to_user is None else None
+        if handler is not None:
+            previous_state = state
+            final_reply_to_user, state = handler(state, new_user_message)
+            # The delivery handler hands back a fresh state once the order is complete.
+            if previous_state.get("stage") == "completed":
+                completed_order = _completed_order_record(previous_state)
+
+        history_tokens_saved = 0
+        cache_key = None
+        if final_reply_to_user is None and reply_cache is not None:
+            previous_reply = messages[-1].get("bot", "") if messages else ""
+            cache_key = reply_cache.key(state, new_user_message, static_prompt_key(), previous_reply)
+            if cache_key is not None:
+                final_reply_to_user = reply_cache.get(cache_key)
+                metrics.REPLY_CACHE_LOOKUPS.inc(result="miss" if final_reply_to_user is None else "hit")
+                if final_reply_to_user is not None:
+                    metrics.TURNS.inc(path="cache")
+                    metrics.LLM_CALLS_AVOIDED.inc(reason="cache")
+                    if stream:
+                        yield "delta", final_reply_to_user
+
+        if final_reply_to_user is None:
+            admitted_at = admission.acquire(state["stage"], deadline)
+            if admitted_at is None:
+                # Over quota, or queued past the turn's deadline: answer now instead of timing out.
+                metrics.TURNS.inc(path="shed")
+                metrics.LLM_CALLS_AVOIDED.inc(reason="shed")
+                final_reply_to_user = degraded_reply(state)
             else:
-                 final_reply_to_user = gemini_reply
-
-        elif state["stage"] == "awaiting_item_details":
-            item_for_clarification = None
-            for current_check_idx in range(state["clarification_index"], len(state["structured_order"]["items"])):
-                potential_item = state["structured_order"]["items"][current_check_idx]
-                menu_item_details = find_item(potential_item["category"], potential_item["id"])
-
-                if menu_item_details and \
-                   potential_item["category"] not in ["drinks"] and \
-                   "sizes" in menu_item_details and \
-                   len(menu_item_details["sizes"]) > 1 and \
-                   "size" not in potential_item:
-                    item_for_clarification = potential_item
-                    state["clarification_index"] = current_check_idx
-                    break
-            
-            if item_for_clarification is None:
-                state["stage"] = "awaiting_special_requests"
-                state["clarification_index"] = 0 
-                # --- NEW LOGIC: MANUALLY GENERATE RESPONSE ---
-                final_reply_to_user = "Wonderful! Now that we have all the details, do you have any special requests? For example, dietary needs (e.g., vegan, halal, gluten-free) or modifications (e.g., extra cheese, no onions)?"
-            else:
-                menu_item_details = find_item(item_for_clarification["category"], item_for_clarification["id"])
-                if not menu_item_details:
-                    final_reply_to_user = "I'm having trouble finding details for that item. Can you please specify which item you're referring to?"
-                else:
-                    available_size_options_raw = [s["size"].lower() for s in menu_item_details.get("sizes", [])]
-                    size_found = None
-
-                    if not new_user_message.startswith("The customer has finished selecting items from the menu.") and \
-                       new_user_message.lower() not in ["yes", "ok", "confirm", "that's all", "no", "none"]:
-                        for size_opt in available_size_options_raw:
-                            if size_opt in new_user_message.lower():
-                                size_found = size_opt
-                                break
-
-                    if size_found:
-                        state["structured_order"]["items"][state["clarification_index"]]["size"] = size_found
-                        state["clarification_index"] += 1
-
-                        next_item_to_ask = None
-                        for i in range(state["clarification_index"], len(state["structured_order"]["items"])):
-                            next_potential_item = state["structured_order"]["items"][i]
-                            next_menu_details = find_item(next_potential_item["category"], next_potential_item["id"])
-
-                            if next_menu_details and \
-                               "sizes" in next_menu_details and \
-                               len(next_menu_details["sizes"]) > 1 and \
-                               "size" not in next_potential_item:
-                                next_item_to_ask = next_potential_item
-                                state["clarification_index"] = i
-                                break
-
-                        if next_item_to_ask:
-                            next_menu_details = find_item(next_item_to_ask["category"], next_item_to_ask["id"])
-                            formatted_options = [SIZE_FULL_NAMES.get(s_opt['size'].lower(), s_opt['size']) for s_opt in next_menu_details.get('sizes', [])]
-                            options_str = ', '.join(formatted_options)
-                            
-                            final_reply_to_user = f"Got it! A {SIZE_FULL_NAMES.get(size_found, size_found).upper()} {item_for_clarification['name']}. And for the {next_item_to_ask['name']}, what size would you like? (Available: {options_str})"
-                        else:
-                            state["stage"] = "awaiting_special_requests"
-                            state["clarification_index"] = 0
-                            # --- NEW LOGIC: MANUALLY GENERATE RESPONSE ---
-                            final_reply_to_user = "Wonderful! Now that we have all the details, do you have any special requests? For example, dietary needs (e.g., vegan, halal, gluten-free) or modifications (e.g., extra cheese, no onions)?"
-
+                mode = "stream" if stream else "sync"
+                try:
+                    chat_history, history_tokens_saved = _build_chat_history(messages, new_user_message, state)
+                    # Whatever the queue left of the turn's deadline is the model's budget.
+                    timeout = min(llm_client.timeout, max(deadline - time.monotonic(), 0.1))
+                    started = time.perf_counter()
+                    if stream:
+                        streamed_parts = []
+                        for text in llm_client.stream(chat_history, timeout):
+                            streamed_parts.append(text)
+                            yield "delta", text
+                        final_reply_to_user = "".join(streamed_parts).strip() or FALLBACK_REPLY
                     else:
-                        formatted_options = [SIZE_FULL_NAMES.get(s_opt['size'].lower(), s_opt['size']) for s_opt in menu_item_details.get('sizes', [])]
-                        options_str = ', '.join(formatted_options)
-                        final_reply_to_user = f"Ah, bellissima! What size would you like for the {item_for_clarification['name']}? (Available: {options_str})"
-
-        elif state["stage"] == "awaiting_special_requests":
-            state["collected_special"] = new_user_message.strip()
-            state["stage"] = "awaiting_confirmation"
-            # --- MANUALLY GENERATE CONFIRMATION MESSAGE ---
-            order_summary = _get_order_summary_text(state["structured_order"], state["collected_special"], include_price=True)
-            
-            # This is the corrected, dynamic logic for the reply opener
-            if new_user_message.strip().lower() in ["no", "none", "n/a", "no special requests"]:
-                opener = "Okay, no special requests. Before we proceed, let me confirm your order:"
-            else:
-                opener = f"Okay, I've noted your request for '{new_user_message.strip()}'. Before we proceed, let me confirm your order:"
-
-            final_reply_to_user = f"{opener}\n\n{order_summary}\n\nDoes everything look correct?"
-
-        elif state["stage"] == "awaiting_confirmation":
-            if new_user_message.lower() in ["yes", "y", "correct", "confirm", "all correct", "that's correct"]:
-                state["collected_confirmation"] = True
-                state["stage"] = "awaiting_delivery_details"
-            else:
-                pass
-
-        elif state["stage"] == "awaiting_delivery_details":
-            extracted_name = re.search(r"my name is (.+?)(?:\.|$)", new_user_message, re.IGNORECASE)
-            extracted_phone = re.search(r"(?:\D|^)(\d{3}[-.\s]?\d{3}[-.\s]?\d{4})(?:\D|$)", new_user_message)
-            extracted_address = re.search(r"address is (.+?)(?:$|\.|\,)", new_user_message, re.IGNORECASE)
-
-            if extracted_name:
-                state["collected_name"] = extracted_name.group(1).strip()
-            if extracted_phone:
-                state["collected_phone"] = extracted_phone.group(1).strip()
-            if extracted_address:
-                 state["collected_address"] = extracted_address.group(1).strip()
-
-            if state["collected_name"] and state["collected_phone"] and state["collected_address"]:
-                state["stage"] = "completed"
-                order_summary_text = _get_order_summary_text(state["structured_order"], state["collected_special"], include_price=True)
-                
-                final_reply_to_user = (
-                    f"Thank you for your order, {state['collected_name']}!\n\n"
-                    f"Here is your full order summary:\n"
-                    f"{order_summary_text}\n\n"
-                    f"**Delivery to:** {state['collected_address']}\n"
-                    f"**Phone:** {state['collected_phone']}\n\n"
-                    "Your order is being prepared and will be delivered shortly. Enjoy your delicious meal!"
-                )
-
-                state = {
-                    "stage": "start",
-                    "structured_order": { "items": [] },
-                    "clarification_index": 0,
-                    "collected_special": None,
-                    "collected_confirmation": None,
-                    "collected_name": None,
-                    "collected_phone": None,
-                    "collected_address": None
-                }
-            else:
-                pass
-
-        else:
-            pass
-
-        print("Gemini formatted reply (after state logic):", final_reply_to_user)
-        return {
+                        final_reply_to_user = llm_client.generate_sync(chat_history, timeout) or FALLBACK_REPLY
+                    metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, mode=mode)
+                    metrics.TURNS.inc(path="model")
+                    logger.debug("Gemini raw reply: %r", final_reply_to_user)
+                    if cache_key is not None and final_reply_to_user != FALLBACK_REPLY:
+                        reply_cache.put(cache_key, final_reply_to_user)
+                except LLMUnavailable as e:
+                    metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, mode=mode)
+                    metrics.LLM_ERRORS.inc(mode=mode)
+                    metrics.TURNS.inc(path="degraded")
+                    logger.warning("Gemini unavailable, using degraded reply: %s", e)
+                    final_reply_to_user = degraded_reply(state)
+                finally:
+                    admission.release(admitted_at)
+        elif cache_key is None:
+            metrics.TURNS.inc(path="handler")
+            metrics.LLM_CALLS_AVOIDED.inc(reason="handler")
+
+        metrics.STAGE_TRANSITIONS.inc(from_stage=entry_stage, to_stage="completed" if completed_order is not None else state["stage"])
+        logger.debug("Formatted reply (after state logic): %r", final_reply_to_user)
+        result = {
             "reply": final_reply_to_user,
             "structured_order": state.get("structured_order"),
-            "state": state
+            "state": state,
+            "history_tokens_saved": history_tokens_saved
         }
+        if completed_order is not None:
+            result["completed_order"] = completed_order
+        yield "result", result
 
     except Exception as e:
-        print(f"Gemini API or processing error: {e}")
-        traceback.print_exc()
-        return {
+        logger.exception("Gemini API or processing error: %s", e)
+        metrics.TURNS.inc(path="error")
+        yield "result", {
             "reply": "I'm very sorry, but something went wrong on my end. Please try again shortly!",
             "structured_order": state.get("structured_order"),
             "state": state
-        }
\ No newline at end of file
+        }
+
+
+def generate_response(messages, new_user_message, current_state=None):
+    for event, payload in iter_response(messages, new_user_message, current_state):
+        if event == "result":
+            return payload
@@ -0,0 +1,427 @@
+import copy
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Whisper decodes fixed 30 second windows; clips up to this length can share one batched pass.
+BATCHABLE_SECONDS = 30
+SAMPLE_RATE = 16000
+# "int8" quantizes weights to 8-bit integers for faster CPU inference.
+QUANTIZE_MODES = ("none", "int8")
+
+
+# --- Backends ---
+# A backend exposes load() -> a model for one replica, preload() and transcribe_batch(model, audios)
+# -> texts. Both are plain attributes and methods, so backends pickle into process-mode replicas.
+
+# Models loaded in this process, by (backend, name, quantize). A model loaded before gunicorn
+# forks (see app.lifecycle.preload) is inherited by every worker and its weights shared copy-on-write.
+# Decoding keeps per-call state on the model (Whisper's KV-cache hooks), so each replica needs its
+# own: the first replica in a process takes the cached instance and later ones get a private copy.
+_models = {}
+_claimed_models = set()
+_claimed_pid = None
+_models_lock = threading.Lock()
+
+def _cached_model(key, build):
+    """The process-wide model for `key`, built on first use."""
+    with _models_lock:
+        model = _models.get(key)
+        if model is None:
+            model = _models[key] = build()
+        return model
+
+
+def _replica_model(key, build, clone=copy.deepcopy):
+    """A model owned by one replica: the cached instance for the first replica in this process, else clone(it)."""
+    global _claimed_pid
+    model = _cached_model(key, build)
+    with _models_lock:
+        if _claimed_pid != os.getpid():
+            # Claims made before a fork belong to the parent's replicas.
+            _claimed_models.clear()
+            _claimed_pid = os.getpid()
+        if key not in _claimed_models:
+            _claimed_models.add(key)
+            return model
+    return clone(model)
+
+def _quantize_int8(model):
+    """Dynamic int8 quantization of Whisper's linear layers (CPU only)."""
+    import torch
+    import whisper.model
+
+    for module in model.modules():
+        # Whisper's Linear only adds a dtype cast in forward(); as a plain nn.Linear
+        # it matches quantize_dynamic's module mapping.
+        if type(module) is whisper.model.Linear:
+            module.__class__ = torch.nn.Linear
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _build_whisper_model(model_name, quantize):
+    import whisper
+    if quantize == "int8":
+        return _quantize_int8(whisper.load_model(model_name, device="cpu"))
+    return whisper.load_model(model_name)
+
+
+def load_whisper_model(model_name="base", quantize="none"):
+    """The process-wide Whisper model; replicas take theirs through WhisperBackend.load()."""
+    return _cached_model(("whisper", model_name, quantize), partial(_build_whisper_model, model_name, quantize))
+
+
+def whisper_transcribe_batch(model, audios, language=None, beam_size=1):
+    """
+    Transcribes a list of audio file paths or float32 16 kHz arrays.
+
+    Clips of up to 30 seconds are decoded together in one batched decoder
+    pass; longer clips fall back to model.transcribe() one at a time.
+    A beam_size of 1 decodes greedily.
+    """
+    import numpy as np
+    import torch
+    import whisper
+
+    arrays = [whisper.load_audio(a) if isinstance(a, str) else a for a in audios]
+    texts = [None] * len(arrays)
+    fp16 = model.device.type != "cpu"
+    beam_size = beam_size if beam_size > 1 else None
+
+    short = [i for i, audio in enumerate(arrays) if len(audio) <= BATCHABLE_SECONDS * SAMPLE_RATE]
+    if short:
+        n_mels = getattr(model.dims, "n_mels", 80)
+        mels = np.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(arrays[i]), n_mels=n_mels).cpu().numpy()
+            for i in short
+        ])
+        mel_batch = torch.from_numpy(mels).to(model.device)
+        # Only the text is used, so skip predicting timestamp tokens.
+        options = whisper.DecodingOptions(language=language, beam_size=beam_size, without_timestamps=True, fp16=fp16)
+        results = whisper.decode(model, mel_batch, options)
+        for i, result in zip(short, results):
+            texts[i] = result.text
+
+    for i, audio in enumerate(arrays):
+        if texts[i] is None:
+            texts[i] = model.transcribe(audio, language=language, beam_size=beam_size, fp16=fp16)["text"]
+    return texts
+
+
+class WhisperBackend:
+    """
+    openai-whisper on PyTorch.
+
+    `quantize="int8"` loads the model on the CPU and quantizes its linear
+    layers dynamically. `threads` sets PyTorch's intra-op thread count for the
+    process (None keeps PyTorch's default of one per core).
+    """
+
+    name = "whisper"
+
+    def __init__(self, model_size="base", quantize="none", threads=None, beam_size=1, language=None):
+        if quantize not in QUANTIZE_MODES:
+            raise ValueError(f"Unsupported ASR quantization: {quantize}")
+        self.model_size = model_size
+        self.quantize = quantize
+        self.threads = threads
+        self.beam_size = beam_size
+        self.language = language
+
+    def preload(self):
+        """Loads the shared model without claiming it for a replica (see app.lifecycle.preload)."""
+        load_whisper_model(self.model_size, self.quantize)
+
+    def load(self):
+        if self.threads:
+            import torch
+            torch.set_num_threads(self.threads)
+        return _replica_model(("whisper", self.model_size, self.quantize), partial(_build_whisper_model, self.model_size, self.quantize))
+
+    def transcribe_batch(self, model, audios):
+        return whisper_transcribe_batch(model, audios, language=self.language, beam_size=self.beam_size)
+
+
+class FasterWhisperBackend(WhisperBackend):
+    """
+    faster-whisper (CTranslate2), an optional install. `quantize="int8"` runs its
+    int8 CPU kernels; `threads` is CTranslate2's cpu_threads (None lets it choose).
+    """
+
+    name = "faster-whisper"
+
+    def _key(self):
+        return (self.name, self.model_size, self.quantize, self.threads)
+
+    def _build(self):
+        from faster_whisper import WhisperModel
+        return WhisperModel(
+            self.model_size, device="cpu",
+            compute_type="int8" if self.quantize == "int8" else "float32",
+            cpu_threads=self.threads or 0
+        )
+
+    def preload(self):
+        _cached_model(self._key(), self._build)
+
+    def load(self):
+        # CTranslate2 models cannot be deep-copied; later replicas load their own.
+        return _replica_model(self._key(), self._build, clone=lambda _: self._build())
+
+    def transcribe_batch(self, model, audios):
+        texts = []
+        for audio in audios:
+            segments, _ = model.transcribe(audio, language=self.language, beam_size=self.beam_size, without_timestamps=True)
+            texts.append("".join(segment.text for segment in segments))
+        return texts
+
+
+ASR_BACKENDS = {backend.name: backend for backend in (WhisperBackend, FasterWhisperBackend)}
+
+
+class FakeTranscriber:
+    """
+    Deterministic stand-in for Whisper: sleeps `latency` seconds per batch and
+    returns `text` for every clip. Picklable, so it also works in process mode.
+    """
+
+    name = "fake"
+
+    def __init__(self, text="two large hawaiian pizzas", latency=0.0):
+        self.text = text
+        self.latency = latency
+
+    def __call__(self, model, audios):
+        if self.latency:
+            time.sleep(self.latency)
+        return [self.text for _ in audios]
+
+    def preload(self):
+        pass
+
+    def load(self):
+        return None
+
+    transcribe_batch = __call__
+
+
+# --- Process Replicas ---
+# In process mode each replica thread forwards batches to a single-worker process
+# that loaded its own model in the initializer.
+
+_process_model = None
+_process_transcribe_batch = None
+
+def _init_process_replica(model_loader, transcribe_batch):
+    global _process_model, _process_transcribe_batch
+    _process_model = model_loader()
+    _process_transcribe_batch = transcribe_batch
+
+def _run_process_batch(audios):
+    return _process_transcribe_batch(_process_model, audios)
+
+
+class _Job:
+    __slots__ = ("audio", "future", "enqueued_at")
+
+    def __init__(self, audio):
+        self.audio = audio
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class ASRWorkerPool:
+    """
+    Speech-to-text workers fed from one request queue.
+
+    Each of `replicas` workers owns a model (in a thread, or in its own
+    process with mode="process"). A worker takes the oldest job, waits up to
+    `batch_window` seconds for more to arrive, and transcribes up to
+    `max_batch` clips in one pass. submit() returns a Future with the text.
+    """
+
+    def __init__(self, model_loader, transcribe_batch=whisper_transcribe_batch, replicas=1, mode="thread",
+                 max_batch=8, batch_window=0.02, warm_up_audio=None):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unsupported ASR worker mode: {mode}")
+        self.model_loader = model_loader
+        self.transcribe_batch = transcribe_batch
+        self.replicas = replicas
+        self.mode = mode
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.warm_up_audio = warm_up_audio
+
+        self._queue = queue.Queue()
+        self._latencies = deque(maxlen=1000)
+        self._stats = {"completed": 0, "failed": 0, "batches": 0, "in_flight": 0, "ready_replicas": 0}
+        self._stats_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._workers = []
+        for i in range(replicas):
+            worker = threading.Thread(target=self._worker_loop, name=f"asr-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, audio):
+        """Queues a file path or float32 16 kHz array; returns a Future resolving to the transcript."""
+        job = _Job(audio)
+        self._queue.put(job)
+        return job.future
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+            latencies = sorted(self._latencies)
+        snapshot["queue_depth"] = self._queue.qsize()
+        snapshot["replicas"] = self.replicas
+        snapshot["avg_batch_size"] = round((snapshot["completed"] + snapshot["failed"]) / snapshot["batches"], 2) if snapshot["batches"] else 0.0
+        for label, pct in (("latency_p50_ms", 0.50), ("latency_p95_ms", 0.95), ("latency_p99_ms", 0.99)):
+            snapshot[label] = round(latencies[min(int(pct * len(latencies)), len(latencies) - 1)] * 1000, 1) if latencies else None
+        return snapshot
+
+    def shutdown(self, wait=True):
+        self._stopping.set()
+        for _ in self._workers:
+            self._queue.put(None)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def _next_batch(self):
+        job = self._queue.get()
+        if job is None:
+            return None
+        batch = [job]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                # Leave the shutdown marker for this worker's next loop.
+                self._queue.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _worker_loop(self):
+        executor = None
+        load_error = None
+        try:
+            if self.mode == "process":
+                executor = ProcessPoolExecutor(
+                    max_workers=1,
+                    initializer=_init_process_replica,
+                    initargs=(self.model_loader, self.transcribe_batch)
+                )
+                run_batch = lambda audios: executor.submit(_run_process_batch, audios).result()
+            else:
+                model = self.model_loader()
+                run_batch = lambda audios: self.transcribe_batch(model, audios)
+            if self.warm_up_audio is not None:
+                # The first inference pays for kernel selection and buffer allocation; do it before real jobs.
+                started = time.perf_counter()
+                run_batch([self.warm_up_audio])
+                logger.info("ASR replica warmed up in %.2fs", time.perf_counter() - started)
+            with self._stats_lock:
+                self._stats["ready_replicas"] += 1
+        except Exception as e:
+            logger.error("ASR worker failed to load model: %s", e)
+            run_batch = None
+            load_error = e
+
+        while not self._stopping.is_set():
+            batch = self._next_batch()
+            if batch is None:
+                break
+
+            with self._stats_lock:
+                self._stats["in_flight"] += len(batch)
+            try:
+                if run_batch is None:
+                    raise load_error
+                started = time.perf_counter()
+                texts = run_batch([job.audio for job in batch])
+                metrics.WHISPER_DECODE_SECONDS.observe(time.perf_counter() - started, batch_size=len(batch))
+                outcome = "completed"
+            except Exception as e:
+                texts = None
+                error = e
+                outcome = "failed"
+
+            now = time.monotonic()
+            with self._stats_lock:
+                self._stats["in_flight"] -= len(batch)
+                self._stats["batches"] += 1
+                self._stats[outcome] += len(batch)
+                self._latencies.extend(now - job.enqueued_at for job in batch)
+
+            for i, job in enumerate(batch):
+                if texts is not None:
+                    job.future.set_result(texts[i])
+                else:
+                    job.future.set_exception(error)
+
+        if executor is not None:
+            executor.shutdown()
+
+
+def create_asr_backend():
+    """
+    The backend selected by ASR_BACKEND (whisper, faster-whisper or fake), configured from
+    ASR_MODEL (model size, e.g. tiny.en or base), ASR_QUANTIZE (none or int8), ASR_THREADS
+    (0 = library default), ASR_BEAM_SIZE (1 = greedy) and ASR_LANGUAGE (unset = detect).
+    """
+    name = os.environ.get("ASR_BACKEND", "whisper")
+    if name == "fake":
+        return FakeTranscriber(
+            text=os.environ.get("ASR_FAKE_TEXT", "two large hawaiian pizzas"),
+            latency=float(os.environ.get("ASR_FAKE_LATENCY_MS", 0)) / 1000
+        )
+    if name not in ASR_BACKENDS:
+        raise ValueError(f"Unsupported ASR backend: {name}")
+    return ASR_BACKENDS[name](
+        model_size=os.environ.get("ASR_MODEL", "base"),
+        quantize=os.environ.get("ASR_QUANTIZE", "none"),
+        threads=int(os.environ.get("ASR_THREADS", 0)) or None,
+        beam_size=int(os.environ.get("ASR_BEAM_SIZE", 1)),
+        language=os.environ.get("ASR_LANGUAGE") or None
+    )
+
+
+def asr_backend():
+    """(model_loader, transcribe_batch) of the configured backend."""
+    backend = create_asr_backend()
+    return backend.load, backend.transcribe_batch
+
+
+def create_asr_pool():
+    """Builds the pool from ASR_* environment variables; see create_asr_backend() for the model settings."""
+    model_loader, transcribe_batch = asr_backend()
+
+    warm_up_audio = None
+    if os.environ.get("ASR_WARM_UP", "1") == "1":
+        import numpy as np
+        warm_up_audio = np.zeros(SAMPLE_RATE, dtype=np.float32)
+
+    return ASRWorkerPool(
+        model_loader,
+        transcribe_batch=transcribe_batch,
+        replicas=int(os.environ.get("ASR_REPLICAS", 1)),
+        mode=os.environ.get("ASR_WORKER_MODE", "thread"),
+        max_batch=int(os.environ.get("ASR_MAX_BATCH", 8)),
+        batch_window=float(os.environ.get("ASR_BATCH_WINDOW_MS", 20)) / 1000,
+        warm_up_audio=warm_up_audio
+    )
@@ -0,0 +1,69 @@
+import functools
+import gzip
+import hashlib
+import json
+import os
+
+from .menu_catalog import CATALOG
+
+try:
+    import brotli
+except ImportError:  # gzip is always available; brotli is used when installed
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+
+# Fingerprinted and versioned URLs never change content, so clients may keep them for a year.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Unversioned URLs are revalidated with the ETag on every use.
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+# --- Menu ---
+
+class MenuPayload:
+    """The menu serialized once per menu version, with its gzip and brotli encodings."""
+
+    def __init__(self, catalog):
+        self.version = catalog.version
+        self.etag = f"menu-{catalog.version}"
+        body = json.dumps(catalog.data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        self.bodies = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(body, quality=11)
+
+    def negotiate(self, accept_encoding):
+        """(encoding, body) for the smallest encoding the client accepts."""
+        accepted = set()
+        for part in (accept_encoding or "").split(","):
+            name, _, params = part.partition(";")
+            if params.replace(" ", "").lower() not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                accepted.add(name.strip().lower())
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.bodies:
+                return encoding, self.bodies[encoding]
+        return "identity", self.bodies["identity"]
+
+
+@functools.lru_cache(maxsize=2)
+def _menu_payload(menu_version):
+    return MenuPayload(CATALOG)
+
+def menu_payload():
+    return _menu_payload(CATALOG.version)
+
+
+# --- Static Files ---
+
+@functools.lru_cache(maxsize=64)
+def _fingerprint(path, mtime):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:10]
+
+def static_fingerprint(filename):
+    """Short content hash of a file under static/, or None if it does not exist."""
+    path = os.path.join(STATIC_DIR, filename)
+    try:
+        return _fingerprint(path, os.path.getmtime(path))
+    except OSError:
+        return None
@@ -0,0 +1,182 @@
+import io
+import os
+import subprocess
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+# RMS energy (full scale = 1.0) below which a frame is never speech
+VAD_MIN_ENERGY = float(os.environ.get("VAD_MIN_ENERGY", 0.01))
+
+
+def pcm16_to_float32(data):
+    """Little-endian 16-bit PCM bytes -> float32 samples in [-1, 1]."""
+    return np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0
+
+
+def decode_audio_bytes(data, sample_rate=SAMPLE_RATE):
+    """
+    Decodes an uploaded audio file in memory to mono float32 samples at `sample_rate`.
+
+    16-bit PCM WAV at the target rate is parsed directly; anything else
+    (e.g. the browser's webm/opus recordings) is piped through ffmpeg
+    without touching the disk.
+    """
+    if data[:4] == b"RIFF":
+        try:
+            with wave.open(io.BytesIO(data)) as wav:
+                if wav.getsampwidth() == 2 and wav.getframerate() == sample_rate:
+                    samples = pcm16_to_float32(wav.readframes(wav.getnframes()))
+                    channels = wav.getnchannels()
+                    return samples.reshape(-1, channels).mean(axis=1) if channels > 1 else samples
+        except wave.Error:
+            pass
+
+    result = subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0", "-i", "pipe:0",
+         "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate), "pipe:1"],
+        input=data,
+        capture_output=True,
+        check=True
+    )
+    return pcm16_to_float32(result.stdout)
+
+
+def trim_silence(samples, vad=None, margin_ms=150):
+    """
+    Cuts leading and trailing non-speech, keeping `margin_ms` around the speech.
+
+    Returns (trimmed samples, seconds removed). Audio in which no speech is
+    detected (e.g. a quiet microphone) is returned untrimmed for Whisper to judge.
+    """
+    vad = vad or EnergyVAD()
+    flags = vad.speech_frames(samples)
+    speech = np.flatnonzero(flags)
+    if len(speech) == 0:
+        return samples, 0.0
+
+    margin = int(vad.sample_rate * margin_ms / 1000)
+    start = max(speech[0] * vad.frame_length - margin, 0)
+    end = min((speech[-1] + 1) * vad.frame_length + margin, len(samples))
+    return samples[start:end], (len(samples) - (end - start)) / vad.sample_rate
+
+
+def frame_energies(samples, frame_length):
+    """RMS energy of each complete frame of `frame_length` samples."""
+    n_frames = len(samples) // frame_length
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = samples[:n_frames * frame_length].reshape(n_frames, frame_length)
+    return np.sqrt(np.mean(frames * frames, axis=1))
+
+
+class EnergyVAD:
+    """
+    Energy-based voice activity detection over fixed frames.
+
+    A frame is speech when its RMS energy exceeds both `min_energy` and
+    `noise_ratio` times the running noise-floor estimate. The noise floor
+    follows non-speech frames, so the detector adapts to the microphone.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, frame_ms=30, min_energy=None, noise_ratio=3.0, noise_smoothing=0.95):
+        self.sample_rate = sample_rate
+        self.frame_length = int(sample_rate * frame_ms / 1000)
+        self.min_energy = VAD_MIN_ENERGY if min_energy is None else min_energy
+        self.noise_ratio = noise_ratio
+        self.noise_smoothing = noise_smoothing
+        self.noise_floor = self.min_energy / noise_ratio
+
+    def is_speech(self, energy):
+        speech = energy > max(self.min_energy, self.noise_ratio * self.noise_floor)
+        if not speech:
+            self.noise_floor = self.noise_smoothing * self.noise_floor + (1 - self.noise_smoothing) * energy
+        return speech
+
+    def speech_frames(self, samples):
+        """Boolean speech flag per complete frame of `samples`."""
+        return np.array([self.is_speech(e) for e in frame_energies(samples, self.frame_length)], dtype=bool)
+
+
+class UtteranceDetector:
+    """
+    Splits a live audio stream into utterances.
+
+    feed() takes float32 chunks of any length and returns the completed
+    utterances (float32 arrays). An utterance ends after `end_silence_ms` of
+    non-speech; `pre_roll_ms` of audio before speech onset is kept so the
+    first syllable is not clipped, and bursts shorter than `min_speech_ms`
+    are discarded as noise.
+    """
+
+    def __init__(self, vad=None, end_silence_ms=700, pre_roll_ms=200, min_speech_ms=250, max_utterance_s=30):
+        self.vad = vad or EnergyVAD()
+        frame_ms = 1000 * self.vad.frame_length / self.vad.sample_rate
+        self.end_silence_frames = max(int(end_silence_ms / frame_ms), 1)
+        self.pre_roll_frames = int(pre_roll_ms / frame_ms)
+        self.min_speech_frames = max(int(min_speech_ms / frame_ms), 1)
+        self.max_utterance_frames = int(max_utterance_s * 1000 / frame_ms)
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._pre_roll = []
+        self._utterance = []
+        self._speech_frames = 0
+        self._silence_run = 0
+
+    @property
+    def in_speech(self):
+        return bool(self._utterance)
+
+    def current_utterance(self):
+        """Audio of the utterance in progress (empty when not in speech)."""
+        return np.concatenate(self._utterance) if self._utterance else np.zeros(0, dtype=np.float32)
+
+    def feed(self, samples):
+        completed = []
+        samples = np.concatenate([self._pending, samples]) if len(self._pending) else samples
+        frame_length = self.vad.frame_length
+        n_frames = len(samples) // frame_length
+        self._pending = samples[n_frames * frame_length:]
+
+        for i in range(n_frames):
+            frame = samples[i * frame_length:(i + 1) * frame_length]
+            speech = self.vad.is_speech(float(np.sqrt(np.mean(frame * frame))))
+
+            if not self._utterance:
+                if speech:
+                    self._utterance = self._pre_roll + [frame]
+                    self._pre_roll = []
+                    self._speech_frames = 1
+                    self._silence_run = 0
+                else:
+                    self._pre_roll.append(frame)
+                    if len(self._pre_roll) > self.pre_roll_frames:
+                        self._pre_roll.pop(0)
+                continue
+
+            self._utterance.append(frame)
+            if speech:
+                self._speech_frames += 1
+                self._silence_run = 0
+            else:
+                self._silence_run += 1
+
+            if self._silence_run >= self.end_silence_frames or len(self._utterance) >= self.max_utterance_frames:
+                utterance = self.flush()
+                if utterance is not None:
+                    completed.append(utterance)
+        return completed
+
+    def flush(self):
+        """Ends the utterance in progress; returns its audio, or None if it was too short to be speech."""
+        utterance, speech_frames = self._utterance, self._speech_frames
+        # Keep a pre-roll's worth of the closing silence and drop the rest.
+        trailing_silence = max(self._silence_run - self.pre_roll_frames, 0)
+        if trailing_silence:
+            utterance = utterance[:-trailing_silence]
+        self._utterance = []
+        self._speech_frames = 0
+        self._silence_run = 0
+        if not utterance or speech_frames < self.min_speech_frames:
+            return None
+        return np.concatenate(utterance)
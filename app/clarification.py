@@ -0,0 +1,212 @@
+import copy
+import functools
+import json
+import re
+
+from .menu_catalog import CATALOG
+from .order_parser import SIZE_FULL_NAMES
+
+# The client sends every answer at once as a chat message of this type.
+SUBMISSION_TYPE = "item_options_submitted"
+
+# Line-item keys the form fills in, in the order they are shown.
+FIELD_LABELS = {
+    "size": "Size",
+    "crust": "Crust",
+    "protein": "Protein",
+    "sauce": "Sauce",
+    "addons": "Add-ons"
+}
+# Fields without a value here must be answered before the order can move on.
+FIELD_DEFAULTS = {"crust": "normal", "addons": []}
+
+
+# --- Form Fields ---
+
+def _choice(value, label, price=None):
+    option = {"value": value, "label": label}
+    if price is not None:
+        option["price"] = price
+    return option
+
+
+def _item_fields(category, item):
+    """Every option field an item offers, as {field name: field spec}."""
+    fields = {}
+    sizes = item.get("sizes", [])
+    if len(sizes) > 1:
+        fields["size"] = {
+            "type": "choice",
+            "options": [_choice(s["size"].lower(), SIZE_FULL_NAMES.get(s["size"].lower(), s["size"]), s["price"]) for s in sizes]
+        }
+
+    crusts = []
+    for size in sizes:
+        crusts.extend(crust for crust in size.get("crust", []) if crust not in crusts)
+    if crusts:
+        gluten_free = CATALOG.data.get("gluten_free_options", {}).get("pizza_crust", {})
+        options = [_choice(crust, crust.capitalize(), 0) for crust in crusts]
+        if gluten_free.get("available", False):
+            options.append(_choice("gluten-free", "Gluten-free", gluten_free.get("price_adjustment", 0)))
+        fields["crust"] = {"type": "choice", "options": options}
+
+    for field, key in (("protein", "protein_options"), ("sauce", "sauce_options")):
+        if item.get(key):
+            fields[field] = {
+                "type": "choice",
+                "options": [_choice(option["name"], option["name"].capitalize(), option.get("price_adjustment", 0)) for option in item[key]]
+            }
+
+    if category == "pastas" and item.get("add_ons"):
+        fields["addons"] = {
+            "type": "multi",
+            "options": [_choice(addon["name"], addon["name"].capitalize(), addon["price"]) for addon in item["add_ons"]]
+        }
+
+    for name, spec in fields.items():
+        spec.update(name=name, label=FIELD_LABELS[name], required=name not in FIELD_DEFAULTS, default=FIELD_DEFAULTS.get(name))
+    return fields
+
+
+@functools.lru_cache(maxsize=2)
+def _fields_for_version(menu_version):
+    return {key: _item_fields(key[0], item) for key, item in CATALOG.items()}
+
+def item_fields(category, item_id):
+    """Option fields for a menu item, computed once per menu version."""
+    return _fields_for_version(CATALOG.version).get((category, item_id), {})
+
+
+# --- Form Spec ---
+
+def build_form(structured_order, errors=None):
+    """
+    A form asking for every option still missing across the whole order, or
+    None when no required option is missing and there are no errors to show.
+
+    Each entry names the line by `index` and lists only its unanswered fields;
+    `errors` ({(index, field): message}) from a rejected submission are
+    attached to their fields.
+    """
+    errors = errors or {}
+    form_items = []
+    needs_answer = False
+    for index, line in enumerate(structured_order.get("items", [])):
+        missing = [
+            dict(spec, error=errors.get((index, name)))
+            for name, spec in item_fields(line.get("category"), line.get("id")).items()
+            if name not in line or (index, name) in errors
+        ]
+        if not missing:
+            continue
+        needs_answer = needs_answer or any(field["required"] for field in missing)
+        form_items.append({"index": index, "id": line.get("id"), "name": line.get("name"), "quantity": line.get("quantity", 1), "fields": missing})
+    if not needs_answer and not errors:
+        return None
+    return {"type": "item_options", "menu_version": CATALOG.version, "items": form_items}
+
+
+def first_required(form):
+    """(form item, its required fields) for the first line still missing a required option, or None."""
+    for form_item in (form or {}).get("items", []):
+        required = [field for field in form_item["fields"] if field["required"]]
+        if required:
+            return form_item, required
+    return None
+
+
+# --- Typed Answers ---
+
+def fill_typed_options(structured_order, message):
+    """
+    Fills required choice options (e.g. protein, sauce) named in a typed reply
+    such as "shrimp with bbq sauce", each into the first line still missing
+    it. Sizes are left to the size questions. Returns the fields filled.
+    """
+    text = message.lower()
+    filled = []
+    for index, line in enumerate(structured_order.get("items", [])):
+        for name, spec in item_fields(line.get("category"), line.get("id")).items():
+            if name == "size" or name in line or not spec["required"] or spec["type"] != "choice" or name in filled:
+                continue
+            mentioned = []
+            for option in spec["options"]:
+                match = re.search(rf"\b{re.escape(option['value'].lower())}\b", text)
+                if match:
+                    mentioned.append((match.start(), option["value"]))
+            if mentioned:
+                line[name] = min(mentioned)[1]
+                filled.append(name)
+    return filled
+
+
+# --- Submission ---
+
+def parse_submission(message):
+    """The answers list from a form submission message, or None for any other message."""
+    if not message.startswith("{"):
+        return None
+    try:
+        parsed = json.loads(message)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(parsed, dict) or parsed.get("type") != SUBMISSION_TYPE:
+        return None
+    answers = parsed.get("items")
+    return answers if isinstance(answers, list) else []
+
+
+def _validate(spec, value):
+    """The canonical value for an answer, or raises ValueError with a message."""
+    allowed = {option["value"].lower(): option["value"] for option in spec["options"]}
+    if spec["type"] == "multi":
+        if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            raise ValueError(f"{spec['label']} must be a list of choices")
+        unknown = [v for v in value if v.lower() not in allowed]
+        if unknown:
+            raise ValueError(f"{spec['label']}: {', '.join(unknown)} not available")
+        return list(dict.fromkeys(allowed[v.lower()] for v in value))
+    if not isinstance(value, str) or value.lower() not in allowed:
+        raise ValueError(f"{spec['label']} must be one of: {', '.join(option['label'] for option in spec['options'])}")
+    return allowed[value.lower()]
+
+
+def apply_answers(structured_order, answers):
+    """
+    Validates a whole form submission against the menu.
+
+    Returns (items, errors). On success `items` is a copy of the order's items
+    with the answers and defaults filled in and `errors` is empty; otherwise
+    `items` is None and `errors` maps (index, field) to a message. Either every
+    answer is applied or none is.
+    """
+    items = copy.deepcopy(structured_order.get("items", []))
+    errors = {}
+    for answer in answers:
+        index = answer.get("index") if isinstance(answer, dict) else None
+        if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < len(items):
+            errors[(index if isinstance(index, int) else -1, "item")] = "Unknown item in the submitted options"
+            continue
+        line = items[index]
+        fields = item_fields(line.get("category"), line.get("id"))
+        for name, value in answer.items():
+            if name == "index":
+                continue
+            if name not in fields:
+                errors[(index, name)] = f"{line.get('name')} has no {name} option"
+                continue
+            try:
+                line[name] = _validate(fields[name], value)
+            except ValueError as e:
+                errors[(index, name)] = str(e)
+
+    for index, line in enumerate(items):
+        for name, spec in item_fields(line.get("category"), line.get("id")).items():
+            if name in line or (index, name) in errors:
+                continue
+            if spec["required"]:
+                errors[(index, name)] = f"Please choose a {spec['label'].lower()} for the {line.get('name')}"
+            else:
+                line[name] = copy.copy(spec["default"])
+
+    return (None, errors) if errors else (items, {})
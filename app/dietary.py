@@ -0,0 +1,173 @@
+import functools
+import re
+
+from .menu_catalog import CATALOG
+from .order_parser import ORDER_CATEGORIES
+
+# Customer restrictions: ("tag", t) keeps items tagged t in their "dietary" list;
+# ("free_of", a) keeps items without allergen a in their "allergens" list.
+RESTRICTIONS = {
+    "vegan": ("tag", "vegan"),
+    "vegetarian": ("tag", "vegetarian"),
+    "halal": ("tag", "halal"),
+    "gluten-free": ("free_of", "gluten"),
+    "dairy-free": ("free_of", "dairy"),
+    "nut-free": ("free_of", "nuts"),
+    "shellfish-free": ("free_of", "shellfish"),
+    "pork-free": ("free_of", "pork"),
+    "alcohol-free": ("free_of", "alcohol")
+}
+
+RESTRICTION_PATTERNS = {
+    "vegan": r"\bvegan",
+    "vegetarian": r"\bvegetarian|\bveggie\b|\bno meat\b|\bmeat[- ]?free\b",
+    "halal": r"\bhalal\b",
+    "gluten-free": r"\bgluten\b|\bcoeliac\b|\bceliac\b",
+    "dairy-free": r"\bdairy\b|\blactose\b|\bmilk allerg",
+    "nut-free": r"\bnuts?\b|\bnut[- ]?free\b|\bpeanuts?\b|\bnut allerg",
+    "shellfish-free": r"\bshellfish\b|\bshrimp allerg|\bseafood allerg|\bno shrimp\b|\bno seafood\b",
+    "pork-free": r"\bpork\b|\bham\b|\bbacon\b",
+    "alcohol-free": r"\balcohol|\bnon[- ]?alcoholic\b"
+}
+_RESTRICTION_REGEXES = {name: re.compile(pattern, re.IGNORECASE) for name, pattern in RESTRICTION_PATTERNS.items()}
+
+# A vegan item is also vegetarian.
+TAG_IMPLIES = {"vegan": ("vegetarian",)}
+
+_CATEGORY_PATTERNS = {
+    "pizzas": re.compile(r"\bpizzas?\b", re.IGNORECASE),
+    "pastas": re.compile(r"\bpastas?\b|\bfettuccine\b", re.IGNORECASE),
+    "drinks": re.compile(r"\bdrinks?\b|\bbeverages?\b|\bsodas?\b|\bcoffee\b", re.IGNORECASE)
+}
+
+
+class DietaryIndex:
+    """
+    Allergen and dietary tags compiled into bitsets over menu items.
+
+    Bit i stands for item i. `tags[t]` and `allergens[a]` hold the items with
+    tag t or allergen a, so a compound query is a few integer ANDs and ORs.
+    `gluten_free_on_request` holds items the kitchen can make without gluten
+    (gluten-free crust or pasta substitute from gluten_free_options).
+    An item's declared allergens always apply; `option_allergens` holds the
+    extra allergens of its protein and add-on options, which check_order adds
+    for the options a line chose.
+    """
+
+    def __init__(self, catalog):
+        self.version = catalog.version
+        self.keys = [key for key, _ in catalog.items() if key[0] in ORDER_CATEGORIES]
+        self.names = [catalog.item(*key)["name"] for key in self.keys]
+        self.bit = {key: 1 << i for i, key in enumerate(self.keys)}
+        self.all_items = (1 << len(self.keys)) - 1
+
+        self.tags = {}
+        self.allergens = {}
+        self.categories = {}
+        self.option_allergens = {}  # (category, id) -> {protein or add-on name: allergens}, for items whose options carry any
+        self.item_allergens = {}  # (category, id) -> declared allergens, for the same items
+        for key in self.keys:
+            item, bit = catalog.item(*key), self.bit[key]
+            self.categories[key[0]] = self.categories.get(key[0], 0) | bit
+            for tag in item.get("dietary", []):
+                for implied in (tag,) + TAG_IMPLIES.get(tag, ()):
+                    self.tags[implied] = self.tags.get(implied, 0) | bit
+            for allergen in item.get("allergens", []):
+                self.allergens[allergen] = self.allergens.get(allergen, 0) | bit
+            options = {option["name"]: frozenset(option["allergens"])
+                       for option in item.get("protein_options", []) + item.get("add_ons", []) if option.get("allergens")}
+            if options:
+                self.option_allergens[key] = options
+                self.item_allergens[key] = frozenset(item.get("allergens", []))
+
+        gluten_free = catalog.data.get("gluten_free_options", {})
+        self.gluten_free_on_request = 0
+        for category, option in (("pizzas", "pizza_crust"), ("pastas", "pasta")):
+            if gluten_free.get(option, {}).get("available", False):
+                self.gluten_free_on_request |= self.categories.get(category, 0) & self.allergens.get("gluten", 0)
+
+    def allowed(self, restriction):
+        """Bitset of items that meet one restriction."""
+        kind, value = RESTRICTIONS[restriction]
+        if kind == "tag":
+            return self.tags.get(value, 0)
+        return self.all_items & ~self.allergens.get(value, 0)
+
+    def matching(self, restrictions, categories=None):
+        """Bitset of items meeting every restriction, limited to `categories` when given."""
+        mask = self.all_items
+        for restriction in restrictions:
+            mask &= self.allowed(restriction)
+        if categories:
+            mask &= functools.reduce(lambda acc, category: acc | self.categories.get(category, 0), categories, 0)
+        return mask
+
+    def keys_in(self, mask):
+        """(category, id) keys of the items in a bitset, in menu order."""
+        keys = []
+        while mask:
+            low = mask & -mask
+            keys.append(self.keys[low.bit_length() - 1])
+            mask ^= low
+        return keys
+
+    def line_allergens(self, line):
+        """
+        The menu item's declared allergens plus those of the line's chosen protein
+        and add-ons, or None when none of its options carry allergens.
+        """
+        key = (line.get("category"), line.get("id"))
+        options = self.option_allergens.get(key)
+        if options is None:
+            return None
+        allergens = set(self.item_allergens[key])
+        for name in [line.get("protein")] + list(line.get("addons") or []):
+            allergens |= options.get(name, frozenset())
+        return allergens
+
+    def check_order(self, structured_order, restrictions):
+        """
+        Lines of an order that break a restriction, as a list of
+        {"index", "name", "restriction", "on_request"}; `on_request` is True when
+        the kitchen can make the item gluten-free and the line does not ask for it yet.
+        A gluten-free crust on a pizza line satisfies "gluten-free", and allergen
+        restrictions also count the line's chosen protein and add-ons (a shrimp add-on is shellfish).
+        """
+        allowed = {restriction: self.allowed(restriction) for restriction in restrictions}
+        conflicts = []
+        for index, line in enumerate(structured_order.get("items", [])):
+            bit = self.bit.get((line.get("category"), line.get("id")), 0)
+            line_allergens = self.line_allergens(line)
+            for restriction, mask in allowed.items():
+                kind, value = RESTRICTIONS[restriction]
+                if kind == "free_of" and line_allergens is not None:
+                    if value not in line_allergens:
+                        continue
+                elif mask & bit:
+                    continue
+                if restriction == "gluten-free" and line.get("crust") == "gluten-free":
+                    continue
+                conflicts.append({
+                    "index": index,
+                    "name": line.get("name"),
+                    "restriction": restriction,
+                    "on_request": restriction == "gluten-free" and bool(self.gluten_free_on_request & bit)
+                })
+        return conflicts
+
+
+@functools.lru_cache(maxsize=2)
+def _compile(menu_version):
+    return DietaryIndex(CATALOG)
+
+def dietary_index():
+    return _compile(CATALOG.version)
+
+
+def parse_restrictions(text):
+    """Restrictions mentioned in a message, in RESTRICTIONS order."""
+    return [name for name, regex in _RESTRICTION_REGEXES.items() if regex.search(text)]
+
+
+def parse_categories(text):
+    return [category for category, regex in _CATEGORY_PATTERNS.items() if regex.search(text)]
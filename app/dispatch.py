@@ -0,0 +1,677 @@
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# --- Prep Time ---
+
+# Seconds of kitchen time per unit, by category and size. The oven bakes several items
+# at once, so an order takes its base time plus a share of each extra unit.
+PREP_BASE_SECONDS = 8 * 60
+PREP_SECONDS = {
+    "pizzas": {"s": 120, "m": 150, "l": 180},
+    "pastas": {"m": 150, "l": 210},
+    "drinks": {"": 15}
+}
+PREP_DEFAULT_SECONDS = 150
+
+def estimate_prep_seconds(items):
+    """Kitchen time for an order from its item counts and sizes."""
+    total = 0
+    for item in items:
+        by_size = PREP_SECONDS.get(item.get("category"), {})
+        per_unit = by_size.get((item.get("size") or "").lower(), max(by_size.values(), default=PREP_DEFAULT_SECONDS))
+        total += per_unit * item.get("quantity", 1)
+    return PREP_BASE_SECONDS + total
+
+
+# --- Geocoding ---
+
+_ADDRESS_ABBREVIATIONS = {"st": "street", "ave": "avenue", "av": "avenue", "rd": "road", "blvd": "boulevard",
+                          "dr": "drive", "ln": "lane", "ct": "court", "pl": "place", "sq": "square", "apt": "apartment"}
+
+def normalize_address(address):
+    words = re.findall(r"[a-z0-9]+", (address or "").lower())
+    return " ".join(_ADDRESS_ABBREVIATIONS.get(word, word) for word in words)
+
+
+class TableGeocoder:
+    """
+    Looks addresses up in a local table of normalized address -> (lat, lon).
+
+    Any object with geocode(address) -> (lat, lon) or None can replace it.
+    """
+
+    def __init__(self, table=None):
+        self.table = {normalize_address(address): (float(lat), float(lon)) for address, (lat, lon) in (table or {}).items()}
+
+    @classmethod
+    def from_file(cls, path):
+        """Loads a JSON object mapping addresses to [lat, lon]."""
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def geocode(self, address):
+        return self.table.get(normalize_address(address))
+
+
+def distance_km(a, b):
+    """Equirectangular distance; accurate to well under 1% across a delivery area."""
+    mean_lat = math.radians((a[0] + b[0]) / 2)
+    dx = (b[1] - a[1]) * 111.32 * math.cos(mean_lat)
+    dy = (b[0] - a[0]) * 110.57
+    return math.hypot(dx, dy)
+
+
+# --- Spatial Index ---
+
+class GridIndex:
+    """
+    Uniform lat/lon grid (a fixed-precision geohash) with cells `cell_km` on a side.
+
+    Every point within `cell_km` of a point lies in its cell or one of the eight
+    around it, so a radius query with radius <= cell_km reads nine cells.
+    """
+
+    def __init__(self, cell_km, reference_lat=0.0):
+        self.cell_lat = cell_km / 110.57
+        self.cell_lon = cell_km / (111.32 * max(math.cos(math.radians(reference_lat)), 0.01))
+        self._cells = {}
+
+    def cell(self, location):
+        return (math.floor(location[0] / self.cell_lat), math.floor(location[1] / self.cell_lon))
+
+    def add(self, key, cell):
+        self._cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(key)
+            if not members:
+                del self._cells[cell]
+
+    def clear(self):
+        self._cells.clear()
+
+    def around(self, cell):
+        """Keys in the cell and its eight neighbours."""
+        row, col = cell
+        for d_row in (-1, 0, 1):
+            for d_col in (-1, 0, 1):
+                yield from self._cells.get((row + d_row, col + d_col), ())
+
+
+# --- Dispatch Stores ---
+# Pending orders and formed batches live in a store. Every worker submits orders
+# to it and reads and claims batches from it; one dispatcher at a time, the lease
+# holder, pulls new orders into its grid index and forms the batches.
+
+class MemoryDispatchStore:
+    """Dispatch state in this process only: not shared between workers and not kept across restarts."""
+
+    persistent = False
+
+    def __init__(self, max_batches_kept=1000):
+        self.max_batches_kept = max_batches_kept
+        self._known = OrderedDict()  # order_id -> submitted_at, to ignore repeats
+        self._unread = deque()  # (seq, order_id, record, location, ready_at, submitted_at)
+        self._seq = itertools.count(1)
+        self._unbatched = set()
+        self._batches = OrderedDict()
+        self._batch_ids = itertools.count(1)
+        self._hold_times = deque(maxlen=10000)
+        self._counts = {"submitted": 0, "unlocated": 0, "batches": 0, "batched_orders": 0, "full_batches": 0, "deadline_batches": 0}
+        self._journal_positions = {}
+        self._lock = threading.Lock()
+
+    def add_order(self, order_id, record, location, ready_at, submitted_at):
+        """Stores a new order; returns False if the order is already known."""
+        with self._lock:
+            if order_id in self._known:
+                return False
+            self._known[order_id] = submitted_at
+            self._unread.append((next(self._seq), order_id, record, location, ready_at, submitted_at))
+            self._unbatched.add(order_id)
+            self._counts["submitted"] += 1
+            if location is None:
+                self._counts["unlocated"] += 1
+            return True
+
+    def new_orders(self, after):
+        """Unbatched orders stored after sequence number `after`, oldest first."""
+        with self._lock:
+            while self._unread and self._unread[0][0] <= after:
+                self._unread.popleft()
+            return list(self._unread)
+
+    def save_batch(self, batch, hold_times):
+        """Assigns batch["batch_id"] and marks its orders batched. Returns False if one already was."""
+        with self._lock:
+            if not self._unbatched.issuperset(batch["order_ids"]):
+                return False
+            self._unbatched.difference_update(batch["order_ids"])
+            batch["batch_id"] = next(self._batch_ids)
+            self._batches[batch["batch_id"]] = batch
+            while len(self._batches) > self.max_batches_kept:
+                self._batches.popitem(last=False)
+            self._hold_times.extend(hold_times)
+            self._counts["batches"] += 1
+            self._counts["batched_orders"] += len(batch["order_ids"])
+            self._counts[f"{batch['reason']}_batches"] += 1
+            return True
+
+    def batches(self, status=None, limit=100):
+        with self._lock:
+            selected = [dict(batch) for batch in reversed(self._batches.values()) if status is None or batch["status"] == status]
+        return selected[:limit]
+
+    def claim(self, batch_id, driver):
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None or batch["status"] != "open":
+                return None
+            batch["status"] = "claimed"
+            batch["driver"] = driver
+            return dict(batch)
+
+    def acquire_lease(self, owner, ttl):
+        return True
+
+    def journal_position(self, path):
+        """Byte offset in the order journal at `path` up to which orders have been restored."""
+        return self._journal_positions.get(path, 0)
+
+    def save_journal_position(self, path, position):
+        self._journal_positions[path] = position
+
+    def purge(self, before):
+        """Forgets orders submitted before `before`; they can no longer be told apart from new ones."""
+        with self._lock:
+            while self._known and next(iter(self._known.values())) < before:
+                self._known.popitem(last=False)
+
+    def counts(self):
+        with self._lock:
+            return dict(self._counts, pending=len(self._unbatched))
+
+    def hold_times(self):
+        with self._lock:
+            return list(self._hold_times)
+
+
+class SQLiteDispatchStore:
+    """
+    Dispatch state in a SQLite database in WAL mode, shared by every worker on
+    the host and kept across restarts. The "leader" lease row names the one
+    dispatcher that forms batches; counts cover orders and batches still
+    within the dispatcher's retention.
+    """
+
+    persistent = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS dispatch_orders ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "order_id TEXT NOT NULL UNIQUE, "
+            "record TEXT NOT NULL, "
+            "lat REAL, lon REAL, "
+            "ready_at REAL NOT NULL, "
+            "submitted_at REAL NOT NULL, "
+            "batch_id INTEGER, "
+            "hold_seconds REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS dispatch_orders_unbatched ON dispatch_orders(seq) WHERE batch_id IS NULL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS dispatch_batches ("
+            "batch_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "batch TEXT NOT NULL, "
+            "reason TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "formed_at REAL NOT NULL, "
+            "status TEXT NOT NULL, "
+            "driver TEXT)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS dispatch_lease (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS dispatch_journal_positions (path TEXT PRIMARY KEY, position INTEGER NOT NULL)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        # SQLite connections must not be used across fork (e.g. one opened in a preloading gunicorn master).
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add_order(self, order_id, record, location, ready_at, submitted_at):
+        lat, lon = location if location is not None else (None, None)
+        cursor = self._connect().execute(
+            "INSERT OR IGNORE INTO dispatch_orders (order_id, record, lat, lon, ready_at, submitted_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (order_id, json.dumps(record, separators=(",", ":")), lat, lon, ready_at, submitted_at)
+        )
+        return cursor.rowcount == 1
+
+    def new_orders(self, after):
+        rows = self._connect().execute(
+            "SELECT seq, order_id, record, lat, lon, ready_at, submitted_at FROM dispatch_orders "
+            "WHERE batch_id IS NULL AND seq > ? ORDER BY seq",
+            (after,)
+        ).fetchall()
+        return [(seq, order_id, json.loads(record), (lat, lon) if lat is not None else None, ready_at, submitted_at)
+                for seq, order_id, record, lat, lon, ready_at, submitted_at in rows]
+
+    def save_batch(self, batch, hold_times):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            batch_id = conn.execute(
+                "INSERT INTO dispatch_batches (batch, reason, size, formed_at, status, driver) VALUES (?, ?, ?, ?, ?, ?)",
+                (json.dumps(batch, separators=(",", ":")), batch["reason"], len(batch["order_ids"]), batch["formed_at"], batch["status"], batch["driver"])
+            ).lastrowid
+            for order_id, hold in zip(batch["order_ids"], hold_times):
+                updated = conn.execute(
+                    "UPDATE dispatch_orders SET batch_id = ?, hold_seconds = ? WHERE order_id = ? AND batch_id IS NULL",
+                    (batch_id, hold, order_id)
+                ).rowcount
+                if updated != 1:
+                    conn.execute("ROLLBACK")
+                    return False
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        batch["batch_id"] = batch_id
+        return True
+
+    def _batch_from_row(self, row):
+        batch_id, batch, status, driver = row
+        return dict(json.loads(batch), batch_id=batch_id, status=status, driver=driver)
+
+    def batches(self, status=None, limit=100):
+        query = "SELECT batch_id, batch, status, driver FROM dispatch_batches"
+        params = ()
+        if status is not None:
+            query += " WHERE status = ?"
+            params = (status,)
+        rows = self._connect().execute(query + " ORDER BY batch_id DESC LIMIT ?", params + (limit,)).fetchall()
+        return [self._batch_from_row(row) for row in rows]
+
+    def claim(self, batch_id, driver):
+        conn = self._connect()
+        cursor = conn.execute(
+            "UPDATE dispatch_batches SET status = 'claimed', driver = ? WHERE batch_id = ? AND status = 'open'",
+            (driver, batch_id)
+        )
+        if cursor.rowcount != 1:
+            return None
+        row = conn.execute("SELECT batch_id, batch, status, driver FROM dispatch_batches WHERE batch_id = ?", (batch_id,)).fetchone()
+        return self._batch_from_row(row) if row is not None else None
+
+    def acquire_lease(self, owner, ttl):
+        """Takes or renews the leader lease for `ttl` seconds; returns whether `owner` holds it."""
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO dispatch_lease (name, owner, expires_at) VALUES ('leader', ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE dispatch_lease.owner = excluded.owner OR dispatch_lease.expires_at < ?",
+            (owner, now + ttl, now)
+        )
+        return cursor.rowcount == 1
+
+    def journal_position(self, path):
+        row = self._connect().execute("SELECT position FROM dispatch_journal_positions WHERE path = ?", (path,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def save_journal_position(self, path, position):
+        self._connect().execute(
+            "INSERT INTO dispatch_journal_positions (path, position) VALUES (?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET position = excluded.position",
+            (path, position)
+        )
+
+    def purge(self, before):
+        conn = self._connect()
+        conn.execute("DELETE FROM dispatch_orders WHERE batch_id IS NOT NULL AND submitted_at < ?", (before,))
+        conn.execute("DELETE FROM dispatch_batches WHERE formed_at < ?", (before,))
+
+    def counts(self):
+        conn = self._connect()
+        submitted, pending, unlocated = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(batch_id IS NULL), 0), COALESCE(SUM(lat IS NULL), 0) FROM dispatch_orders"
+        ).fetchone()
+        counts = {"submitted": submitted, "unlocated": unlocated, "pending": pending,
+                  "batches": 0, "batched_orders": 0, "full_batches": 0, "deadline_batches": 0}
+        for reason, batches, orders in conn.execute("SELECT reason, COUNT(*), SUM(size) FROM dispatch_batches GROUP BY reason"):
+            counts["batches"] += batches
+            counts["batched_orders"] += orders
+            counts[f"{reason}_batches"] = batches
+        return counts
+
+    def hold_times(self):
+        rows = self._connect().execute(
+            "SELECT hold_seconds FROM dispatch_orders WHERE batch_id IS NOT NULL ORDER BY seq DESC LIMIT 10000"
+        ).fetchall()
+        return [hold for (hold,) in rows]
+
+
+def create_dispatch_store(url="memory", max_batches_kept=1000):
+    """Builds a dispatch store from a URL: "memory" or "sqlite:///path/to/dispatch.db"."""
+    if url == "memory":
+        return MemoryDispatchStore(max_batches_kept=max_batches_kept)
+    if url.startswith("sqlite:///"):
+        path = url[len("sqlite:///"):]
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return SQLiteDispatchStore(path)
+    raise ValueError(f"Unsupported dispatch store URL: {url}")
+
+
+# --- Dispatcher ---
+
+class _PendingOrder:
+    __slots__ = ("order_id", "record", "location", "cell", "ready_at", "submitted_at")
+
+    def __init__(self, order_id, record, location, cell, ready_at, submitted_at):
+        self.order_id = order_id
+        self.record = record
+        self.location = location
+        self.cell = cell
+        self.ready_at = ready_at
+        self.submitted_at = submitted_at
+
+
+class Dispatcher:
+    """
+    Groups completed orders into delivery batches by location and ready time.
+
+    Orders are geocoded on submit and kept in `store`. tick() forms batches
+    of up to `capacity` orders within `radius_km` of each other that are ready
+    (or will be within `ready_slack` seconds):
+    - as soon as a neighbourhood has a full batch of them, and
+    - at the latest `max_hold` seconds after an order is ready, with whatever
+      neighbours are available then, so no order waits longer than that bound.
+    Orders whose address cannot be geocoded go out alone at that deadline.
+    Batches list their stops in nearest-neighbour order from the restaurant.
+
+    With a shared store, only the dispatcher holding the store's lease forms
+    batches; it indexes the pending orders on a grid and rebuilds that index
+    from the store whenever it takes the lease over.
+    """
+
+    def __init__(self, geocoder=None, restaurant_location=None, capacity=4, radius_km=2.0, max_hold=300.0,
+                 ready_slack=120.0, tick_interval=1.0, max_batches_kept=1000, retention=86400.0, store=None,
+                 clock=time.time):
+        self.geocoder = geocoder or TableGeocoder()
+        self.restaurant_location = restaurant_location
+        self.capacity = capacity
+        self.radius_km = radius_km
+        self.max_hold = max_hold
+        self.ready_slack = ready_slack
+        self.tick_interval = tick_interval
+        self.retention = retention
+        self.store = store or MemoryDispatchStore(max_batches_kept)
+        self._clock = clock
+        self._lease_ttl = max(5.0, 3 * (tick_interval or 0))
+        self._instance = uuid.uuid4().hex[:8]
+        self._leading = False
+        self._last_purge = None
+
+        self._index = GridIndex(radius_km, reference_lat=restaurant_location[0] if restaurant_location else 0.0)
+        self._reset_index()
+        self._lock = threading.Lock()
+        self._ticker = None
+        self._ticker_pid = None
+
+    def _reset_index(self):
+        self._index.clear()
+        self._pending = {}
+        self._deadlines = []  # (ready_at + max_hold, order_id), lazily pruned
+        self._becoming_ready = []  # (ready_at, order_id), moved into the index once within the slack
+        self._seen = 0  # last store sequence number loaded
+
+    # --- Intake ---
+
+    def submit(self, order, now=None):
+        """Queues a completed order (a journal record with order_id, address and items)."""
+        now = self._clock() if now is None else now
+        location = self.geocoder.geocode(order.get("address"))
+        ready_at = now + estimate_prep_seconds(order.get("items", []))
+        self.store.add_order(order["order_id"], order, location, ready_at, now)
+        self._ensure_ticker()
+        return order["order_id"]
+
+    def restore(self, journal, now=None):
+        """
+        Re-submits orders from the last `retention` seconds of `journal` that the store
+        has never seen, e.g. ones journaled just before a crash. Only the part of the
+        journal written since the previous restore is read; the store keeps that
+        position, so workers starting after the first one read next to nothing.
+        Orders the store already holds, pending or batched, are skipped. A memory
+        store remembers nothing across restarts, so it is not restored. Returns the
+        number of orders added.
+        """
+        if not self.store.persistent:
+            return 0
+        cutoff = (self._clock() if now is None else now) - self.retention
+        start = position = self.store.journal_position(journal.path)
+        restored = 0
+        for position, record in journal.read_from(start):
+            recorded_at = record.get("recorded_at", 0)
+            if recorded_at < cutoff or "order_id" not in record:
+                continue
+            location = self.geocoder.geocode(record.get("address"))
+            ready_at = recorded_at + estimate_prep_seconds(record.get("items", []))
+            if self.store.add_order(record["order_id"], record, location, ready_at, recorded_at):
+                restored += 1
+        if position != start:
+            self.store.save_journal_position(journal.path, position)
+        if restored:
+            logger.info("Restored %d journaled orders for dispatch", restored)
+        return restored
+
+    def _load_new_orders(self):
+        for seq, order_id, record, location, ready_at, submitted_at in self.store.new_orders(self._seen):
+            self._seen = seq
+            if order_id in self._pending:
+                continue
+            location = tuple(location) if location is not None else None
+            self._pending[order_id] = _PendingOrder(order_id, record, location, self._index.cell(location) if location else None,
+                                                    ready_at, submitted_at)
+            heapq.heappush(self._deadlines, (ready_at + self.max_hold, order_id))
+            heapq.heappush(self._becoming_ready, (ready_at, order_id))
+
+    # --- Batching ---
+
+    def tick(self, now=None):
+        """Forms every batch that is due at `now`. Returns the new batches; none unless this dispatcher holds the lease."""
+        now = self._clock() if now is None else now
+        formed = []
+        with self._lock:
+            if not self.store.acquire_lease(self._owner(), self._lease_ttl):
+                self._leading = False
+                return formed
+            if not self._leading:
+                # Another dispatcher may have batched orders since this one last led.
+                self._reset_index()
+                self._leading = True
+            self._load_new_orders()
+
+            # Only orders ready within the slack are indexed, so neighbour queries never see the rest.
+            eligible = []
+            while self._becoming_ready and self._becoming_ready[0][0] <= now + self.ready_slack:
+                _, order_id = heapq.heappop(self._becoming_ready)
+                pending = self._pending.get(order_id)
+                if pending is not None and pending.cell is not None:
+                    self._index.add(order_id, pending.cell)
+                    eligible.append(pending)
+
+            # Deadlines first: these orders cannot wait for a fuller batch.
+            while self._leading and self._deadlines and self._deadlines[0][0] <= now:
+                _, order_id = heapq.heappop(self._deadlines)
+                seed = self._pending.get(order_id)
+                if seed is not None:
+                    formed.append(self._form_batch(seed, self._neighbours(seed), now, "deadline"))
+
+            # Then any neighbourhood that a newly eligible order fills up.
+            for seed in eligible:
+                if self._leading and seed.order_id in self._pending:
+                    neighbours = self._neighbours(seed)
+                    if len(neighbours) + 1 >= self.capacity:
+                        formed.append(self._form_batch(seed, neighbours, now, "full"))
+
+            if self._last_purge is None or now - self._last_purge >= 60:
+                self.store.purge(now - self.retention)
+                self._last_purge = now
+        return [batch for batch in formed if batch is not None]
+
+    def _owner(self):
+        # A forked worker is a different dispatcher from its parent.
+        return f"{os.getpid()}-{self._instance}"
+
+    def _neighbours(self, seed):
+        """
+        Up to capacity - 1 nearest eligible orders within radius_km of `seed`.
+
+        Their ready times are within max_hold / 2 of the seed's, so no member
+        of the batch waits more than max_hold for the last one to be ready.
+        """
+        if seed.cell is None:
+            return []
+        candidates = []
+        for order_id in self._index.around(seed.cell):
+            other = self._pending[order_id]
+            if order_id == seed.order_id or abs(other.ready_at - seed.ready_at) > self.max_hold / 2:
+                continue
+            distance = distance_km(seed.location, other.location)
+            if distance <= self.radius_km:
+                candidates.append((distance, order_id))
+        return [self._pending[order_id] for _, order_id in heapq.nsmallest(self.capacity - 1, candidates)]
+
+    def _form_batch(self, seed, neighbours, now, reason):
+        """Saves a batch of `seed` and `neighbours` to the store. Returns it, or None if the store refused it."""
+        members = [seed] + neighbours
+        for member in members:
+            del self._pending[member.order_id]
+            if member.cell is not None:
+                self._index.remove(member.order_id, member.cell)
+
+        depart_at = max(now, max(member.ready_at for member in members))
+        batch = {
+            "order_ids": [member.order_id for member in members],
+            "stops": [
+                {"order_id": member.order_id, "address": member.record.get("address"), "name": member.record.get("name"),
+                 "phone": member.record.get("phone"), "location": member.location, "ready_at": member.ready_at}
+                for member in self._route(members)
+            ],
+            "formed_at": now,
+            "depart_at": depart_at,
+            "reason": reason,
+            "status": "open",
+            "driver": None
+        }
+        if not self.store.save_batch(batch, [depart_at - member.ready_at for member in members]):
+            # Another dispatcher batched one of these orders: its lease expired under us. Rebuild on the next tick.
+            logger.warning("Dispatch lease lost; dropping batch of %d orders", len(members))
+            self._leading = False
+            return None
+        return batch
+
+    def _route(self, members):
+        """Nearest-neighbour stop order starting from the restaurant."""
+        located = [member for member in members if member.location is not None]
+        unlocated = [member for member in members if member.location is None]
+        if not located or self.restaurant_location is None:
+            return located + unlocated
+        route, position = [], self.restaurant_location
+        while located:
+            nearest = min(located, key=lambda member: distance_km(position, member.location))
+            located.remove(nearest)
+            route.append(nearest)
+            position = nearest.location
+        return route + unlocated
+
+    # --- Drivers ---
+
+    def batches(self, status=None, limit=100):
+        """Most recent batches first, optionally only those with the given status."""
+        self._ensure_ticker()
+        return self.store.batches(status=status, limit=limit)
+
+    def claim(self, batch_id, driver):
+        """Assigns an open batch to a driver. Returns the batch, or None if it is unknown or already claimed."""
+        return self.store.claim(batch_id, driver)
+
+    def stats(self):
+        snapshot = self.store.counts()
+        holds = sorted(self.store.hold_times())
+        snapshot["avg_batch_size"] = round(snapshot["batched_orders"] / snapshot["batches"], 2) if snapshot["batches"] else 0.0
+        for label, pct in (("hold_p50_seconds", 0.50), ("hold_p95_seconds", 0.95), ("hold_max_seconds", 1.0)):
+            snapshot[label] = round(holds[min(int(pct * len(holds)), len(holds) - 1)], 1) if holds else None
+        return snapshot
+
+    # --- Background Ticks ---
+
+    def _ensure_ticker(self):
+        # Started on first use, and again in a forked worker whose parent had one.
+        if self.tick_interval is None or (self._ticker is not None and self._ticker_pid == os.getpid()):
+            return
+        with self._lock:
+            if self._ticker is None or self._ticker_pid != os.getpid():
+                self._ticker = threading.Thread(target=self._tick_loop, name="dispatch-ticker", daemon=True)
+                self._ticker_pid = os.getpid()
+                self._ticker.start()
+
+    def _tick_loop(self):
+        while True:
+            time.sleep(self.tick_interval)
+            try:
+                for batch in self.tick():
+                    logger.info("Dispatch batch %s (%s): %d orders", batch["batch_id"], batch["reason"], len(batch["order_ids"]))
+            except Exception:
+                logger.exception("Dispatch tick failed")
+
+
+def _parse_location(value):
+    if not value:
+        return None
+    lat, lon = value.split(",")
+    return float(lat), float(lon)
+
+
+def create_dispatcher(store_url="memory"):
+    """
+    Builds the dispatcher from DISPATCH_* environment variables; GEOCODER_TABLE_PATH selects
+    the lookup table and `store_url` (see create_dispatch_store) where its state is kept.
+    """
+    table_path = os.environ.get("GEOCODER_TABLE_PATH")
+    max_batches_kept = int(os.environ.get("DISPATCH_MAX_BATCHES_KEPT", 1000))
+    return Dispatcher(
+        geocoder=TableGeocoder.from_file(table_path) if table_path else TableGeocoder(),
+        restaurant_location=_parse_location(os.environ.get("RESTAURANT_LOCATION")),
+        capacity=int(os.environ.get("DISPATCH_BATCH_CAPACITY", 4)),
+        radius_km=float(os.environ.get("DISPATCH_RADIUS_KM", 2.0)),
+        max_hold=float(os.environ.get("DISPATCH_MAX_HOLD_SECONDS", 300)),
+        ready_slack=float(os.environ.get("DISPATCH_READY_SLACK_SECONDS", 120)),
+        tick_interval=float(os.environ.get("DISPATCH_TICK_SECONDS", 1.0)),
+        max_batches_kept=max_batches_kept,
+        retention=float(os.environ.get("DISPATCH_RETENTION_SECONDS", 86400)),
+        store=create_dispatch_store(store_url, max_batches_kept=max_batches_kept)
+    )
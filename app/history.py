@@ -0,0 +1,87 @@
+import os
+
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", 1500))
+HISTORY_RECENT_TURNS = int(os.environ.get("HISTORY_RECENT_TURNS", 6))
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (about four characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+
+def _turn_tokens(msg):
+    return estimate_tokens(msg.get("user", "")) + estimate_tokens(msg.get("bot", ""))
+
+
+def summarize_state(state, folded_turns):
+    """
+    Builds the rolling summary of older turns from the structured order state.
+
+    The state already holds everything those turns decided, so the summary is
+    derived locally instead of asking the model to condense the transcript.
+    """
+    lines = [f"Summary of the {folded_turns} earlier conversation turns (omitted):"]
+    lines.append(f"- Current stage: {state.get('stage')}")
+
+    items = state.get("structured_order", {}).get("items", [])
+    if items:
+        described = []
+        for item in items:
+            text = f"{item.get('quantity', 1)}x {item.get('name', 'N/A Item')}"
+            if item.get("size"):
+                text += f" ({item['size']})"
+            described.append(text)
+        lines.append("- Items so far: " + ", ".join(described))
+    else:
+        lines.append("- Items so far: none")
+
+    if state.get("collected_special") is not None:
+        lines.append(f"- Special requests: {state['collected_special']}")
+    if state.get("collected_confirmation"):
+        lines.append("- The customer has confirmed the order.")
+
+    collected = [label for label, key in (("name", "collected_name"), ("phone", "collected_phone"), ("address", "collected_address")) if state.get(key)]
+    if collected:
+        lines.append("- Delivery details already collected: " + ", ".join(collected))
+    return "\n".join(lines)
+
+
+class HistoryWindow:
+    """
+    Chooses which prior turns are replayed to the model.
+
+    The last `recent_turns` turns are kept verbatim while they fit in
+    `token_budget`; everything older is replaced by a summary of the order state.
+    """
+
+    def __init__(self, token_budget=HISTORY_TOKEN_BUDGET, recent_turns=HISTORY_RECENT_TURNS):
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+
+    def build(self, messages, state):
+        """Returns (chat_history entries, estimated tokens saved versus replaying everything)."""
+        full_tokens = sum(_turn_tokens(msg) for msg in messages)
+
+        kept = []
+        kept_tokens = 0
+        for msg in reversed(messages[-self.recent_turns:] if self.recent_turns > 0 else []):
+            tokens = _turn_tokens(msg)
+            # The most recent turn is always kept so the model sees what it just said.
+            if kept and kept_tokens + tokens > self.token_budget:
+                break
+            kept.append(msg)
+            kept_tokens += tokens
+        kept.reverse()
+
+        chat_history = []
+        folded_turns = len(messages) - len(kept)
+        if folded_turns:
+            summary = summarize_state(state, folded_turns)
+            kept_tokens += estimate_tokens(summary)
+            chat_history.append({"role": "user", "parts": [summary]})
+
+        for msg in kept:
+            chat_history.append({"role": "user", "parts": [msg["user"]]})
+            chat_history.append({"role": "model", "parts": [msg["bot"]]})
+
+        return chat_history, max(full_tokens - kept_tokens, 0)
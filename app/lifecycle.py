@@ -0,0 +1,49 @@
+import logging
+import os
+import time
+
+from .asr_pool import create_asr_backend
+
+logger = logging.getLogger(__name__)
+
+
+def preload():
+    """
+    Loads model weights and builds menu-derived tables in the current process.
+
+    Run in the gunicorn master with preload_app so forked workers inherit them
+    and share the pages copy-on-write. Nothing here starts threads or opens
+    network clients, both of which would not survive the fork. Returns the
+    seconds spent per step.
+    """
+    timings = {}
+
+    started = time.perf_counter()
+    create_asr_backend().preload()
+    timings["asr_model"] = time.perf_counter() - started
+
+    if os.environ.get("LLM_BACKEND", "gemini") != "fake":
+        started = time.perf_counter()
+        import google.generativeai  # noqa: F401  (module import only; the client is built per worker)
+        timings["llm_library"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    from .agent import static_prompt_prefix
+    from .order_parser import order_parser
+    from .pricing import compiled_menu
+    static_prompt_prefix()
+    order_parser()
+    compiled_menu()
+    timings["menu_tables"] = time.perf_counter() - started
+
+    logger.info("Preloaded in %.2fs: %s", sum(timings.values()), {k: round(v, 3) for k, v in timings.items()})
+    return timings
+
+
+def start_workers():
+    """
+    Starts this process's ASR replicas, which load (or inherit) the model and run a
+    warm-up inference in the background. Call after fork, e.g. from gunicorn's post_fork.
+    """
+    from .speech_utils import get_asr_pool
+    return get_asr_pool()
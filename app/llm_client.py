@@ -0,0 +1,317 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+
+class LLMUnavailable(Exception):
+    """The model could not produce a reply in time: retries exhausted, deadline passed or circuit open."""
+
+
+# --- Backends ---
+
+class GeminiBackend:
+    """
+    Calls Gemini through google-generativeai.
+
+    The library is imported and the model built on first use, so importing the
+    app does not pay for it and no client state is created before a fork.
+    """
+
+    def __init__(self, model_name="gemini-2.0-flash", api_key=None):
+        self.model_name = model_name
+        self.api_key = api_key
+        self._model = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._model is None:
+                import google.generativeai as genai
+
+                genai.configure(api_key=self.api_key or os.environ.get("GEMINI_API_KEY", "API KEY HERE"))
+                self._model = genai.GenerativeModel(self.model_name)
+            return self._model
+
+    async def generate(self, contents, timeout):
+        response = await (self._model or self.load()).generate_content_async(contents, request_options={"timeout": timeout})
+        return response.text.strip() if hasattr(response, "text") and response.text else ""
+
+    def stream(self, contents, timeout):
+        for chunk in (self._model or self.load()).generate_content(contents, stream=True, request_options={"timeout": timeout}):
+            # Chunks without text parts (e.g. the final one carrying only a finish reason) raise on .text.
+            try:
+                text = chunk.text
+            except ValueError:
+                text = ""
+            if text:
+                yield text
+
+
+class FakeBackend:
+    """
+    Local stand-in for Gemini with configurable latency and failures.
+
+    `reply` may be a string or a callable taking the request contents.
+    """
+
+    def __init__(self, reply="Okay! What else can I get for you?", latency=0.0, jitter=0.0, failure_rate=0.0, seed=None):
+        self.reply = reply
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+
+    def _reply_for(self, contents):
+        self.calls += 1
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise RuntimeError("FakeBackend injected failure")
+        return self.reply(contents) if callable(self.reply) else self.reply
+
+    def _delay(self):
+        return self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    async def generate(self, contents, timeout):
+        await asyncio.sleep(self._delay())
+        return self._reply_for(contents)
+
+    def stream(self, contents, timeout):
+        text = self._reply_for(contents)
+        words = text.split(" ")
+        per_word = self._delay() / max(len(words), 1)
+        for i, word in enumerate(words):
+            time.sleep(per_word)
+            yield word if i == len(words) - 1 else word + " "
+
+
+# --- Circuit Breaker ---
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds, then lets a single trial call through (half-open).
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if self._clock() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self._trial_in_flight = False
+
+
+# --- Client ---
+
+class LLMClient:
+    """
+    Async client around a backend with per-call deadlines, jittered retries,
+    optional hedged requests and a circuit breaker.
+
+    Coroutines run on one background event loop; Flask views use
+    generate_sync(), which blocks only the calling thread, while at most
+    `max_concurrency` upstream calls are in flight at once.
+    """
+
+    def __init__(self, backend, timeout=15.0, max_retries=2, backoff_base=0.25, backoff_max=2.0,
+                 hedge_after=None, max_concurrency=32, breaker=None):
+        self.backend = backend
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker or CircuitBreaker()
+        self._stats = {"calls": 0, "failures": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "rejected": 0}
+        self._stats_lock = threading.Lock()
+        self._loop = None
+        self._loop_pid = None
+        self._semaphore = None
+        self._loop_lock = threading.Lock()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot["breaker_state"] = self.breaker.state
+        return snapshot
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _call_backend(self, contents, timeout):
+        async with self._semaphore_for_running_loop():
+            return await asyncio.wait_for(self.backend.generate(contents, timeout), timeout)
+
+    def _semaphore_for_running_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore[0] is not loop:
+            self._semaphore = (loop, asyncio.Semaphore(self.max_concurrency))
+        return self._semaphore[1]
+
+    async def _attempt(self, contents, timeout):
+        if not self.hedge_after or self.hedge_after >= timeout:
+            return await self._call_backend(contents, timeout)
+
+        # Hedging: if the first request is still running after hedge_after, race a second one.
+        primary = asyncio.ensure_future(self._call_backend(contents, timeout))
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        self._count("hedges")
+        hedge = asyncio.ensure_future(self._call_backend(contents, timeout - self.hedge_after))
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if task is hedge:
+                        self._count("hedge_wins")
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    async def generate(self, contents, timeout=None):
+        """Returns the reply text or raises LLMUnavailable."""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self._count("calls")
+
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not self.breaker.allow():
+                self._count("rejected")
+                raise LLMUnavailable("circuit open")
+            try:
+                reply = await self._attempt(contents, remaining)
+                self.breaker.record_success()
+                return reply
+            except Exception as e:
+                last_error = e
+                self.breaker.record_failure()
+
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt)
+                if time.monotonic() + delay >= deadline:
+                    break
+                self._count("retries")
+                await asyncio.sleep(delay)
+
+        self._count("failures")
+        raise LLMUnavailable(f"model call failed: {last_error!r}")
+
+    def _ensure_loop(self):
+        with self._loop_lock:
+            # The loop thread does not survive fork; a forked worker starts its own.
+            if self._loop is None or self._loop_pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="llm-client-loop", daemon=True)
+                thread.start()
+                self._loop = loop
+                self._loop_pid = os.getpid()
+            return self._loop
+
+    def generate_sync(self, contents, timeout=None):
+        """Blocking wrapper for threads outside the client's event loop (e.g. Flask views)."""
+        budget = timeout or self.timeout
+        future = asyncio.run_coroutine_threadsafe(self.generate(contents, budget), self._ensure_loop())
+        try:
+            # A little slack over the budget lets the coroutine report its own timeout.
+            return future.result(budget + 1.0)
+        except LLMUnavailable:
+            raise
+        except Exception as e:
+            future.cancel()
+            raise LLMUnavailable(f"model call failed: {e!r}")
+
+    def stream(self, contents, timeout=None):
+        """
+        Yields reply text chunks. Streams are not retried or hedged because text
+        may already have reached the customer; failures raise LLMUnavailable.
+        """
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise LLMUnavailable("circuit open")
+        self._count("calls")
+        try:
+            for text in self.backend.stream(contents, timeout or self.timeout):
+                yield text
+        except Exception as e:
+            self.breaker.record_failure()
+            self._count("failures")
+            raise LLMUnavailable(f"model stream failed: {e!r}")
+        self.breaker.record_success()
+
+
+def create_llm_client():
+    """Builds the client from LLM_* environment variables. LLM_BACKEND=fake uses the local fake backend."""
+    if os.environ.get("LLM_BACKEND", "gemini") == "fake":
+        backend = FakeBackend(latency=float(os.environ.get("LLM_FAKE_LATENCY_SECONDS", 0)))
+    else:
+        backend = GeminiBackend(os.environ.get("LLM_MODEL", "gemini-2.0-flash"))
+
+    hedge_after = os.environ.get("LLM_HEDGE_AFTER_SECONDS")
+    return LLMClient(
+        backend,
+        timeout=float(os.environ.get("LLM_TIMEOUT_SECONDS", 15)),
+        max_retries=int(os.environ.get("LLM_MAX_RETRIES", 2)),
+        hedge_after=float(hedge_after) if hedge_after else None,
+        max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", 32)),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.environ.get("LLM_BREAKER_FAILURES", 5)),
+            reset_timeout=float(os.environ.get("LLM_BREAKER_RESET_SECONDS", 30))
+        )
+    )
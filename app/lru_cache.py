@@ -0,0 +1,66 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUTTLCache:
+    """
+    Thread-safe mapping bounded by size and idle time.
+
+    The least recently used entry is evicted once `maxsize` is reached, and
+    entries that have not been read or written for `ttl` seconds are dropped.
+    """
+
+    def __init__(self, maxsize=10000, ttl=3600, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()  # key -> (last_access, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            now = self._clock()
+            if self.ttl is not None and now - entry[0] > self.ttl:
+                del self._data[key]
+                return default
+            self._data[key] = (now, entry[1])
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (self._clock(), value)
+            self._data.move_to_end(key)
+            self._evict_locked()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def evict_expired(self):
+        with self._lock:
+            self._evict_locked()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _evict_locked(self):
+        # Entries are kept in access order, so expired ones are always at the front.
+        if self.ttl is not None:
+            cutoff = self._clock() - self.ttl
+            while self._data:
+                oldest_key = next(iter(self._data))
+                if self._data[oldest_key][0] >= cutoff:
+                    break
+                del self._data[oldest_key]
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
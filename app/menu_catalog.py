@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+from types import MappingProxyType
+
+menu_path = os.path.join(os.path.dirname(__file__), "menu.json")
+
+
+class MenuCatalog:
+    """
+    Read-only, indexed view of menu.json.
+
+    Items are indexed by (category, id) and each item's size, protein and
+    add-on prices are precomputed, so lookups do not depend on menu length.
+    `data` is the parsed menu shared by every module; treat it as read-only.
+    """
+
+    __slots__ = ("_data", "_version", "_items", "_size_prices", "_protein_adjustments", "_addon_prices")
+
+    def __init__(self, data, version=None):
+        if version is None:
+            version = hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+        items = {}
+        size_prices = {}
+        protein_adjustments = {}
+        addon_prices = {}
+
+        for category, entries in data.items():
+            if not isinstance(entries, list):
+                continue
+            for item in entries:
+                if not isinstance(item, dict) or "id" not in item:
+                    continue
+                key = (category, item["id"])
+                items[key] = item
+                size_prices[key] = MappingProxyType({s["size"].lower(): s["price"] for s in item.get("sizes", [])})
+                protein_adjustments[key] = MappingProxyType({p["name"]: p.get("price_adjustment", 0) for p in item.get("protein_options", [])})
+                addon_prices[key] = MappingProxyType({a["name"]: a["price"] for a in item.get("add_ons", [])})
+
+        object.__setattr__(self, "_data", data)
+        object.__setattr__(self, "_version", version)
+        object.__setattr__(self, "_items", MappingProxyType(items))
+        object.__setattr__(self, "_size_prices", MappingProxyType(size_prices))
+        object.__setattr__(self, "_protein_adjustments", MappingProxyType(protein_adjustments))
+        object.__setattr__(self, "_addon_prices", MappingProxyType(addon_prices))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MenuCatalog is immutable")
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "rb") as f:
+            raw = f.read()
+        return cls(json.loads(raw), version=hashlib.sha256(raw).hexdigest()[:12])
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def version(self):
+        """Short content hash of the menu; changes whenever menu.json does."""
+        return self._version
+
+    def items(self):
+        """Iterates over ((category, id), item) pairs."""
+        return self._items.items()
+
+    def item(self, category, item_id):
+        return self._items.get((category, item_id))
+
+    def size_prices(self, category, item_id):
+        """Lower-cased size -> price for an item (empty for items without sizes)."""
+        return self._size_prices.get((category, item_id), MappingProxyType({}))
+
+    def size_price(self, category, item_id, size):
+        if not size:
+            return None
+        return self.size_prices(category, item_id).get(size.lower())
+
+    def protein_adjustment(self, category, item_id, protein):
+        table = self._protein_adjustments.get((category, item_id))
+        return table.get(protein) if table else None
+
+    def addon_price(self, category, item_id, addon):
+        table = self._addon_prices.get((category, item_id))
+        return table.get(addon) if table else None
+
+
+CATALOG = MenuCatalog.from_file(menu_path)
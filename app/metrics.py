@@ -0,0 +1,143 @@
+import bisect
+import threading
+
+# Latency buckets in seconds, from sub-millisecond handler turns to slow model calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def _label_key(label_names, labels):
+    return tuple(str(labels.get(name, "")) for name in label_names)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names, key, extra=None):
+    pairs = list(zip(label_names, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.label_names, labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram; observe() is a bisect and a few additions under a lock."""
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        self._series = {}  # label key -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.label_names, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, **labels):
+        series = self._series.get(_label_key(self.label_names, labels))
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', bound))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- Conversation ---
+
+PROMPT_BUILD_SECONDS = REGISTRY.register(Histogram(
+    "mammamia_prompt_build_seconds", "Time spent assembling the Gemini request."))
+PROMPT_CHARS = REGISTRY.register(Histogram(
+    "mammamia_prompt_chars", "Size of the Gemini request in characters.", buckets=SIZE_BUCKETS))
+PROMPT_TOKENS = REGISTRY.register(Histogram(
+    "mammamia_prompt_tokens", "Estimated size of the Gemini request in tokens.", buckets=SIZE_BUCKETS))
+HISTORY_TOKENS_SAVED = REGISTRY.register(Counter(
+    "mammamia_history_tokens_saved_total", "Estimated tokens not sent thanks to history windowing."))
+LLM_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "mammamia_llm_request_seconds", "Latency of Gemini calls.", label_names=("mode",)))
+LLM_ERRORS = REGISTRY.register(Counter(
+    "mammamia_llm_errors_total", "Gemini calls that ended in a degraded reply.", label_names=("mode",)))
+TURNS = REGISTRY.register(Counter(
+    "mammamia_turns_total", "Chat turns by how the reply was produced.", label_names=("path",)))
+LLM_CALLS_AVOIDED = REGISTRY.register(Counter(
+    "mammamia_llm_calls_avoided_total", "Chat turns answered without calling Gemini.", label_names=("reason",)))
+REPLY_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "mammamia_reply_cache_lookups_total", "Reply cache lookups for cacheable stages.", label_names=("result",)))
+STAGE_TRANSITIONS = REGISTRY.register(Counter(
+    "mammamia_stage_transitions_total", "Order state machine transitions.", label_names=("from_stage", "to_stage")))
+ADMISSION_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "mammamia_admission_wait_seconds", "Time model calls waited in the admission queue."))
+ADMISSION_SHED = REGISTRY.register(Counter(
+    "mammamia_admission_shed_total", "Model calls answered with a degraded reply instead of queuing.", label_names=("reason",)))
+COALESCED_TURNS = REGISTRY.register(Counter(
+    "mammamia_coalesced_turns_total", "Duplicate chat submits answered with the in-flight turn's result."))
+
+# --- Speech ---
+
+WHISPER_DECODE_SECONDS = REGISTRY.register(Histogram(
+    "mammamia_whisper_decode_seconds", "Time spent in one Whisper batch.", label_names=("batch_size",)))
+AUDIO_DURATION_SECONDS = REGISTRY.register(Histogram(
+    "mammamia_audio_duration_seconds", "Duration of uploaded audio before and after silence trimming.",
+    buckets=(0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60), label_names=("phase",)))
@@ -0,0 +1,255 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class _Commit:
+    __slots__ = ("done", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class OrderJournal:
+    """
+    Append-only JSONL log of completed orders with write-behind batching.
+
+    append() enqueues the record. A writer thread drains the queue in groups
+    of up to `batch_size` records, writes them and fsyncs once per group
+    (group commit). Records are durable once their group is fsynced, at most
+    about `flush_interval` seconds after append() under normal load. With
+    wait=True, append() returns only after that fsync, so an order is never
+    confirmed before it is on disk; flush() waits for everything queued so far.
+
+    Each group is written with one write() to a file opened with O_APPEND, so
+    several worker processes can share the file without interleaving records.
+
+    A group that fails to write is retried every `retry_interval` seconds until
+    it is on disk, and append() raises OSError in the meantime so no new order
+    is accepted that cannot be saved. A write that fails part-way leaves a torn
+    line; the retry starts on a new line so replay() skips only the fragment.
+    """
+
+    def __init__(self, path, batch_size=256, flush_interval=0.05, retry_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._start_writer()
+        atexit.register(self.close)
+        if hasattr(os, "register_at_fork"):
+            # The writer thread does not survive fork; each forked worker starts its own.
+            os.register_at_fork(after_in_child=self._start_writer)
+
+    def _start_writer(self):
+        self._queue = queue.Queue()
+        self._stats = {"appended": 0, "written": 0, "commits": 0, "write_errors": 0, "replay_skipped_lines": 0}
+        self._stats_lock = threading.Lock()
+        self._closed = False
+        self._failing = None  # the last write error while a group is waiting to be retried
+        self._torn = False  # the file may end in a partial line from a failed write
+        self._writer = threading.Thread(target=self._writer_loop, name="order-journal-writer", daemon=True)
+        self._writer.start()
+
+    def append(self, order, wait=False, timeout=10.0):
+        """
+        Queues a completed order; returns its order_id. Raises OSError while the
+        journal cannot write. With wait=True, blocks until the order's group is
+        fsynced and raises OSError (TimeoutError after `timeout` seconds) if it was not.
+        """
+        failing = self._failing
+        if failing is not None:
+            raise OSError(f"Order journal is not writable: {failing}")
+        record = dict(order)
+        record.setdefault("order_id", uuid.uuid4().hex)
+        record.setdefault("recorded_at", time.time())
+        commit = _Commit() if wait else None
+        self._queue.put((record, commit))
+        with self._stats_lock:
+            self._stats["appended"] += 1
+        if commit is not None:
+            if not commit.done.wait(timeout):
+                raise TimeoutError(f"Order {record['order_id']} not journaled within {timeout}s")
+            if commit.error is not None:
+                raise commit.error
+        return record["order_id"]
+
+    def flush(self):
+        """Blocks until every order queued so far is written and fsynced."""
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot["queue_depth"] = self._queue.qsize()
+        return snapshot
+
+    def _writer_loop(self):
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            while True:
+                entry = self._queue.get()
+                batch = [entry]
+                # Give concurrent checkouts a moment to join this commit.
+                deadline = time.monotonic() + self.flush_interval
+                while entry is not None and len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    batch.append(entry)
+
+                entries = [e for e in batch if e is not None]
+                if entries:
+                    self._commit(fd, entries)
+                for _ in batch:
+                    self._queue.task_done()
+                if len(entries) != len(batch):
+                    return
+        finally:
+            os.close(fd)
+
+    def _write(self, fd, data):
+        return os.write(fd, data)
+
+    def _commit(self, fd, entries):
+        """Writes and fsyncs one group, retrying until it is on disk or the journal closes."""
+        lines = [(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n", commit) for record, commit in entries]
+        synced = []  # commits whose lines are written and wait only for the fsync
+        while True:
+            prefix = b"\n" if self._torn else b""
+            data = prefix + b"".join(line for line, _ in lines)
+            written = 0
+            try:
+                # Regular files only write short when the disk is full; finish or fail.
+                while written < len(data):
+                    written += self._write(fd, data[written:])
+                os.fsync(fd)
+            except OSError as e:
+                lines, synced = self._after_failed_write(lines, synced, written - len(prefix), e)
+                if self._closed:
+                    logger.error("Order journal closed with %d orders unwritten", len(lines))
+                    return
+                time.sleep(self.retry_interval)
+                continue
+
+            self._torn = False
+            self._failing = None
+            with self._stats_lock:
+                self._stats["written"] += len(lines) + len(synced)
+                self._stats["commits"] += 1
+            for commit in synced + [commit for _, commit in lines]:
+                if commit is not None:
+                    commit.done.set()
+            return
+
+    def _after_failed_write(self, lines, synced, written, error):
+        """
+        Splits a group after a failed write into the lines still to write and the
+        commits already written. Waiting appends whose line did not make it are
+        failed now, so their caller can report it; the rest are retried.
+        """
+        logger.error("Order journal write error (retrying in %ss): %s", self.retry_interval, error)
+        self._failing = error
+        if written >= 0:
+            # The prefix ended any earlier fragment; count the whole lines this write got out.
+            complete = 0
+            while complete < len(lines) and written >= len(lines[complete][0]):
+                written -= len(lines[complete][0])
+                complete += 1
+            self._torn = written > 0
+            synced = synced + [commit for _, commit in lines[:complete]]
+            lines = lines[complete:]
+
+        retry = []
+        for line, commit in lines:
+            if commit is None:
+                retry.append((line, commit))
+            else:
+                commit.error = error
+                commit.done.set()
+        with self._stats_lock:
+            self._stats["write_errors"] += len(lines)
+        return retry, synced
+
+    # --- Replay / Query ---
+
+    def replay(self):
+        """
+        Yields every journaled order in write order. Lines that do not parse (e.g. a
+        torn final line from a crash) are logged, counted in stats() and skipped.
+        """
+        for _, record in self._read(0, whole_lines_only=False):
+            yield record
+
+    def read_from(self, position):
+        """
+        Yields (position after the line, record) for each order journaled after byte
+        `position`, e.g. one saved from an earlier read. A final line still being
+        written is left for the next read. A position past the end of the file (the
+        journal was replaced) reads from the start.
+        """
+        return self._read(position, whole_lines_only=True)
+
+    def _read(self, position, whole_lines_only):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            if position > os.fstat(f.fileno()).st_size:
+                position = 0
+            f.seek(position)
+            for line in f:
+                if whole_lines_only and not line.endswith(b"\n"):
+                    return
+                start, position = position, position + len(line)
+                line = line.decode("utf-8", errors="replace").strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    record = None
+                if not isinstance(record, dict):
+                    logger.warning("Skipping unreadable order journal line at byte %d in %s", start, self.path)
+                    with self._stats_lock:
+                        self._stats["replay_skipped_lines"] += 1
+                    continue
+                yield position, record
+
+    def query(self, since=None, until=None, phone=None, name=None, limit=None):
+        """Journaled orders filtered by recorded_at range, phone or (case-insensitive) customer name."""
+        matches = []
+        for record in self.replay():
+            recorded_at = record.get("recorded_at", 0)
+            if since is not None and recorded_at < since:
+                continue
+            if until is not None and recorded_at >= until:
+                continue
+            if phone is not None and record.get("phone") != phone:
+                continue
+            if name is not None and (record.get("name") or "").lower() != name.lower():
+                continue
+            matches.append(record)
+            if limit is not None and len(matches) >= limit:
+                break
+        return matches
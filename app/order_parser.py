@@ -0,0 +1,277 @@
+import functools
+import re
+
+from .menu_catalog import CATALOG
+
+SIZE_FULL_NAMES = {
+    "s": "Small",
+    "m": "Medium",
+    "l": "Large",
+    "single": "Single",
+    "double": "Double",
+    "regular": "Regular",
+    "500ml": "500ml",
+    "1l": "1 Liter"
+}
+
+ORDER_CATEGORIES = ("pizzas", "pastas", "drinks")
+
+# Extra names customers use, on top of each item's menu name and its name without the category word.
+ALIASES = {
+    ("pizzas", "MARG"): ["margherita", "margherita pizza", "margarita"],
+    ("pizzas", "RANCH"): ["ranch", "bbq", "bbq pizza", "ranch pizza", "barbecue", "barbecue pizza", "bbq ranch pizza"],
+    ("pizzas", "SPEC"): ["special pizza", "house special pizza", "mamma mia pizza"],
+    ("pastas", "ALFR"): ["alfredo", "alfredo pasta", "fettuccine alfredo"],
+    ("pastas", "PEST"): ["pesto", "pesto pasta", "pesto fettuccine"],
+    ("pastas", "TRUF"): ["truffle", "truffle pasta", "truffle fettuccine"],
+    ("pastas", "VODKA"): ["special pasta", "vodka pasta", "mamma mia pasta"],
+    ("drinks", "SPRK"): ["sparkling water", "san pellegrino", "water"],
+    ("drinks", "SBLOOD"): ["blood orange", "orange soda", "blood orange soda"],
+    ("drinks", "LIMON"): ["limonata", "lemonade", "lemon soda"],
+    ("drinks", "ESP"): ["espresso", "coffee espresso"],
+    ("drinks", "ICEC"): ["iced coffee", "ice coffee", "cold coffee"]
+}
+
+CATEGORY_WORDS = {"pizzas": ("pizza",), "pastas": ("fettuccine", "pasta"), "drinks": ()}
+
+SIZE_WORDS = dict(
+    {name.lower().replace(" ", ""): code for code, name in SIZE_FULL_NAMES.items()},
+    big="l", largest="l", smallest="s", personal="s"
+)
+
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "couple": 2, "pair": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "dozen": 12
+}
+# Homophones ASR produces for numbers; only read as quantities right before an item or size.
+HOMOPHONE_NUMBERS = {"to": 2, "too": 2, "for": 4}
+
+MAX_QUANTITY = 20
+
+# Words that may sit between a quantity/size and the item it belongs to.
+FILLER_WORDS = {"x", "of", "size", "sized", "in", "the", "order", "orders", "please", "with"}
+
+# "I don't want the hawaiian": an item within NEGATION_SCOPE tokens after one of these is not ordered.
+NEGATION_WORDS = {"no", "not", "dont", "doesnt", "without", "never", "nor"}
+NEGATION_SCOPE = 4
+# Words that end a negated span before it reaches an item ("no thanks, two margheritas", "no, I want a pesto").
+CLAUSE_BREAKS = {"but", "instead", "just", "only", "rather", "actually", "thanks", "thank", "i", "id", "ill", "im", "we", "lets"}
+
+QUESTION_PATTERN = re.compile(
+    r"\?\s*$|^\s*(?:do|does|is|are|what|which|how|can you|could you|tell me|any)\b", re.IGNORECASE
+)
+
+_TOKEN_PATTERN = re.compile(r"\d+\s*(?:ml|l|liters?|litres?)\b|\d+|[a-z]+")
+
+
+def tokenize(text):
+    """Lowercased word and number tokens; apostrophes are dropped ("mia's" -> "mias"), "1 liter" -> "1l"."""
+    text = text.lower().replace("'", "").replace("’", "")
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text):
+        if token[0].isdigit() and not token.isdigit():
+            number = re.match(r"\d+", token).group()
+            token = number + ("ml" if "ml" in token else "l")
+        tokens.append(token)
+    return tokens
+
+
+def _within_distance(a, b, max_distance):
+    """Levenshtein distance between a and b is at most max_distance; stops as soon as every row exceeds it."""
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+        if min(current) > max_distance:
+            return False
+        previous = current
+    return previous[-1] <= max_distance
+
+
+class OrderParser:
+    """
+    Turns free text such as "two large hawaiian and a limonata" into order items.
+
+    Menu names and aliases are compiled into a token trie, so a message is
+    scanned once, taking the longest phrase that starts at each token.
+    Tokens that are not menu words are snapped to the closest one within a
+    small edit distance to absorb ASR and typing errors ("hawaian", "limonada").
+    """
+
+    def __init__(self, catalog):
+        self.version = catalog.version
+        self.trie = {}
+        self.vocabulary = set(SIZE_WORDS)
+        self.names = {}
+        self.sizes = {}
+
+        for key, item in catalog.items():
+            if key[0] not in ORDER_CATEGORIES:
+                continue
+            self.names[key] = item["name"]
+            self.sizes[key] = frozenset(catalog.size_prices(*key))
+            for phrase in self._phrases(key, item["name"]):
+                tokens = tokenize(phrase)
+                if tokens:
+                    self._insert(tokens, key)
+
+    def _phrases(self, key, name):
+        base = re.sub(r"\s*\(.*?\)", "", name)
+        phrases = {name, base}
+        for word in CATEGORY_WORDS.get(key[0], ()):
+            stripped = re.sub(rf"\b{word}\b", "", base, flags=re.IGNORECASE).strip()
+            if stripped and not stripped.lower().startswith("mamma mia"):
+                phrases.add(stripped)
+        parenthetical = re.search(r"\((.*?)\)", name)
+        if parenthetical and key[0] == "drinks":
+            phrases.add(parenthetical.group(1))
+        phrases.update(ALIASES.get(key, []))
+        return phrases
+
+    def _insert(self, tokens, key):
+        node = self.trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+            self.vocabulary.add(token)
+        node[None] = key
+
+    @functools.lru_cache(maxsize=4096)
+    def correct(self, token):
+        """The token itself if it is a menu word, a number or too short to guess; else its closest menu word."""
+        if token in self.vocabulary or token in NUMBER_WORDS or token in HOMOPHONE_NUMBERS or token in FILLER_WORDS \
+           or token in NEGATION_WORDS or len(token) < 5 or token.isdigit():
+            return token
+        # The nearest words win: "limonada" is one edit from "limonata" and two from "lemonade".
+        for distance in range(1, (1 if len(token) < 8 else 2) + 1):
+            matches = [word for word in self.vocabulary if len(word) >= 4 and _within_distance(token, word, distance)]
+            if matches:
+                return matches[0] if len(matches) == 1 else token
+        return token
+
+    def _match_item(self, tokens, start):
+        """Longest menu phrase starting at tokens[start]: ((category, id), end) or (None, start)."""
+        node, found, end = self.trie, None, start
+        for i in range(start, len(tokens)):
+            node = node.get(tokens[i])
+            if node is None:
+                break
+            if None in node:
+                found, end = node[None], i + 1
+        return found, end
+
+    def parse(self, text, skip_negated=True):
+        """
+        Items ordered in `text`, each {"id", "name", "category", "quantity"} plus "size"
+        when one was given. Repeated mentions of the same item and size are merged;
+        negated ones ("no hawaiian", "I don't want the pesto") are left out unless
+        `skip_negated` is False, for finding the items a question is about.
+        """
+        tokens = [self.correct(token) for token in tokenize(text)]
+        items = []
+        quantity, size = None, None
+        negation = 0  # tokens left in which a negation still applies to the next item
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            key, end = self._match_item(tokens, i)
+            if key is not None and negation and skip_negated:
+                # Skipped together with its quantity and size; "or" carries the negation on ("no hawaiian or pepperoni").
+                if size is None:
+                    _, end = self._trailing_size(tokens, end)
+                quantity, size = None, None
+                negation = NEGATION_SCOPE if end < len(tokens) and tokens[end] in ("or", "nor") else 0
+                i = end
+                continue
+            if key is not None:
+                item = {"id": key[1], "name": self.names[key], "category": key[0], "quantity": quantity or 1}
+                if size is None:
+                    size, end = self._trailing_size(tokens, end)
+                # Sizes the item does not come in are left for the clarification step.
+                if size in self.sizes[key]:
+                    item["size"] = size
+                items.append(item)
+                quantity, size = None, None
+                i = end
+                continue
+
+            if token.isdigit():
+                quantity = int(token) if 0 < int(token) <= MAX_QUANTITY else None
+            elif token in NUMBER_WORDS:
+                quantity = NUMBER_WORDS[token]
+            elif token in HOMOPHONE_NUMBERS and self._starts_order_phrase(tokens, i + 1):
+                quantity = HOMOPHONE_NUMBERS[token]
+            elif token in SIZE_WORDS:
+                size = SIZE_WORDS[token]
+
+            if token in NEGATION_WORDS:
+                negation = NEGATION_SCOPE
+            elif token in CLAUSE_BREAKS:
+                negation = 0
+            else:
+                negation = max(negation - 1, 0)
+            i += 1
+        return _merge(items)
+
+    def _trailing_size(self, tokens, end):
+        """
+        A size straight after an item ("a hawaiian, large") belongs to it unless
+        another item follows the size. Returns (size or None, index after it).
+        """
+        j = end
+        while j < len(tokens) and tokens[j] in FILLER_WORDS:
+            j += 1
+        if j < len(tokens) and tokens[j] in SIZE_WORDS:
+            k = j + 1
+            while k < len(tokens) and tokens[k] in FILLER_WORDS:
+                k += 1
+            if k >= len(tokens) or self._match_item(tokens, k)[0] is None:
+                return SIZE_WORDS[tokens[j]], j + 1
+        return None, end
+
+    def _starts_order_phrase(self, tokens, i):
+        return i < len(tokens) and (tokens[i] in SIZE_WORDS or self._match_item(tokens, i)[0] is not None)
+
+
+def _merge(items):
+    merged = {}
+    for item in items:
+        key = (item["category"], item["id"], item.get("size"))
+        if key in merged:
+            merged[key]["quantity"] += item["quantity"]
+        else:
+            merged[key] = item
+    return list(merged.values())
+
+
+@functools.lru_cache(maxsize=2)
+def _compile(menu_version):
+    return OrderParser(CATALOG)
+
+def order_parser():
+    return _compile(CATALOG.version)
+
+
+def parse_order(text):
+    """Items ordered in free text, or [] for questions and messages that name no menu item."""
+    if QUESTION_PATTERN.search(text):
+        return []
+    return order_parser().parse(text)
+
+
+def parse_size(text, available_sizes):
+    """
+    The size named in `text` among `available_sizes` (lower-cased codes such as "m"), or None.
+
+    Whole words only ("medium", "large", or a bare "m"), so "please" is not read as Small.
+    """
+    tokens = [order_parser().correct(token) for token in tokenize(text)]
+    if len(tokens) == 1 and tokens[0] in available_sizes:
+        return tokens[0]
+    for token in tokens:
+        code = SIZE_WORDS.get(token)
+        if code in available_sizes:
+            return code
+    return None
@@ -0,0 +1,229 @@
+import functools
+
+import numpy as np
+
+from .menu_catalog import CATALOG
+
+# --- Error Codes ---
+
+PRICE_OK = 0
+UNKNOWN_CATEGORY = 1
+ITEM_NOT_FOUND = 2
+INVALID_SIZE = 3
+MISSING_PRICE = 4
+MALFORMED_LINE = 5
+
+# Larger quantities are rejected as malformed; they are not real orders and overflow the price arrays.
+MAX_LINE_QUANTITY = 10000
+
+SIZED_CATEGORIES = ("pizzas", "pastas")
+
+
+class CompiledMenu:
+    """
+    Dense price arrays compiled from a MenuCatalog.
+
+    Rows are menu items. `base[item, size]` is the size price (NaN where the
+    item has no such size; column 0 holds flat drink prices),
+    `protein[item, protein]` and `addon[item, addon]` hold adjustments.
+    """
+
+    def __init__(self, catalog):
+        self.version = catalog.version
+        keys = [key for key, _ in catalog.items()]
+        self.item_index = {key: i for i, key in enumerate(keys)}
+        self.item_category = [category for category, _ in keys]
+
+        self.size_index = {"": 0}
+        self.protein_index = {}
+        self.addon_index = {}
+        for key, item in catalog.items():
+            for size in catalog.size_prices(*key):
+                self.size_index.setdefault(size, len(self.size_index))
+            for option in item.get("protein_options", []):
+                self.protein_index.setdefault(option["name"], len(self.protein_index))
+            for addon in item.get("add_ons", []):
+                self.addon_index.setdefault(addon["name"], len(self.addon_index))
+
+        n_items = len(keys)
+        self.base = np.full((n_items, len(self.size_index)), np.nan)
+        self.protein = np.zeros((n_items, max(len(self.protein_index), 1)))
+        self.addon = np.zeros((n_items, max(len(self.addon_index), 1)))
+        self.is_sized = np.zeros(n_items, dtype=bool)
+
+        for key, item in catalog.items():
+            row = self.item_index[key]
+            if key[0] in SIZED_CATEGORIES:
+                self.is_sized[row] = True
+                for size, price in catalog.size_prices(*key).items():
+                    self.base[row, self.size_index[size]] = price
+            elif "price" in item:
+                self.base[row, 0] = item["price"]
+            for option in item.get("protein_options", []):
+                self.protein[row, self.protein_index[option["name"]]] = option.get("price_adjustment", 0)
+            if key[0] == "pastas":
+                for addon in item.get("add_ons", []):
+                    self.addon[row, self.addon_index[addon["name"]]] = addon["price"]
+
+        gluten_free = catalog.data.get("gluten_free_options", {}).get("pizza_crust", {})
+        self.gluten_free_adjustment = gluten_free["price_adjustment"] if gluten_free.get("available", False) else 0
+
+
+@functools.lru_cache(maxsize=2)
+def _compile(menu_version):
+    return CompiledMenu(CATALOG)
+
+def compiled_menu():
+    return _compile(CATALOG.version)
+
+
+def _malformed_reason(item):
+    """Why a line item cannot be priced at all, or None when its fields have usable types."""
+    if not isinstance(item, dict):
+        return "line items must be objects"
+    for field in ("category", "id", "size", "protein", "crust"):
+        if item.get(field) is not None and not isinstance(item[field], str):
+            return f"{field} must be a string"
+    # Lines without a category are categorized by their name.
+    if ("name" in item or "category" not in item) and not isinstance(item.get("name"), str):
+        return "name must be a string"
+    quantity = item.get("quantity", 1)
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or not 1 <= quantity <= MAX_LINE_QUANTITY:
+        return f"quantity must be an integer from 1 to {MAX_LINE_QUANTITY}"
+    addons = item.get("addons", [])
+    if not isinstance(addons, list) or not all(isinstance(addon, str) for addon in addons):
+        return "addons must be a list of strings"
+    return None
+
+
+def _line_category(item):
+    # Prefer explicit category if available, otherwise fall back to the item name.
+    if "category" in item:
+        return item["category"]
+    name = item.get("name", "").lower()
+    if "pizza" in name:
+        return "pizzas"
+    if "pasta" in name:
+        return "pastas"
+    if "drink" in name:
+        return "drinks"
+    return None
+
+
+class BatchPriceResult:
+    """Totals (NaN for failed orders), per-order error codes and lazily built error messages."""
+
+    def __init__(self, totals, error_codes, error_lines, lines):
+        self.totals = totals
+        self.error_codes = error_codes
+        self._error_lines = error_lines
+        self._lines = lines
+
+    def __len__(self):
+        return len(self.totals)
+
+    def error_message(self, order_index):
+        code = self.error_codes[order_index]
+        if code == PRICE_OK:
+            return None
+        item = self._lines[self._error_lines[order_index]]
+        if code == MALFORMED_LINE:
+            return f"Malformed line item: {_malformed_reason(item)}"
+        name = item.get("name")
+        if code == UNKNOWN_CATEGORY:
+            return f"Unknown item category: {name}"
+        if code == ITEM_NOT_FOUND:
+            return f"Item not found in menu: {name}"
+        if code == INVALID_SIZE:
+            return f"Invalid or missing size for {name}: {item.get('size')}"
+        return f"Price information missing for drink: {name}"
+
+
+def price_orders(orders):
+    """
+    Prices many orders (each a list of line-item dicts) in one vectorized pass.
+
+    Line items are encoded into index arrays against the compiled menu, then
+    base prices, crust/protein/add-on adjustments and quantities are summed
+    per order with NumPy. An order's error code is that of its first failing line;
+    a line with unusable field types fails with MALFORMED_LINE without affecting other orders.
+    """
+    menu = compiled_menu()
+    item_index, size_index = menu.item_index, menu.size_index
+    protein_index, addon_index = menu.protein_index, menu.addon_index
+
+    order_ids, item_rows, size_cols, protein_cols, gluten_free, quantities, line_errors, lines = [], [], [], [], [], [], [], []
+    addon_lines, addon_cols = [], []
+
+    for order_id, order_items in enumerate(orders):
+        for item in order_items:
+            line = len(lines)
+            lines.append(item)
+            order_ids.append(order_id)
+
+            malformed = _malformed_reason(item) is not None
+            quantities.append(0 if malformed else item.get("quantity", 1))
+            category = None if malformed else _line_category(item)
+            row = item_index.get((category, item.get("id"))) if category is not None else None
+            if row is None:
+                line_errors.append(MALFORMED_LINE if malformed else UNKNOWN_CATEGORY if category is None else ITEM_NOT_FOUND)
+                item_rows.append(0)
+                size_cols.append(0)
+                protein_cols.append(-1)
+                gluten_free.append(False)
+                continue
+
+            line_errors.append(PRICE_OK)
+            item_rows.append(row)
+            if category in SIZED_CATEGORIES:
+                size = item.get("size")
+                size_cols.append(size_index.get(size.lower(), -1) if size else -1)
+                gluten_free.append(item.get("crust") == "gluten-free")
+                protein_cols.append(protein_index.get(item["protein"], -1) if "protein" in item else -1)
+                if category == "pastas":
+                    for addon in item.get("addons", []):
+                        col = addon_index.get(addon)
+                        if col is not None:
+                            addon_lines.append(line)
+                            addon_cols.append(col)
+            else:
+                size_cols.append(0)
+                gluten_free.append(False)
+                protein_cols.append(-1)
+
+    n_orders = len(orders)
+    if not lines:
+        return BatchPriceResult(np.zeros(n_orders), np.zeros(n_orders, dtype=np.int8), {}, lines)
+
+    order_ids = np.asarray(order_ids)
+    item_rows = np.asarray(item_rows)
+    size_cols = np.asarray(size_cols)
+    protein_cols = np.asarray(protein_cols)
+    line_errors = np.asarray(line_errors, dtype=np.int8)
+
+    valid_size = size_cols >= 0
+    prices = np.where(valid_size, menu.base[item_rows, np.where(valid_size, size_cols, 0)], np.nan)
+    missing_price = np.isnan(prices) & (line_errors == PRICE_OK)
+    line_errors[missing_price] = np.where(menu.is_sized[item_rows[missing_price]], INVALID_SIZE, MISSING_PRICE)
+
+    prices = prices + np.asarray(gluten_free) * menu.gluten_free_adjustment
+    has_protein = protein_cols >= 0
+    prices = prices + np.where(has_protein, menu.protein[item_rows, np.where(has_protein, protein_cols, 0)], 0)
+    if addon_lines:
+        addon_lines = np.asarray(addon_lines)
+        prices = prices + np.bincount(addon_lines, weights=menu.addon[item_rows[addon_lines], addon_cols], minlength=len(lines))
+
+    line_totals = np.where(line_errors == PRICE_OK, prices * np.asarray(quantities), 0.0)
+    totals = np.bincount(order_ids, weights=line_totals, minlength=n_orders)
+
+    error_codes = np.zeros(n_orders, dtype=np.int8)
+    failed_lines = np.flatnonzero(line_errors)
+    error_lines = {}
+    if len(failed_lines):
+        # Lines are in order, so the first failed line per order is its first occurrence.
+        failed_orders, first = np.unique(order_ids[failed_lines], return_index=True)
+        error_codes[failed_orders] = line_errors[failed_lines[first]]
+        totals[failed_orders] = np.nan
+        error_lines = dict(zip(failed_orders.tolist(), failed_lines[first].tolist()))
+
+    return BatchPriceResult(totals, error_codes, error_lines, lines)
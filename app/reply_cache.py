@@ -0,0 +1,96 @@
+import hashlib
+import os
+import re
+import threading
+
+from .lru_cache import LRUTTLCache
+from .menu_catalog import CATALOG
+
+# Stages whose model replies depend only on the message and the items ordered, not on
+# customer details or earlier turns. Sessions stay in "start" until items are picked from
+# the menu; awaiting_confirmation only reaches the model when the customer did not
+# confirm, so its cached reply is the re-prompt.
+DEFAULT_CACHEABLE_STAGES = ("start", "awaiting_order", "awaiting_confirmation")
+
+_WHITESPACE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = re.compile(r"^[\s\W_]+|[\s\W_]+$")
+
+
+def normalize_message(message):
+    """Lowercases, collapses whitespace and strips surrounding punctuation: "What's vegan?? " -> "what's vegan"."""
+    return _EDGE_PUNCTUATION.sub("", _WHITESPACE.sub(" ", message.lower()))
+
+
+def order_signature(state):
+    """
+    Coarse fingerprint of what is being ordered: item ids, sizes and quantities plus
+    the special request. Clarification progress and delivery details are left out.
+    """
+    items = sorted(
+        f"{item.get('category')}:{item.get('id')}:{item.get('size', '')}:{item.get('quantity', 1)}"
+        for item in (state.get("structured_order") or {}).get("items", [])
+    )
+    items.append(state.get("collected_special") or "")
+    return hashlib.sha256("|".join(items).encode("utf-8")).hexdigest()[:16]
+
+
+class ReplyCache:
+    """
+    Reuses model replies for repeatable turns ("show menu", greetings, "what's vegan?").
+
+    Replies are keyed on (stage, normalized message, menu version, order signature,
+    previous assistant reply) and only cached for stages in the allowlist. The
+    previous reply keeps short answers such as "yes" or "the second one" from
+    being reused after a different question. Entries are evicted LRU once
+    `maxsize` is reached and after `ttl` seconds without use.
+    """
+
+    def __init__(self, stages=DEFAULT_CACHEABLE_STAGES, maxsize=2048, ttl=600):
+        self.stages = frozenset(stages)
+        self._cache = LRUTTLCache(maxsize=maxsize, ttl=ttl)
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "bypassed": 0}
+        self._stats_lock = threading.Lock()
+
+    def key(self, state, message, prompt_key=None, previous_reply=""):
+        """The cache key for this turn, or None if the stage is not cacheable."""
+        if state.get("stage") not in self.stages:
+            with self._stats_lock:
+                self._stats["bypassed"] += 1
+            return None
+        context = hashlib.sha256((previous_reply or "").encode("utf-8")).hexdigest()[:16]
+        return (state["stage"], normalize_message(message), prompt_key or CATALOG.version, order_signature(state), context)
+
+    def get(self, key):
+        reply = self._cache.get(key)
+        with self._stats_lock:
+            self._stats["hits" if reply is not None else "misses"] += 1
+        return reply
+
+    def put(self, key, reply):
+        self._cache.set(key, reply)
+        with self._stats_lock:
+            self._stats["stores"] += 1
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_rate"] = round(snapshot["hits"] / lookups, 3) if lookups else 0.0
+        snapshot["entries"] = len(self._cache)
+        return snapshot
+
+
+def create_reply_cache():
+    """Builds the cache from REPLY_CACHE_* environment variables. REPLY_CACHE_SIZE=0 disables it."""
+    maxsize = int(os.environ.get("REPLY_CACHE_SIZE", 2048))
+    if maxsize <= 0:
+        return None
+    stages = os.environ.get("REPLY_CACHE_STAGES")
+    return ReplyCache(
+        stages=[s.strip() for s in stages.split(",") if s.strip()] if stages is not None else DEFAULT_CACHEABLE_STAGES,
+        maxsize=maxsize,
+        ttl=float(os.environ.get("REPLY_CACHE_TTL_SECONDS", 600))
+    )
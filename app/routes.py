@@ -1,86 +1,179 @@
-from flask import Blueprint, render_template, request, jsonify
-from .agent import generate_response
-from .speech_utils import speech_to_text
+from flask import Blueprint, render_template, request, jsonify, current_app, g, Response, stream_with_context, url_for
+from .agent import admission, generate_response, iter_response
+from .admission import SessionFlights
+from .session_store import new_order_state
+from .state_sync import capture, snapshot, state_update
+from .clarification import SUBMISSION_TYPE
+from .menu_catalog import CATALOG
+from .assets import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, menu_payload, static_fingerprint
+from .pricing import PRICE_OK, price_orders
+from .speech_utils import get_asr_pool, preprocess_stats, transcribe_async, transcribe_bytes_async
+from .audio import pcm16_to_float32
+from .voice_stream import VoiceStream
+from .metrics import COALESCED_TURNS, REGISTRY
+import logging
 import os
 import markdown
 import json
-import tempfile
 import uuid
 
+try:
+    from flask_sock import Sock
+except ImportError:  # streaming voice input is optional
+    Sock = None
+
 main = Blueprint('main', __name__)
 
-menu_path = os.path.join(os.path.dirname(__file__), "menu.json")
-with open(menu_path, "r") as f:
-    MENU_DATA = json.load(f)
-
-order_state = {
-    "messages": [],
-    "structured_order": { "items": [] },
-    "stage": "start",
-    "clarification_index": 0,
-    "collected_special": None,
-    "collected_confirmation": None,
-    "collected_name": None,
-    "collected_phone": None,
-    "collected_address": None
-}
+logger = logging.getLogger(__name__)
+
+sock = Sock() if Sock is not None else None
+
+SESSION_COOKIE = "mm_session_id"
 
 WELCOME_MESSAGE = "Hello! Welcome to Mamma Mia's Pizza, Pasta & Drinks! Please choose what you'd like from our interactive menu. Once you're done, hit the 'Done with Order' button to proceed with your choices."
 
+LISTEN_TIMEOUT_SECONDS = float(os.environ.get("LISTEN_TIMEOUT_SECONDS", 60))
+
+# How often the voice WebSocket checks for finished transcriptions while idle
+VOICE_POLL_SECONDS = 0.05
+
+PRICE_BATCH_MAX_ORDERS = int(os.environ.get("PRICE_BATCH_MAX_ORDERS", 100000))
+
+ORDER_NOT_SAVED_MESSAGE = "Sorry, we couldn't save your order just now, so it has not been placed. Your cart is still here: please send your details again in a moment, or call the restaurant."
+
+# Compare-and-set attempts a session reset makes before reporting a conflict
+RESET_ATTEMPTS = 5
+
+CONFLICT_MESSAGE = "I'm still working on your previous message. Please send that again in a moment."
+
+# --- Session Helpers ---
+
+def _session_store():
+    return current_app.extensions["order_sessions"]
+
+def _session_id():
+    session_id = request.cookies.get(SESSION_COOKIE)
+    if not session_id:
+        session_id = g.get("new_session_id")
+        if not session_id:
+            session_id = uuid.uuid4().hex
+            g.new_session_id = session_id
+    return session_id
+
+def _reset_session(session_id, first_message):
+    """
+    Starts the session over. Returns (state, version), or (None, None) when concurrent
+    turns kept committing first; versions keep increasing across resets.
+    """
+    state = new_order_state()
+    state["messages"].append(first_message)
+    store = _session_store()
+    # A reset wins over a concurrent turn: re-read and retry, but give up on a session that stays busy.
+    for _ in range(RESET_ATTEMPTS):
+        _, version = store.get(session_id)
+        new_version = store.compare_and_set(session_id, version, state)
+        if new_version is not None:
+            return state, new_version
+    logger.warning("Session %s reset lost to concurrent turns %d times", session_id, RESET_ATTEMPTS)
+    return None, None
+
+def _conflict_response(session_id):
+    """The session is busy with another message: resync the client to the latest state."""
+    latest_state, latest_version = _session_store().get(session_id)
+    return dict({"reply": CONFLICT_MESSAGE, "menu": None}, **snapshot(latest_state, latest_version)), 409
+
+def _client_ack(value):
+    """The state version the client last applied, or None."""
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+@main.after_request
+def _set_session_cookie(response):
+    if g.get("new_session_id"):
+        response.set_cookie(SESSION_COOKIE, g.new_session_id, httponly=True, samesite="Lax")
+    return response
+
 @main.route("/")
 def home():
-    order_state.clear()
-    order_state.update({
-        "messages": [],
-        "structured_order": { "items": [] },
-        "stage": "start",
-        "clarification_index": 0,
-        "collected_special": None,
-        "collected_confirmation": None,
-        "collected_name": None,
-        "collected_phone": None,
-        "collected_address": None
-    })
-    order_state["messages"].append({"user": "Bot initialized", "bot": WELCOME_MESSAGE})
-    
-    return render_template("index.html", initial_bot_message=WELCOME_MESSAGE, initial_menu_data=MENU_DATA)
+    state, _ = _reset_session(_session_id(), {"user": "Bot initialized", "bot": WELCOME_MESSAGE})
+    if state is None:
+        return CONFLICT_MESSAGE, 409
 
+    return render_template("index.html", initial_bot_message=WELCOME_MESSAGE, menu=_menu_reference())
 
-@main.route("/chat", methods=["POST"])
-def chat():
-    data = request.get_json()
-    user_input = data.get("message", "")
+
+# --- Menu & Static Assets ---
+
+def _menu_reference():
+    """What chat responses send instead of the menu itself; the URL changes with the menu version."""
+    return {"version": CATALOG.version, "url": url_for("main.menu", v=CATALOG.version)}
+
+@main.route("/menu")
+def menu():
+    payload = menu_payload()
+    if request.if_none_match.contains_weak(payload.etag):
+        response = Response(status=304)
+    else:
+        encoding, body = payload.negotiate(request.headers.get("Accept-Encoding"))
+        response = Response(body, mimetype="application/json")
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(payload.etag, weak=True)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL if request.args.get("v") == payload.version else REVALIDATE_CACHE_CONTROL
+    return response
+
+@main.app_context_processor
+def _static_url_helper():
+    def static_url(filename):
+        """URL of a static file fingerprinted with its content hash."""
+        return url_for("static", filename=filename, v=static_fingerprint(filename))
+    return {"static_url": static_url}
+
+@main.after_app_request
+def _cache_fingerprinted_static(response):
+    fingerprint = request.args.get("v")
+    if request.endpoint == "static" and response.status_code == 200 and fingerprint \
+       and fingerprint == static_fingerprint(request.view_args["filename"]):
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+# --- Chat Turn ---
+
+def _begin_chat_turn(session_id, user_input, ack=None):
+    """
+    Loads the session and rewrites the user input for the model.
+
+    `ack` is the state version the client last applied; the response patches
+    from it when it is still current. Returns a turn dict; turn["response"]
+    is already set when no model call is needed.
+    """
+    if user_input.lower() == "bot_restart_command":
+        order_state, version = _reset_session(session_id, {"user": "Bot Restarted", "bot": WELCOME_MESSAGE})
+        if order_state is None:
+            return {"response": _conflict_response(session_id)}
+        return {"response": (dict({
+            "reply": WELCOME_MESSAGE,
+            "menu": _menu_reference()
+        }, **snapshot(order_state, version)), 200)}
+
+    order_state, state_version = _session_store().get(session_id)
+    # Captured before the menu and form messages below change the state, so the patch includes their changes.
+    state_before = capture(order_state)
 
     response_to_frontend = {
         "reply": "",
-        "menu": None,
-        "structured_order": order_state["structured_order"],
-        "state": order_state
+        "menu": None
     }
 
-    if user_input.lower() == "bot_restart_command":
-        order_state.clear()
-        order_state.update({
-            "messages": [],
-            "structured_order": { "items": [] },
-            "stage": "start",
-            "clarification_index": 0,
-            "collected_special": None,
-            "collected_confirmation": None,
-            "collected_name": None,
-            "collected_phone": None,
-            "collected_address": None
-        })
-        response_to_frontend["reply"] = WELCOME_MESSAGE
-        response_to_frontend["menu"] = MENU_DATA
-        order_state["messages"].append({"user": "Bot Restarted", "bot": response_to_frontend["reply"]})
-        return jsonify(response_to_frontend)
-
     current_user_message_for_llm = user_input
+    # What the conversation history records for this message
+    message_for_history = user_input
 
     try:
         parsed_input = json.loads(user_input)
         if parsed_input.get("type") == "order_finalized_from_menu":
+            message_for_history = "I'm done choosing from the menu."
             order_state["stage"] = "awaiting_item_details"
             order_state["structured_order"]["items"] = parsed_input["items"]
             order_state["clarification_index"] = 0
@@ -88,8 +181,16 @@ def chat():
             current_user_message_for_llm = "The customer has finished selecting items from the menu. Please proceed to clarify order details for: " + ", ".join([item['name'] for item in parsed_input["items"]])
             
             response_to_frontend["menu"] = None 
+        elif parsed_input.get("type") == SUBMISSION_TYPE:
+            message_for_history = "I've chosen the options for my items."
+            # A form left over from an earlier turn: the options were already settled.
+            if order_state["stage"] != "awaiting_item_details":
+                return {"response": (dict({
+                    "reply": "Your item options are already saved.",
+                    "menu": None
+                }, **snapshot(order_state, state_version)), 200)}
 
-    except json.JSONDecodeError:
+    except (json.JSONDecodeError, AttributeError):
         pass
     
     # Check if the user asks for the menu or if the LLM detects the menu isn't visible
@@ -97,46 +198,181 @@ def chat():
     llm_detected_menu_issue = "it's not" in user_input.lower() or "not showing" in user_input.lower() or "where is it" in user_input.lower()
 
     if user_asked_for_menu or llm_detected_menu_issue:
-        response_to_frontend["menu"] = MENU_DATA
+        response_to_frontend["menu"] = _menu_reference()
         if user_asked_for_menu:
             current_user_message_for_llm = "The user asked for the menu. Please provide a brief conversational confirmation that the menu is now displayed."
         elif llm_detected_menu_issue:
              # Let the LLM handle the reply, but make sure the menu is sent to the client.
              current_user_message_for_llm = user_input
 
-    reply_result = generate_response(
-        messages=order_state["messages"],
-        new_user_message=current_user_message_for_llm,
-        current_state=order_state
-    )
+    return {
+        "response": None,
+        "user_input": user_input,
+        "message_for_llm": current_user_message_for_llm,
+        "message_for_history": message_for_history,
+        "order_state": order_state,
+        "state_version": state_version,
+        "state_before": state_before,
+        "ack": ack,
+        "response_to_frontend": response_to_frontend
+    }
+
+def _finish_chat_turn(session_id, turn, reply_result):
+    """Applies the agent's result to the session and commits it. Returns (payload, status)."""
+    order_state = turn["order_state"]
+    response_to_frontend = turn["response_to_frontend"]
+
+    # Journaled before the reset commits, so an order the journal refuses keeps its cart for a retry.
+    # append() only queues the order; the writer group-commits it without delaying this reply.
+    order = None
+    if reply_result.get("completed_order"):
+        order = dict(reply_result["completed_order"], session_id=session_id)
+        try:
+            order["order_id"] = current_app.extensions["order_journal"].append(order)
+        except OSError as e:
+            logger.error("Order for session %s was not journaled: %s", session_id, e)
+            latest_state, latest_version = _session_store().get(session_id)
+            return dict({"reply": ORDER_NOT_SAVED_MESSAGE, "menu": None}, **snapshot(latest_state, latest_version)), 200
 
     response_to_frontend["reply"] = reply_result["reply"]
     order_state.update(reply_result["state"])
 
-    if not (isinstance(user_input, str) and user_input.startswith('{"type":"order_finalized_from_menu"')):
-        order_state["messages"].append({"user": user_input, "bot": response_to_frontend["reply"]})
-    else:
-        order_state["messages"].append({"user": "I'm done choosing from the menu.", "bot": response_to_frontend["reply"]})
+    order_state["messages"].append({"user": turn["message_for_history"], "bot": response_to_frontend["reply"]})
     
     if order_state["stage"] == "completed":
         final_bot_message_for_history = response_to_frontend["reply"]
         
         order_state.clear()
-        order_state.update({
-            "messages": [],
-            "structured_order": { "items": [] },
-            "stage": "start",
-            "clarification_index": 0,
-            "collected_special": None,
-            "collected_confirmation": None,
-            "collected_name": None,
-            "collected_phone": None,
-            "collected_address": None
-        })
+        order_state.update(new_order_state())
         order_state["messages"].append({"user": "Session Restarted (Auto)", "bot": WELCOME_MESSAGE})
-        response_to_frontend["menu"] = MENU_DATA
+        response_to_frontend["menu"] = _menu_reference()
+
+    # Another request for this session committed first; keep its state rather than overwrite it.
+    new_version = _session_store().compare_and_set(session_id, turn["state_version"], order_state)
+    if new_version is None:
+        return _conflict_response(session_id)
+
+    if order is not None:
+        current_app.extensions["dispatcher"].submit(order)
 
-    return jsonify(response_to_frontend)
+    response_to_frontend.update(state_update(turn["state_before"], order_state, turn["state_version"], new_version, turn["ack"]))
+    return response_to_frontend, 200
+
+def _chat_flights():
+    return current_app.extensions["chat_flights"]
+
+def _follow_flight(session_id, role, flight):
+    """A duplicate submit gets the in-flight turn's result; a different message while busy gets a 409."""
+    if role == SessionFlights.FOLLOWER and flight.done.wait(admission.turn_deadline + 5) and flight.result is not None:
+        COALESCED_TURNS.inc()
+        return flight.result
+    return _conflict_response(session_id)
+
+def _run_chat_turn(session_id, user_input, ack=None):
+    """Runs one complete /chat turn. Returns (payload, status)."""
+    role, flight = _chat_flights().join(session_id, user_input)
+    if role != SessionFlights.LEADER:
+        return _follow_flight(session_id, role, flight)
+
+    result = None
+    try:
+        turn = _begin_chat_turn(session_id, user_input, ack)
+        if turn["response"] is not None:
+            result = turn["response"]
+            return result
+
+        reply_result = generate_response(
+            messages=turn["order_state"]["messages"],
+            new_user_message=turn["message_for_llm"],
+            current_state=turn["order_state"]
+        )
+
+        result = _finish_chat_turn(session_id, turn, reply_result)
+        return result
+    finally:
+        _chat_flights().finish(session_id, flight, result)
+
+@main.route("/chat", methods=["POST"])
+def chat():
+    data = request.get_json()
+    user_input = data.get("message", "")
+
+    payload, status = _run_chat_turn(_session_id(), user_input, _client_ack(data.get("ack")))
+    return jsonify(payload), status
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@main.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """
+    Same turn as /chat, streamed as Server-Sent Events: "delta" events carry
+    reply text as the model generates it, and one final "done" event carries
+    the /chat payload. The session is only committed once the stream finishes.
+    """
+    data = request.get_json()
+    user_input = data.get("message", "")
+
+    session_id = _session_id()
+    flights = _chat_flights()
+    role, flight = flights.join(session_id, user_input)
+
+    def events():
+        if role != SessionFlights.LEADER:
+            payload, status = _follow_flight(session_id, role, flight)
+            yield _sse("done", dict(payload, status=status))
+            return
+
+        result = None
+        try:
+            turn = _begin_chat_turn(session_id, user_input, _client_ack(data.get("ack")))
+            if turn["response"] is not None:
+                result = turn["response"]
+            else:
+                reply_result = None
+                for event, event_payload in iter_response(
+                    turn["order_state"]["messages"],
+                    turn["message_for_llm"],
+                    turn["order_state"],
+                    stream=True
+                ):
+                    if event == "delta":
+                        yield _sse("delta", {"text": event_payload})
+                    else:
+                        reply_result = event_payload
+
+                result = _finish_chat_turn(session_id, turn, reply_result)
+            payload, status = result
+            yield _sse("done", dict(payload, status=status))
+        finally:
+            flights.finish(session_id, flight, result)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@main.route("/price/batch", methods=["POST"])
+def price_batch():
+    """
+    Prices many orders at once: {"orders": [[line items...], ...]} ->
+    {"totals": [...], "errors": [null | {"code": n, "message": "..."}], "menu_version": "..."}
+    """
+    data = request.get_json(silent=True) or {}
+    orders = data.get("orders")
+    if not isinstance(orders, list) or not all(isinstance(order, list) for order in orders):
+        return jsonify({"error": "Expected {\"orders\": [[line items...], ...]}"}), 400
+    if len(orders) > PRICE_BATCH_MAX_ORDERS:
+        return jsonify({"error": f"At most {PRICE_BATCH_MAX_ORDERS} orders per request"}), 413
+
+    result = price_orders(orders)
+    errors = [
+        None if code == PRICE_OK else {"code": int(code), "message": result.error_message(i)}
+        for i, code in enumerate(result.error_codes.tolist())
+    ]
+    totals = [None if error else total for total, error in zip(result.totals.tolist(), errors)]
+    return jsonify({"totals": totals, "errors": errors, "menu_version": CATALOG.version})
 
 @main.route("/listen", methods=["POST"])
 def listen():
@@ -145,15 +381,96 @@ def listen():
 
     audio_file = request.files["audio_data"]
     
-    temp_dir = tempfile.gettempdir()
-    temp_audio_path = os.path.join(temp_dir, f"{uuid.uuid4()}.wav")
-    audio_file.save(temp_audio_path)
-    
     try:
-        transcript = speech_to_text(temp_audio_path)
-        return jsonify({"transcript": transcript})
+        transcription, seconds_saved = transcribe_bytes_async(audio_file.read())
+        transcript = transcription.result(timeout=LISTEN_TIMEOUT_SECONDS)
+        return jsonify({"transcript": transcript, "audio_seconds_saved": round(seconds_saved, 2)})
     except Exception as e:
-        print(f"Error in speech_to_text: {e}")
+        logger.error("Error in speech_to_text: %s", e)
         return jsonify({"error": "Could not process audio"}), 500
-    finally:
-        os.remove(temp_audio_path)
\ No newline at end of file
+
+@main.route("/metrics")
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@main.route("/admission/stats")
+def admission_stats():
+    return jsonify(dict(admission.stats(), sessions=_chat_flights().stats()))
+
+@main.route("/asr/stats")
+def asr_stats():
+    return jsonify(dict(get_asr_pool().stats(), preprocessing=preprocess_stats))
+
+
+# --- Delivery Dispatch ---
+
+@main.route("/dispatch/batches")
+def dispatch_batches():
+    """Recent delivery batches, newest first; ?status=open|claimed filters them."""
+    status = request.args.get("status")
+    if status not in (None, "open", "claimed"):
+        return jsonify({"error": "status must be open or claimed"}), 400
+    limit = request.args.get("limit", 100, type=int)
+    return jsonify({"batches": current_app.extensions["dispatcher"].batches(status=status, limit=max(1, min(limit, 1000)))})
+
+@main.route("/dispatch/batches/<int:batch_id>/claim", methods=["POST"])
+def dispatch_claim(batch_id):
+    driver = (request.get_json(silent=True) or {}).get("driver")
+    if not isinstance(driver, str) or not driver.strip():
+        return jsonify({"error": "Expected {\"driver\": \"...\"}"}), 400
+    batch = current_app.extensions["dispatcher"].claim(batch_id, driver.strip())
+    if batch is None:
+        return jsonify({"error": "Batch not found or already claimed"}), 409
+    return jsonify(batch)
+
+@main.route("/dispatch/stats")
+def dispatch_stats():
+    return jsonify(current_app.extensions["dispatcher"].stats())
+
+
+# --- Streaming Voice ---
+
+if sock is not None:
+    @sock.route("/listen/stream", bp=main)
+    def listen_stream(ws):
+        """
+        Streaming voice input. The client sends 16 kHz mono 16-bit PCM as binary
+        frames and {"type": "end"} when the customer stops recording. The server
+        answers with {"type": "partial"} transcripts while they speak, then a
+        {"type": "final"} transcript per utterance followed by the /chat reply
+        for it as {"type": "reply", ...}. A text frame that is not a JSON object,
+        or a binary frame that is not whole 16-bit samples, gets {"type": "error"}
+        and the stream carries on.
+        """
+        session_id = _session_id()
+        stream = VoiceStream(transcribe_async)
+        ending = False
+        # The client applies every reply sent on this socket, so each one acknowledges the last.
+        ack = _client_ack(request.args.get("ack", type=int))
+
+        while True:
+            message = ws.receive(timeout=VOICE_POLL_SECONDS)
+            if isinstance(message, (bytes, bytearray)):
+                if len(message) % 2:
+                    ws.send(json.dumps({"type": "error", "error": "Audio frames must hold whole 16-bit PCM samples"}))
+                    continue
+                stream.feed(pcm16_to_float32(bytes(message)))
+            elif message:
+                try:
+                    control = json.loads(message).get("type")
+                except (ValueError, AttributeError):
+                    ws.send(json.dumps({"type": "error", "error": "Expected a JSON object such as {\"type\": \"end\"}"}))
+                    continue
+                if control == "end":
+                    stream.finish()
+                    ending = True
+
+            for event in stream.poll():
+                ws.send(json.dumps(event))
+                if event["type"] == "final" and event["text"]:
+                    payload, status = _run_chat_turn(session_id, event["text"], ack)
+                    ack = payload["version"]
+                    ws.send(json.dumps(dict(payload, type="reply", status=status)))
+
+            if ending and not stream.pending:
+                break
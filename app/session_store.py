@@ -0,0 +1,163 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .lru_cache import LRUTTLCache
+
+
+def new_order_state():
+    """Returns a fresh per-session order state."""
+    return {
+        "messages": [],
+        "structured_order": { "items": [] },
+        "stage": "start",
+        "clarification_index": 0,
+        "clarification_form": None,
+        "collected_special": None,
+        "collected_confirmation": None,
+        "collected_name": None,
+        "collected_phone": None,
+        "collected_address": None
+    }
+
+
+class MemorySessionStore:
+    """
+    In-process session store: an LRU of session_id -> (version, state) with idle-time eviction.
+
+    Every successful compare_and_set bumps the version, so two requests that
+    read the same version cannot both commit their changes.
+    """
+
+    def __init__(self, max_sessions=10000, ttl=3600, clock=time.monotonic):
+        self._sessions = LRUTTLCache(maxsize=max_sessions, ttl=ttl, clock=clock)
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """Returns (state, version). Unknown or expired sessions start fresh at version 0."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+        if entry is None:
+            return new_order_state(), 0
+        version, state = entry
+        return copy.deepcopy(state), version
+
+    def compare_and_set(self, session_id, expected_version, new_state):
+        """Stores new_state if the session is still at expected_version. Returns the new version or None."""
+        snapshot = copy.deepcopy(new_state)
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            current_version = entry[0] if entry is not None else 0
+            if current_version != expected_version:
+                return None
+            self._sessions.set(session_id, (current_version + 1, snapshot))
+            return current_version + 1
+
+    def expire(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionStore:
+    """
+    Session store backed by a SQLite database in WAL mode.
+
+    Lets several gunicorn workers on the same host share sessions. Each thread
+    gets its own connection; compare_and_set is a single conditional UPDATE.
+    """
+
+    def __init__(self, path, ttl=3600, purge_every=500, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self._clock = clock
+        self._purge_every = purge_every
+        self._writes = 0
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, "
+            "version INTEGER NOT NULL, "
+            "state TEXT NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions(updated_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        # SQLite connections must not be used across fork (e.g. one opened in a preloading gunicorn master).
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _cutoff(self):
+        return self._clock() - self.ttl if self.ttl is not None else float("-inf")
+
+    def get(self, session_id):
+        row = self._connect().execute(
+            "SELECT version, state FROM sessions WHERE session_id = ? AND updated_at >= ?",
+            (session_id, self._cutoff())
+        ).fetchone()
+        if row is None:
+            return new_order_state(), 0
+        return json.loads(row[1]), row[0]
+
+    def compare_and_set(self, session_id, expected_version, new_state):
+        conn = self._connect()
+        payload = json.dumps(new_state, separators=(",", ":"))
+        now = self._clock()
+        if expected_version == 0:
+            # A fresh session: replace any expired leftover row, but never a live one.
+            cursor = conn.execute(
+                "INSERT INTO sessions (session_id, version, state, updated_at) VALUES (?, 1, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET version = 1, state = excluded.state, "
+                "updated_at = excluded.updated_at WHERE sessions.updated_at < ?",
+                (session_id, payload, now, self._cutoff())
+            )
+        else:
+            cursor = conn.execute(
+                "UPDATE sessions SET version = version + 1, state = ?, updated_at = ? "
+                "WHERE session_id = ? AND version = ? AND updated_at >= ?",
+                (payload, now, session_id, expected_version, self._cutoff())
+            )
+        if cursor.rowcount != 1:
+            return None
+
+        self._writes += 1
+        if self._writes % self._purge_every == 0:
+            self.purge_expired()
+        return expected_version + 1
+
+    def expire(self, session_id):
+        self._connect().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def purge_expired(self):
+        self._connect().execute("DELETE FROM sessions WHERE updated_at < ?", (self._cutoff(),))
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+def create_session_store(url="memory", ttl=3600, max_sessions=10000):
+    """
+    Builds a session store from a URL: "memory" or "sqlite:///path/to/sessions.db".
+    """
+    if url == "memory":
+        return MemorySessionStore(max_sessions=max_sessions, ttl=ttl)
+    if url.startswith("sqlite:///"):
+        path = url[len("sqlite:///"):]
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return SQLiteSessionStore(path, ttl=ttl)
+    raise ValueError(f"Unsupported session store URL: {url}")
@@ -1,18 +1,74 @@
-import whisper
-import tempfile
+import logging
 import os
-import uuid
+import threading
+from concurrent.futures import Future
 
-# Load Whisper model
-model = whisper.load_model("base")
+from . import metrics
+from .asr_pool import create_asr_pool
+from .audio import SAMPLE_RATE, decode_audio_bytes, trim_silence
+
+logger = logging.getLogger(__name__)
+
+# Whisper replicas behind a batching request queue, started on first use. Worker threads
+# do not survive fork, so a pool created before a gunicorn fork is rebuilt in each worker.
+_asr_pool = None
+_asr_pool_pid = None
+_asr_pool_lock = threading.Lock()
+
+def get_asr_pool():
+    global _asr_pool, _asr_pool_pid
+    pool = _asr_pool
+    if pool is not None and _asr_pool_pid == os.getpid():
+        return pool
+    with _asr_pool_lock:
+        if _asr_pool is None or _asr_pool_pid != os.getpid():
+            _asr_pool = create_asr_pool()
+            _asr_pool_pid = os.getpid()
+        return _asr_pool
+
+def transcribe_async(audio):
+    """
+    Queue an audio file path (or 16 kHz float32 array) for transcription; returns a Future
+    """
+    return get_asr_pool().submit(audio)
+
+# Audio removed by silence trimming before it reaches Whisper
+preprocess_stats = {"clips": 0, "audio_seconds": 0.0, "audio_seconds_saved": 0.0}
+_preprocess_lock = threading.Lock()
+
+def preprocess_audio(data):
+    """
+    Decode uploaded audio bytes in memory and trim leading/trailing silence.
+    Returns (samples, seconds saved)
+    """
+    samples = decode_audio_bytes(data)
+    trimmed, seconds_saved = trim_silence(samples)
+    metrics.AUDIO_DURATION_SECONDS.observe(len(samples) / SAMPLE_RATE, phase="uploaded")
+    metrics.AUDIO_DURATION_SECONDS.observe(len(trimmed) / SAMPLE_RATE, phase="trimmed")
+    with _preprocess_lock:
+        preprocess_stats["clips"] += 1
+        preprocess_stats["audio_seconds"] += len(samples) / SAMPLE_RATE
+        preprocess_stats["audio_seconds_saved"] += seconds_saved
+    return trimmed, seconds_saved
+
+def transcribe_bytes_async(data):
+    """
+    Preprocess uploaded audio bytes and queue them for transcription.
+    Returns (Future, seconds saved); empty clips resolve to "" without running Whisper
+    """
+    samples, seconds_saved = preprocess_audio(data)
+    if len(samples) == 0:
+        future = Future()
+        future.set_result("")
+        return future, seconds_saved
+    return transcribe_async(samples), seconds_saved
 
 def speech_to_text(audio_path):
     """
     Transcribe audio file to text using Whisper
     """
     try:
-        result = model.transcribe(audio_path)
-        return result["text"]
+        return transcribe_async(audio_path).result()
     except Exception as e:
-        print(f"Whisper transcription error: {e}")
-        return ""
\ No newline at end of file
+        logger.error("Whisper transcription error: %s", e)
+        return ""
@@ -0,0 +1,51 @@
+import copy
+
+# Order state fields the browser sees. Delivery details and the raw history never leave
+# the server; messages are sent separately, as the turns added since the client's version.
+PUBLIC_STATE_KEYS = (
+    "stage",
+    "structured_order",
+    "clarification_index",
+    "clarification_form",
+    "collected_special",
+    "collected_confirmation"
+)
+
+
+def public_state(state):
+    return {key: state.get(key) for key in PUBLIC_STATE_KEYS}
+
+
+def capture(state):
+    """What state_update() needs from the state before a turn mutates it in place."""
+    messages = state.get("messages", [])
+    return {
+        "public": copy.deepcopy(public_state(state)),
+        "message_count": len(messages),
+        "last_message": messages[-1] if messages else None
+    }
+
+
+def snapshot(state, version):
+    """The full client state, for new clients and resyncs."""
+    return {"version": version, "snapshot": {"state": public_state(state), "messages": state.get("messages", [])}}
+
+
+def state_update(before, state, base_version, version, ack):
+    """
+    The client's state change for one turn.
+
+    When the client has acknowledged `base_version` (the version the turn
+    started from) this is a patch holding only the changed fields and the
+    messages added by the turn, so its size does not grow with the
+    conversation. Otherwise, or when the history was reset, it is a snapshot.
+    """
+    messages = state.get("messages", [])
+    count = before["message_count"]
+    extends_history = len(messages) >= count and (count == 0 or messages[count - 1] == before["last_message"])
+    if ack != base_version or not extends_history:
+        return snapshot(state, version)
+
+    current = public_state(state)
+    changed = {key: value for key, value in current.items() if before["public"][key] != value}
+    return {"version": version, "patch": {"base": ack, "state": changed, "messages": messages[count:]}}
@@ -9,15 +9,44 @@ const restartButton = document.getElementById("restart-btn");
 // Keep track of selected items in order
 let currentOrderItems = []; // Initialize here to ensure it's always an array
 
+// Order state mirrored from the server. Responses carry either a full snapshot or a
+// patch against the version we acknowledged; `version` is null until the first snapshot.
+let sessionState = { version: null, state: {}, messages: [] };
+
+function applyStateUpdate(data) {
+  if (data.snapshot) {
+    sessionState = { version: data.version, state: data.snapshot.state, messages: data.snapshot.messages };
+  } else if (data.patch && data.patch.base === sessionState.version) {
+    Object.assign(sessionState.state, data.patch.state);
+    sessionState.messages.push(...data.patch.messages);
+    sessionState.version = data.version;
+  } else {
+    // A patch we cannot apply; the next request asks for a snapshot.
+    sessionState.version = null;
+  }
+}
+
 function restartChat() {
   chatBox.innerHTML = "";
   removeCurrentMenu();
+  removeOptionsForm();
   currentOrderItems = [];
   sendMessage("BOT_RESTART_COMMAND"); // This signals a fresh start
 }
 // Keep a reference to the currently displayed menu div
 let currentMenuDiv = null;
 
+// Responses reference the menu as {version, url}; it is fetched once per version
+let cachedMenu = null;
+
+async function loadMenu(menuRef) {
+  if (!cachedMenu || cachedMenu.version !== menuRef.version) {
+    const response = await fetch(menuRef.url);
+    cachedMenu = { version: menuRef.version, data: await response.json() };
+  }
+  return cachedMenu.data;
+}
+
 function appendMessage(text, isUser) {
   const msg = document.createElement("div");
   msg.className = "chat-bubble " + (isUser ? "user-msg" : "bot-msg");
@@ -135,35 +164,195 @@ function finishOrder() {
   // The menu will now only be removed if the bot's response does not contain menu data.
 }
 
-// Send user message to backend and handle reply
+// Item options form. While sizes and other options are missing, the server puts a form spec in
+// state.clarification_form; every answer goes back in one "item_options_submitted" message.
+let currentOptionsForm = null;
+
+function removeOptionsForm() {
+  if (currentOptionsForm) {
+    currentOptionsForm.remove();
+    currentOptionsForm = null;
+  }
+}
+
+function renderOptionsForm(form) {
+  removeOptionsForm();
+
+  const formElement = document.createElement("form");
+  formElement.className = "interactive-menu-container options-form";
+  currentOptionsForm = formElement;
+
+  form.items.forEach(item => {
+    const section = document.createElement("fieldset");
+    section.className = "menu-section";
+    const header = document.createElement("legend");
+    header.className = "menu-section-header";
+    header.textContent = `${item.quantity}x ${item.name}`;
+    section.appendChild(header);
+
+    item.fields.forEach(field => {
+      const row = document.createElement("div");
+      row.className = "options-field";
+      const label = document.createElement("span");
+      label.className = "options-label";
+      label.textContent = field.label;
+      row.appendChild(label);
+
+      field.options.forEach(option => {
+        const input = document.createElement("input");
+        input.type = field.type === "multi" ? "checkbox" : "radio";
+        input.name = `${item.index}-${field.name}`;
+        input.value = option.value;
+        input.required = field.required && field.type !== "multi";
+        input.checked = field.type === "multi" ? (field.default || []).includes(option.value) : field.default === option.value;
+
+        // Sizes show their price; other options show what they add to it.
+        let price = "";
+        if (field.name === "size") price = ` ($${option.price})`;
+        else if (option.price) price = ` (+$${option.price})`;
+
+        const optionLabel = document.createElement("label");
+        optionLabel.appendChild(input);
+        optionLabel.append(` ${option.label}${price}`);
+        row.appendChild(optionLabel);
+      });
+
+      if (field.error) {
+        const error = document.createElement("div");
+        error.className = "options-error";
+        error.textContent = field.error;
+        row.appendChild(error);
+      }
+      section.appendChild(row);
+    });
+    formElement.appendChild(section);
+  });
+
+  const submitBtn = document.createElement("button");
+  submitBtn.type = "submit";
+  submitBtn.className = "done-order-btn";
+  submitBtn.textContent = "Confirm options";
+  formElement.appendChild(submitBtn);
+
+  formElement.addEventListener("submit", e => {
+    e.preventDefault();
+    submitOptionsForm(form, formElement);
+  });
+
+  chatBox.appendChild(formElement);
+  chatBox.scrollTop = chatBox.scrollHeight;
+}
+
+function submitOptionsForm(form, formElement) {
+  const items = form.items.map(item => {
+    const answer = { index: item.index };
+    item.fields.forEach(field => {
+      const inputs = Array.from(formElement.querySelectorAll(`input[name="${item.index}-${field.name}"]`));
+      if (field.type === "multi") {
+        answer[field.name] = inputs.filter(input => input.checked).map(input => input.value);
+      } else {
+        const checked = inputs.find(input => input.checked);
+        if (checked) answer[field.name] = checked.value;
+      }
+    });
+    return answer;
+  });
+
+  removeOptionsForm();
+  appendMessage("I've chosen the options for my items.", true);
+  sendMessage(JSON.stringify({ type: "item_options_submitted", items: items }));
+}
+
+// Read a Server-Sent Events body from a fetch response, calling onEvent(name, data) per event
+async function readEventStream(response, onEvent) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let eventName = "message";
+      let dataText = "";
+      rawEvent.split("\n").forEach(line => {
+        if (line.startsWith("event: ")) eventName = line.slice(7);
+        else if (line.startsWith("data: ")) dataText += line.slice(6);
+      });
+      if (dataText) onEvent(eventName, JSON.parse(dataText));
+    }
+  }
+}
+
+// Send user message to backend and render the reply as it streams in
 async function sendMessage(text) {
-  // Do NOT append the BOT_RESTART_COMMAND or the special JSON message
+  // Do NOT append the BOT_RESTART_COMMAND or the special JSON messages
   // to the chatbox directly as user input, as they are internal.
-  if (text !== "BOT_RESTART_COMMAND" && !text.startsWith('{"type":"order_finalized_from_menu"')) {
+  if (text !== "BOT_RESTART_COMMAND" && !text.startsWith('{"type":"')) {
     appendMessage(text, true);
   }
 
-  const response = await fetch("/chat", {
+  const response = await fetch("/chat/stream", {
     method: "POST",
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ message: text })
+    body: JSON.stringify({ message: text, ack: sessionState.version })
   });
 
-  const data = await response.json();
+  // Bubble that receives streamed text; created on the first delta
+  let streamingBubble = null;
+  let streamedText = "";
+
+  await readEventStream(response, (eventName, data) => {
+    if (eventName === "delta") {
+      if (!streamingBubble) {
+        streamingBubble = document.createElement("div");
+        streamingBubble.className = "chat-bubble bot-msg";
+        chatBox.appendChild(streamingBubble);
+      }
+      streamedText += data.text;
+      streamingBubble.textContent = streamedText;
+      chatBox.scrollTop = chatBox.scrollHeight;
+    } else if (eventName === "done") {
+      handleBotResponse(data, streamingBubble);
+    }
+  });
+}
+
+async function handleBotResponse(data, streamingBubble) {
   console.log("Bot response:", data);
+  applyStateUpdate(data);
 
-  // Crucial: Only render menu if data.menu is explicitly present and not empty
-  if (data.menu && Object.keys(data.menu).length > 0) {
-    renderMenu(data.menu);
+  // Crucial: Only render menu if data.menu is explicitly present
+  if (data.menu && data.menu.url) {
+    renderMenu(await loadMenu(data.menu));
   } else {
     // If bot sends no menu data, remove any existing menu
     removeCurrentMenu(); 
   }
 
-  // Always append bot's text reply
-  if (data.reply) {
+  if (streamingBubble) {
+    // Replace the streamed text with the final reply and keep it below any menu
+    streamingBubble.innerHTML = data.reply || "";
+    chatBox.appendChild(streamingBubble);
+    chatBox.scrollTop = chatBox.scrollHeight;
+  } else if (data.reply) {
+    // Always append bot's text reply
     appendMessage(data.reply, false);
   }
+
+  // Show the options form below the reply while any item option is still missing
+  const optionsForm = sessionState.state.clarification_form;
+  if (optionsForm) {
+    renderOptionsForm(optionsForm);
+  } else {
+    removeOptionsForm();
+  }
 }
 
 chatForm.addEventListener("submit", (e) => {
@@ -180,9 +369,74 @@ restartButton.addEventListener("click", restartChat);
 let mediaRecorder;
 let audioChunks = [];
 
+// Streaming voice: audio goes to the server over a WebSocket while the user speaks
+let voiceSession = null;
+
+function openVoiceSocket() {
+  return new Promise(resolve => {
+    const protocol = window.location.protocol === "https:" ? "wss:" : "ws:";
+    const ack = sessionState.version === null ? "" : `?ack=${sessionState.version}`;
+    const ws = new WebSocket(`${protocol}//${window.location.host}/listen/stream${ack}`);
+    ws.binaryType = "arraybuffer";
+    ws.onopen = () => resolve(ws);
+    ws.onerror = () => resolve(null); // Server without streaming support: fall back to uploads
+  });
+}
+
+async function startStreamingVoice(stream) {
+  if (!window.WebSocket || !window.AudioContext) return false;
+  const ws = await openVoiceSocket();
+  if (!ws) return false;
+
+  ws.onmessage = event => {
+    const data = JSON.parse(event.data);
+    if (data.type === "partial") {
+      userInput.value = data.text; // Live transcript while the user is still talking
+    } else if (data.type === "final") {
+      userInput.value = "";
+      if (data.text) appendMessage(data.text, true);
+    } else if (data.type === "reply") {
+      handleBotResponse(data, null);
+    }
+  };
+
+  // Whisper expects 16 kHz mono; send it as 16-bit PCM
+  const audioContext = new AudioContext({ sampleRate: 16000 });
+  const source = audioContext.createMediaStreamSource(stream);
+  const processor = audioContext.createScriptProcessor(4096, 1, 1);
+  processor.onaudioprocess = event => {
+    const samples = event.inputBuffer.getChannelData(0);
+    const pcm = new Int16Array(samples.length);
+    for (let i = 0; i < samples.length; i++) {
+      const s = Math.max(-1, Math.min(1, samples[i]));
+      pcm[i] = s < 0 ? s * 0x8000 : s * 0x7fff;
+    }
+    if (ws.readyState === WebSocket.OPEN) ws.send(pcm.buffer);
+  };
+  source.connect(processor);
+  processor.connect(audioContext.destination);
+
+  voiceSession = { ws, audioContext, processor, stream };
+  return true;
+}
+
+function stopStreamingVoice() {
+  const { ws, audioContext, processor, stream } = voiceSession;
+  voiceSession = null;
+  processor.disconnect();
+  audioContext.close();
+  stream.getTracks().forEach(track => track.stop());
+  // The server closes the socket after sending the last transcript and reply
+  if (ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({ type: "end" }));
+}
+
 micButton.addEventListener("click", async () => {
   if (micButton.dataset.recording === "true") {
-    mediaRecorder.stop();
+    if (voiceSession) {
+      stopStreamingVoice();
+    } else {
+      mediaRecorder.stop();
+    }
     micButton.textContent = "🎤";
     micButton.dataset.recording = "false";
   } else {
@@ -192,12 +446,17 @@ micButton.addEventListener("click", async () => {
     }
 
     const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
-    mediaRecorder = new MediaRecorder(stream);
 
-    mediaRecorder.start();
     micButton.textContent = "🎙️ Recording...";
     micButton.dataset.recording = "true";
 
+    if (await startStreamingVoice(stream)) {
+      return;
+    }
+
+    mediaRecorder = new MediaRecorder(stream);
+    mediaRecorder.start();
+
     audioChunks = [];
 
     mediaRecorder.addEventListener("dataavailable", event => {
@@ -0,0 +1,68 @@
+from .audio import SAMPLE_RATE, UtteranceDetector
+
+
+class VoiceStream:
+    """
+    Incremental transcription for one streaming voice connection.
+
+    Audio is fed in as float32 chunks. While the customer is speaking, the
+    utterance so far is re-transcribed every `partial_interval` seconds of new
+    audio (one request in flight at a time). When the VAD detects the end of
+    the utterance it is transcribed once more as the final transcript.
+    poll() returns the events that are ready: {"type": "partial"|"final", "text": ...}.
+    """
+
+    def __init__(self, transcribe_async, detector=None, partial_interval=0.8):
+        self.transcribe_async = transcribe_async
+        self.detector = detector or UtteranceDetector()
+        self.partial_samples = int(partial_interval * SAMPLE_RATE)
+        self._partial_future = None
+        self._partial_submitted_at = 0
+        self._last_partial_text = ""
+        self._final_futures = []
+
+    def feed(self, samples):
+        for utterance in self.detector.feed(samples):
+            self._submit_final(utterance)
+
+    def finish(self):
+        """The client stopped sending audio: finalize whatever is being spoken."""
+        utterance = self.detector.flush()
+        if utterance is not None:
+            self._submit_final(utterance)
+
+    @property
+    def pending(self):
+        """True while a final transcript is still being produced."""
+        return bool(self._final_futures)
+
+    def _submit_final(self, utterance):
+        self._final_futures.append(self.transcribe_async(utterance))
+        # A partial for the finished utterance is obsolete.
+        self._partial_future = None
+        self._partial_submitted_at = 0
+        self._last_partial_text = ""
+
+    def poll(self):
+        events = []
+
+        if self._partial_future is not None and self._partial_future.done():
+            future, self._partial_future = self._partial_future, None
+            if future.exception() is None:
+                text = future.result().strip()
+                if text and text != self._last_partial_text:
+                    self._last_partial_text = text
+                    events.append({"type": "partial", "text": text})
+
+        while self._final_futures and self._final_futures[0].done():
+            future = self._final_futures.pop(0)
+            text = future.result().strip() if future.exception() is None else ""
+            events.append({"type": "final", "text": text})
+
+        if self.detector.in_speech and self._partial_future is None:
+            audio = self.detector.current_utterance()
+            if len(audio) - self._partial_submitted_at >= self.partial_samples:
+                self._partial_submitted_at = len(audio)
+                self._partial_future = self.transcribe_async(audio)
+
+        return events
@@ -0,0 +1,230 @@
+"""
+Speech-to-text benchmark for the ASR backends in app.asr_pool.
+
+Transcribes the ordering phrases in bench/fixtures/asr/phrases.json with
+every combination of the given model sizes, quantization modes, thread
+counts and beam sizes. Each configuration runs in its own forked process,
+so its peak memory is its own. Reported per configuration:
+- model load time
+- real-time factor: transcription time / audio duration, one clip at a time
+  after a warm-up clip (below 1.0 is faster than real time)
+- peak RSS of the process
+- word error rate against the reference text
+- item accuracy: clips whose transcript parses (app.order_parser) to the same
+  items, sizes and quantities as the reference text
+
+The fastest configuration that reaches --min-item-accuracy is printed as
+ASR_* settings. Clips missing from the fixture directory are synthesized with
+--synthesize (espeak-ng by default, see --tts-command); recorded 16 kHz WAVs
+under the same file names work too.
+
+    python -m bench.asr --synthesize
+    python -m bench.asr --models tiny.en base.en --quantize none int8 --threads 2 4 --beam-sizes 1 5
+    python -m bench.asr --backend faster-whisper --models base.en --quantize int8
+"""
+
+import argparse
+import itertools
+import json
+import os
+import re
+import resource
+import shlex
+import subprocess
+import sys
+import time
+
+from app.asr_pool import ASR_BACKENDS, FakeTranscriber
+from app.audio import SAMPLE_RATE, decode_audio_bytes
+from app.order_parser import NUMBER_WORDS, order_parser
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "asr")
+DEFAULT_TTS_COMMAND = "espeak-ng -v en-us -s 150 -w {path} {text}"
+
+# Whisper writes small numbers as digits; score "2" and "two" as the same word.
+_DIGIT_WORDS = {str(n): word for word, n in NUMBER_WORDS.items() if word not in ("a", "an", "couple", "pair", "dozen")}
+
+
+# --- Fixtures ---
+
+def load_fixtures(fixture_dir):
+    with open(os.path.join(fixture_dir, "phrases.json")) as f:
+        return json.load(f)
+
+
+def synthesize_missing(fixtures, fixture_dir, tts_command):
+    """Speaks each missing clip with `tts_command` ({path} and {text} are filled in per argument)."""
+    for fixture in fixtures:
+        path = os.path.join(fixture_dir, fixture["file"])
+        if os.path.exists(path):
+            continue
+        args = [arg.format(path=path, text=fixture["text"]) for arg in shlex.split(tts_command)]
+        subprocess.run(args, check=True, capture_output=True)
+        print(f"synthesized {fixture['file']}")
+
+
+def load_clips(fixtures, fixture_dir):
+    """[(fixture, float32 16 kHz samples)]; exits with a hint when a clip is missing."""
+    missing = [f["file"] for f in fixtures if not os.path.exists(os.path.join(fixture_dir, f["file"]))]
+    if missing:
+        sys.exit(f"missing {len(missing)} clip(s) in {fixture_dir} (e.g. {missing[0]}); "
+                 f"run with --synthesize or record them as 16 kHz WAV")
+    clips = []
+    for fixture in fixtures:
+        with open(os.path.join(fixture_dir, fixture["file"]), "rb") as f:
+            clips.append((fixture, decode_audio_bytes(f.read())))
+    return clips
+
+
+# --- Scoring ---
+
+def normalize_words(text):
+    words = re.sub(r"[^a-z0-9' ]+", " ", text.lower().replace("-", " ")).split()
+    return [_DIGIT_WORDS.get(word, word) for word in words]
+
+
+def word_errors(reference, hypothesis):
+    """Word-level edit distance (substitutions + deletions + insertions)."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1]
+
+
+def parsed_items(text):
+    return sorted((item["id"], item.get("size"), item["quantity"]) for item in order_parser().parse(text))
+
+
+def score(clips, transcripts):
+    errors = words = items_correct = 0
+    misses = []
+    for (fixture, _), transcript in zip(clips, transcripts):
+        reference = normalize_words(fixture["text"])
+        errors += word_errors(reference, normalize_words(transcript))
+        words += len(reference)
+        if parsed_items(transcript) == parsed_items(fixture["text"]):
+            items_correct += 1
+        else:
+            misses.append({"file": fixture["file"], "heard": transcript.strip()})
+    return {"wer": errors / words, "item_accuracy": items_correct / len(clips), "misses": misses}
+
+
+# --- Runs ---
+
+def make_backend(args, config):
+    if args.backend == "fake":
+        return FakeTranscriber()
+    return ASR_BACKENDS[args.backend](
+        model_size=config["model"], quantize=config["quantize"], threads=config["threads"] or None,
+        beam_size=config["beam_size"], language=args.language
+    )
+
+
+def run_config(args, config, clips):
+    """Loads the backend and transcribes every clip `args.repeat` times, one at a time."""
+    backend = make_backend(args, config)
+    started = time.perf_counter()
+    model = backend.load()
+    load_seconds = time.perf_counter() - started
+    backend.transcribe_batch(model, [clips[0][1]])
+
+    seconds = 0.0
+    for _ in range(args.repeat):
+        transcripts = []
+        for _, audio in clips:
+            started = time.perf_counter()
+            transcripts.extend(backend.transcribe_batch(model, [audio]))
+            seconds += time.perf_counter() - started
+    audio_seconds = sum(len(audio) for _, audio in clips) / SAMPLE_RATE * args.repeat
+
+    report = dict(config, load_seconds=load_seconds, rtf=seconds / audio_seconds,
+                  peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+    report.update(score(clips, transcripts))
+    return report
+
+
+def run_forked(args, config, clips):
+    """run_config() in a child process, so model weights and peak RSS do not carry over."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            payload = json.dumps(run_config(args, config, clips))
+        except Exception as e:
+            payload = json.dumps(dict(config, error=repr(e)))
+        with os.fdopen(write_fd, "w") as f:
+            f.write(payload)
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        report = json.loads(f.read() or "{}") or dict(config, error="worker exited without a report")
+    os.waitpid(pid, 0)
+    return report
+
+
+def settings(args, report):
+    if args.backend == "fake":
+        return "ASR_BACKEND=fake"
+    env = {"ASR_BACKEND": args.backend, "ASR_MODEL": report["model"], "ASR_QUANTIZE": report["quantize"],
+           "ASR_THREADS": report["threads"], "ASR_BEAM_SIZE": report["beam_size"]}
+    if args.language:
+        env["ASR_LANGUAGE"] = args.language
+    return " ".join(f"{key}={value}" for key, value in env.items())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=sorted(ASR_BACKENDS) + ["fake"], default="whisper")
+    parser.add_argument("--models", nargs="+", default=["tiny.en", "base.en", "base"])
+    parser.add_argument("--quantize", nargs="+", default=["none", "int8"])
+    parser.add_argument("--threads", nargs="+", type=int, default=[0], help="0 = library default")
+    parser.add_argument("--beam-sizes", nargs="+", type=int, default=[1], help="1 = greedy decoding")
+    parser.add_argument("--language", help="skip language detection, e.g. en")
+    parser.add_argument("--repeat", type=int, default=3, help="timed passes over the fixture set")
+    parser.add_argument("--min-item-accuracy", type=float, default=1.0, help="required share of clips parsed to the right items")
+    parser.add_argument("--fixtures", default=FIXTURE_DIR, help="directory with phrases.json and the clips")
+    parser.add_argument("--synthesize", action="store_true", help="speak missing clips with --tts-command first")
+    parser.add_argument("--tts-command", default=DEFAULT_TTS_COMMAND)
+    parser.add_argument("--show-misses", action="store_true", help="print the transcripts of misparsed clips")
+    args = parser.parse_args(argv)
+
+    fixtures = load_fixtures(args.fixtures)
+    if args.synthesize:
+        synthesize_missing(fixtures, args.fixtures, args.tts_command)
+    clips = load_clips(fixtures, args.fixtures)
+    audio_seconds = sum(len(audio) for _, audio in clips) / SAMPLE_RATE
+    print(f"fixtures             {len(clips)} clips, {audio_seconds:.1f}s of audio, {args.repeat} timed passes")
+
+    if args.backend == "fake":
+        grid = [("fake", "none", 0, 1)]
+    else:
+        grid = itertools.product(args.models, args.quantize, args.threads, args.beam_sizes)
+    reports = [run_forked(args, dict(zip(("model", "quantize", "threads", "beam_size"), values)), clips) for values in grid]
+
+    print(f"{'model':<10}{'quant':<7}{'threads':>8}{'beam':>6}{'load s':>9}{'RTF':>8}{'peak MB':>10}{'WER':>8}{'items':>8}")
+    for report in reports:
+        label = f"{report['model']:<10}{report['quantize']:<7}{report['threads']:>8}{report['beam_size']:>6}"
+        if "error" in report:
+            print(f"{label}  error: {report['error']}")
+            continue
+        print(f"{label}{report['load_seconds']:>9.2f}{report['rtf']:>8.3f}{report['peak_rss_mb']:>10.0f}"
+              f"{report['wer']:>8.1%}{report['item_accuracy']:>8.0%}")
+        if args.show_misses:
+            for miss in report["misses"]:
+                print(f"    {miss['file']}: {miss['heard']!r}")
+
+    passing = [r for r in reports if "error" not in r and r["item_accuracy"] >= args.min_item_accuracy]
+    if not passing:
+        print(f"no configuration reached {args.min_item_accuracy:.0%} item accuracy")
+        return 1
+    best = min(passing, key=lambda r: r["rtf"])
+    print(f"fastest reliable     {settings(args, best)} (RTF {best['rtf']:.3f}, WER {best['wer']:.1%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""
+End-to-end load test for /chat and /listen with fake Gemini and Whisper backends.
+
+Each simulated customer runs a scripted ordering conversation against the
+Flask app from create_app(): restart, menu-finalized JSON payload, size
+clarification, special requests, confirmation, delivery details and one
+voice upload. Latency is reported per stage (p50/p95/p99) together with
+requests per second at the chosen concurrency.
+
+    python -m bench.load_test --sessions 50 --llm-latency-ms 300 --save baseline
+    python -m bench.load_test --sessions 50 --llm-latency-ms 300 --compare baseline
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+
+MENU_ORDER = {
+    "type": "order_finalized_from_menu",
+    "items": [
+        {"id": "HAWA", "name": "Hawaiian Pizza", "category": "pizzas", "quantity": 1},
+        {"id": "ALFR", "name": "Alfredo Fettuccine", "category": "pastas", "quantity": 1},
+        {"id": "LIMON", "name": "Limonata", "category": "drinks", "quantity": 2}
+    ]
+}
+
+# (stage label, message) pairs for one complete order
+CONVERSATION = [
+    ("restart", "BOT_RESTART_COMMAND"),
+    ("menu_finalized", json.dumps(MENU_ORDER, separators=(",", ":"))),
+    ("size_clarification", "large"),
+    ("size_clarification", "large"),
+    ("special_requests", "extra cheese"),
+    ("confirmation", "yes"),
+    ("delivery_details", "My name is Test Customer. 555-123-4567"),
+    ("delivery_details", "My address is 1 Main Street")
+]
+
+
+def configure_fakes(llm_latency_ms, asr_latency_ms, journal_dir):
+    """Selects the fake backends; must run before the app package is imported."""
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["LLM_FAKE_LATENCY_SECONDS"] = str(llm_latency_ms / 1000)
+    os.environ["ASR_BACKEND"] = "fake"
+    os.environ["ASR_FAKE_LATENCY_MS"] = str(asr_latency_ms)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["ORDER_JOURNAL_PATH"] = os.path.join(journal_dir, "orders.jsonl")
+
+
+def make_wav(seconds=2.0, sample_rate=16000):
+    """A 16 kHz PCM WAV with a tone between two stretches of silence."""
+    import numpy as np
+
+    silence = np.zeros(int(sample_rate * 0.5), dtype=np.float32)
+    tone = 0.3 * np.sin(2 * np.pi * 220 * np.arange(int(sample_rate * seconds)) / sample_rate).astype(np.float32)
+    samples = np.concatenate([silence, tone, silence])
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((samples * 32767).astype("<i2").tobytes())
+    return buffer.getvalue()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(pct * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def run_session(app, conversations, wav_bytes, samples, errors, lock):
+    client = app.test_client()
+    client.get("/")
+    for _ in range(conversations):
+        for stage, message in CONVERSATION:
+            started = time.perf_counter()
+            response = client.post("/chat", json={"message": message})
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples.setdefault(stage, []).append(elapsed)
+                if response.status_code != 200:
+                    errors[stage] = errors.get(stage, 0) + 1
+
+        started = time.perf_counter()
+        response = client.post("/listen", data={"audio_data": (io.BytesIO(wav_bytes), "user_audio.wav")})
+        elapsed = time.perf_counter() - started
+        with lock:
+            samples.setdefault("listen", []).append(elapsed)
+            if response.status_code != 200:
+                errors["listen"] = errors.get("listen", 0) + 1
+
+
+def run(sessions, conversations):
+    from app import create_app
+
+    app = create_app()
+    wav_bytes = make_wav()
+    samples, errors = {}, {}
+    lock = threading.Lock()
+
+    threads = [
+        threading.Thread(target=run_session, args=(app, conversations, wav_bytes, samples, errors, lock))
+        for _ in range(sessions)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    stages = {}
+    total_requests = 0
+    for stage, values in samples.items():
+        values.sort()
+        total_requests += len(values)
+        stages[stage] = {
+            "count": len(values),
+            "errors": errors.get(stage, 0),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2)
+        }
+    return {
+        "sessions": sessions,
+        "conversations_per_session": conversations,
+        "requests": total_requests,
+        "wall_seconds": round(wall, 3),
+        "requests_per_second": round(total_requests / wall, 1),
+        "stages": stages
+    }
+
+
+def print_report(report, baseline=None):
+    print(f"{report['sessions']} sessions x {report['conversations_per_session']} conversations: "
+          f"{report['requests']} requests in {report['wall_seconds']}s ({report['requests_per_second']} req/s)")
+    header = f"{'stage':<20}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    if baseline:
+        header += f"{'p95 vs base':>14}"
+    print(header)
+    for stage, stats in sorted(report["stages"].items()):
+        line = f"{stage:<20}{stats['count']:>7}{stats['errors']:>8}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}"
+        base = baseline["stages"].get(stage) if baseline else None
+        if base and base["p95_ms"]:
+            line += f"{(stats['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100:>+13.1f}%"
+        print(line)
+    if baseline:
+        change = (report["requests_per_second"] - baseline["requests_per_second"]) / baseline["requests_per_second"] * 100
+        print(f"throughput vs baseline: {change:+.1f}%")
+
+
+def regressions(report, baseline, tolerance, min_delta_ms):
+    """
+    Stages whose p95 grew by more than `tolerance` (a fraction) over the baseline
+    and by at least `min_delta_ms`, so sub-millisecond jitter is not flagged.
+    """
+    found = []
+    for stage, stats in report["stages"].items():
+        base = baseline["stages"].get(stage)
+        if base and base["p95_ms"] and stats["p95_ms"] > base["p95_ms"] * (1 + tolerance) \
+           and stats["p95_ms"] - base["p95_ms"] >= min_delta_ms:
+            found.append(stage)
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20, help="concurrent customer sessions")
+    parser.add_argument("--conversations", type=int, default=3, help="complete orders per session")
+    parser.add_argument("--llm-latency-ms", type=float, default=200, help="fake Gemini latency per call")
+    parser.add_argument("--asr-latency-ms", type=float, default=100, help="fake Whisper latency per batch")
+    parser.add_argument("--save", metavar="NAME", help="save the report as bench/baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="compare against bench/baselines/NAME.json")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 growth before failing --compare")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="ignore p95 growth smaller than this")
+    args = parser.parse_args(argv)
+
+    journal_dir = tempfile.mkdtemp(prefix="mamma-mia-bench-")
+    configure_fakes(args.llm_latency_ms, args.asr_latency_ms, journal_dir)
+
+    report = run(args.sessions, args.conversations)
+    report["config"] = {"llm_latency_ms": args.llm_latency_ms, "asr_latency_ms": args.asr_latency_ms}
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, f"{args.save}.json"), "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"saved baseline {args.save}")
+
+    if baseline:
+        regressed = regressions(report, baseline, args.tolerance, args.min_delta_ms)
+        if regressed:
+            print(f"p95 regression beyond {args.tolerance:.0%} in: {', '.join(sorted(regressed))}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
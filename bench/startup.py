@@ -0,0 +1,131 @@
+"""
+Startup cost report: import and create_app() time, model preload and warm-up
+time, and resident memory per process.
+
+With --workers N the process forks N workers after startup, like gunicorn
+with preload_app. Each worker starts its ASR replicas, waits for the warm-up
+and times one transcription; its RSS and PSS are reported. PSS splits shared
+pages between the processes using them, so preloaded weights show up in RSS
+but only fractionally in PSS.
+
+    python -m bench.startup
+    python -m bench.startup --preload --workers 4
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+
+def memory_mb():
+    """RSS and (on Linux) PSS of this process in MB."""
+    usage = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    usage["rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    usage["pss_mb"] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        import resource
+        usage["rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return usage
+
+
+def timed(steps, name, fn):
+    started = time.perf_counter()
+    result = fn()
+    steps.append(dict({"step": name, "seconds": round(time.perf_counter() - started, 3)}, **memory_mb()))
+    return result
+
+
+def wait_ready(timeout):
+    from app.lifecycle import start_workers
+
+    pool = start_workers()
+    deadline = time.monotonic() + timeout
+    while pool.stats()["ready_replicas"] < pool.replicas and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return pool
+
+
+def first_transcription(pool):
+    import numpy as np
+    from app.audio import SAMPLE_RATE
+
+    return pool.submit(np.zeros(SAMPLE_RATE * 2, dtype=np.float32)).result(timeout=300)
+
+
+def worker_report(timeout):
+    steps = []
+    pool = timed(steps, "asr replicas ready", lambda: wait_ready(timeout))
+    timed(steps, "first transcription", lambda: first_transcription(pool))
+    return steps
+
+
+def fork_workers(count, timeout):
+    reports = []
+    children = []
+    for i in range(count):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            try:
+                payload = json.dumps(worker_report(timeout))
+            except Exception as e:
+                payload = json.dumps([{"step": "error", "error": repr(e)}])
+            with os.fdopen(write_fd, "w") as f:
+                f.write(payload)
+            os._exit(0)
+        os.close(write_fd)
+        children.append((i, pid, read_fd))
+
+    for i, pid, read_fd in children:
+        with os.fdopen(read_fd) as f:
+            reports.append((i, json.loads(f.read() or "[]")))
+        os.waitpid(pid, 0)
+    return reports
+
+
+def print_steps(title, steps):
+    print(title)
+    for step in steps:
+        if "error" in step:
+            print(f"  error: {step['error']}")
+            continue
+        line = f"  {step['step']:<24}{step['seconds']:>9.3f}s{step.get('rss_mb', 0):>10.1f} MB RSS"
+        if "pss_mb" in step:
+            line += f"{step['pss_mb']:>10.1f} MB PSS"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--preload", action="store_true", help="run app.lifecycle.preload() before forking")
+    parser.add_argument("--workers", type=int, default=0, help="forked workers to measure after startup")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for ASR warm-up")
+    args = parser.parse_args(argv)
+
+    steps = [dict({"step": "interpreter"}, seconds=0.0, **memory_mb())]
+    create_app = timed(steps, "import app", lambda: __import__("app").create_app)
+    timed(steps, "create_app()", create_app)
+    if args.preload:
+        from app.lifecycle import preload
+        timed(steps, "preload()", preload)
+    if not args.workers:
+        steps.extend(worker_report(args.timeout))
+    print_steps(f"master (pid {os.getpid()})", steps)
+
+    for i, worker_steps in fork_workers(args.workers, args.timeout):
+        print_steps(f"worker {i}", worker_steps)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
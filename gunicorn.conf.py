@@ -0,0 +1,13 @@
+# gunicorn -c gunicorn.conf.py run:app
+#
+# PRELOAD_MODELS=1 loads Whisper in the master before forking, so workers share
+# its weights copy-on-write instead of each loading a private copy.
+
+import os
+
+preload_app = os.environ.get("PRELOAD_MODELS") == "1"
+
+
+def post_fork(server, worker):
+    from app.lifecycle import start_workers
+    start_workers()
@@ -0,0 +1,22 @@
+import os
+
+# Fake model backends; set before the app package reads them at import time.
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("ASR_BACKEND", "fake")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import pytest
+
+from app import create_app
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv("ORDER_JOURNAL_PATH", str(tmp_path / "orders.jsonl"))
+    monkeypatch.setenv("DISPATCH_STORE_URL", f"sqlite:///{tmp_path / 'dispatch.db'}")
+    return create_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,138 @@
+import threading
+import time
+
+from app.admission import AdmissionController, SessionFlights, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_token_bucket_refills_at_its_rate_up_to_the_burst():
+    clock = Clock()
+    bucket = TokenBucket(rate=2.0, burst=2, clock=clock)
+
+    assert [bucket.try_take() for _ in range(3)] == [True, True, False]
+    assert bucket.time_until(1) == 0.5
+
+    clock.now += 0.25
+    assert not bucket.try_take()
+    clock.now += 0.25
+    assert bucket.try_take()
+
+    clock.now += 60
+    assert [bucket.try_take() for _ in range(3)] == [True, True, False]
+
+
+def test_zero_rate_is_unlimited():
+    bucket = TokenBucket(rate=0, burst=1, clock=Clock())
+
+    assert all(bucket.try_take() for _ in range(100))
+
+
+class Caller(threading.Thread):
+    """Acquires a model call slot for `stage` and records whether it was admitted."""
+
+    def __init__(self, controller, stage, admitted):
+        super().__init__(daemon=True)
+        self.controller, self.stage, self.admitted = controller, stage, admitted
+        self.result = "pending"
+
+    def run(self):
+        self.result = self.controller.acquire(self.stage, deadline=self.controller.deadline_for())
+        if self.result is not None:
+            self.admitted.append(self.stage)
+
+
+def test_waiters_are_admitted_by_stage_priority():
+    clock = Clock()
+    controller = AdmissionController(max_in_flight=1, queue_size=8, clock=clock)
+    held = controller.acquire("start", controller.deadline_for())
+    admitted = []
+
+    browsing = Caller(controller, "awaiting_order", admitted)
+    browsing.start()
+    wait_for(lambda: controller.stats()["queued"] == 1)
+    paying = Caller(controller, "awaiting_confirmation", admitted)
+    paying.start()
+    wait_for(lambda: controller.stats()["queued"] == 2)
+
+    controller.release(held)
+    wait_for(lambda: admitted == ["awaiting_confirmation"])
+    controller.release(paying.result)
+    wait_for(lambda: admitted == ["awaiting_confirmation", "awaiting_order"])
+    controller.release(browsing.result)
+    assert controller.stats()["in_flight"] == 0
+
+
+def test_full_queue_sheds_the_lowest_priority_caller():
+    clock = Clock()
+    controller = AdmissionController(max_in_flight=1, queue_size=1, clock=clock)
+    held = controller.acquire("start", controller.deadline_for())
+    admitted = []
+
+    browsing = Caller(controller, "awaiting_order", admitted)
+    browsing.start()
+    wait_for(lambda: controller.stats()["queued"] == 1)
+
+    # No room, and it ranks no higher than the caller already queued.
+    assert controller.acquire("start", controller.deadline_for()) is None
+    assert controller.stats()["shed_queue_full"] == 1
+
+    # A customer about to pay takes the queued browser's place.
+    paying = Caller(controller, "awaiting_delivery_details", admitted)
+    paying.start()
+    browsing.join(5)
+    assert browsing.result is None
+    assert controller.stats()["evicted"] == 1
+
+    controller.release(held)
+    paying.join(5)
+    assert admitted == ["awaiting_delivery_details"]
+
+
+def test_caller_that_would_miss_its_deadline_is_shed_at_once():
+    clock = Clock()
+    controller = AdmissionController(initial_service_time=2.0, clock=clock)
+
+    assert controller.acquire("start", deadline=clock() + 1.0) is None
+    assert controller.stats()["shed_deadline"] == 1
+    assert controller.acquire("start", deadline=clock() + 3.0) is not None
+
+
+def test_duplicate_submits_share_the_leaders_result():
+    clock = Clock()
+    flights = SessionFlights(max_age=30, clock=clock)
+
+    role, flight = flights.join("s1", "two hawaiian")
+    assert role == SessionFlights.LEADER
+    follower_role, same_flight = flights.join("s1", "two hawaiian")
+    assert follower_role == SessionFlights.FOLLOWER and same_flight is flight
+    assert flights.join("s1", "a limonata")[0] == SessionFlights.BUSY
+    assert flights.join("s2", "a limonata")[0] == SessionFlights.LEADER
+
+    flights.finish("s1", flight, ({"reply": "ok"}, 200))
+    assert flight.done.is_set() and same_flight.result == ({"reply": "ok"}, 200)
+    assert flights.join("s1", "a limonata")[0] == SessionFlights.LEADER
+    assert flights.stats()["coalesced"] == 1
+
+
+def test_abandoned_turn_stops_blocking_its_session():
+    clock = Clock()
+    flights = SessionFlights(max_age=30, clock=clock)
+    flights.join("s1", "two hawaiian")
+
+    clock.now += 31
+
+    assert flights.join("s1", "a limonata")[0] == SessionFlights.LEADER
@@ -0,0 +1,37 @@
+import time
+import uuid
+
+from app.asr_pool import ASRWorkerPool, _cached_model, _replica_model
+
+
+def _weights():
+    return {"weights": [0.0] * 4}
+
+
+def test_first_replica_takes_the_preloaded_model_and_later_ones_a_copy():
+    key = ("test", uuid.uuid4().hex)
+    preloaded = _cached_model(key, _weights)
+
+    first = _replica_model(key, _weights)
+    second = _replica_model(key, _weights)
+
+    assert first is preloaded
+    assert second is not preloaded and second == preloaded
+
+
+def test_thread_replicas_own_distinct_models():
+    key = ("test", uuid.uuid4().hex)
+    loaded = []
+
+    def loader():
+        model = _replica_model(key, _weights)
+        loaded.append(model)
+        return model
+
+    pool = ASRWorkerPool(loader, transcribe_batch=lambda model, audios: ["" for _ in audios], replicas=3)
+    deadline = time.monotonic() + 5
+    while pool.stats()["ready_replicas"] < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pool.shutdown()
+
+    assert len({id(model) for model in loaded}) == 3
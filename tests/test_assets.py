@@ -0,0 +1,54 @@
+import gzip
+import json
+import re
+
+from app.assets import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, menu_payload, static_fingerprint
+from app.menu_catalog import CATALOG
+
+
+def test_menu_revalidates_to_304_with_a_matching_etag(client):
+    first = client.get("/menu")
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == REVALIDATE_CACHE_CONTROL
+    etag = first.headers["ETag"]
+
+    repeat = client.get("/menu", headers={"If-None-Match": etag})
+    assert repeat.status_code == 304
+    assert repeat.data == b""
+    assert repeat.headers["ETag"] == etag
+
+    stale = client.get("/menu", headers={"If-None-Match": 'W/"menu-old"'})
+    assert stale.status_code == 200 and json.loads(stale.data) == CATALOG.data
+
+
+def test_versioned_menu_url_is_immutable_and_compressed(client):
+    version = menu_payload().version
+    response = client.get(f"/menu?v={version}", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Cache-Control"] == IMMUTABLE_CACHE_CONTROL
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert json.loads(gzip.decompress(response.data)) == CATALOG.data
+
+
+def test_page_links_fingerprinted_static_files(client):
+    page = client.get("/").get_data(as_text=True)
+
+    assert f"/static/script.js?v={static_fingerprint('script.js')}" in page
+    assert re.search(r"/menu\?v=[\w-]+", page)
+
+
+def test_only_the_current_fingerprint_is_cached_for_a_year(client):
+    fingerprint = static_fingerprint("script.js")
+
+    current = client.get(f"/static/script.js?v={fingerprint}")
+    assert current.headers["Cache-Control"] == IMMUTABLE_CACHE_CONTROL
+    current.close()
+
+    outdated = client.get("/static/script.js?v=0000000000")
+    assert outdated.headers.get("Cache-Control") != IMMUTABLE_CACHE_CONTROL
+    outdated.close()
+
+
+def test_missing_static_file_has_no_fingerprint():
+    assert static_fingerprint("no-such-file.js") is None
@@ -0,0 +1,59 @@
+import io
+import wave
+
+import numpy as np
+
+from app.audio import SAMPLE_RATE, EnergyVAD, trim_silence
+
+
+def tone(seconds, amplitude):
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+
+def silence(seconds):
+    return np.zeros(int(SAMPLE_RATE * seconds), dtype=np.float32)
+
+
+def wav_bytes(samples):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes((samples * 32767).astype("<i2").tobytes())
+    return buffer.getvalue()
+
+
+def test_silence_around_speech_is_trimmed():
+    samples = np.concatenate([silence(1.0), tone(0.5, 0.3), silence(1.0)])
+
+    trimmed, seconds_saved = trim_silence(samples)
+
+    assert 0.5 <= len(trimmed) / SAMPLE_RATE < 1.0
+    assert abs(seconds_saved - (len(samples) - len(trimmed)) / SAMPLE_RATE) < 1e-9
+
+
+def test_recording_below_the_energy_floor_is_kept_whole():
+    quiet = np.concatenate([silence(0.5), tone(1.0, 0.008), silence(0.5)])
+
+    trimmed, seconds_saved = trim_silence(quiet)
+
+    assert len(trimmed) == len(quiet) and seconds_saved == 0.0
+
+
+def test_lower_floor_finds_quiet_speech():
+    quiet = np.concatenate([silence(0.5), tone(1.0, 0.008), silence(0.5)])
+
+    trimmed, _ = trim_silence(quiet, vad=EnergyVAD(min_energy=0.002))
+
+    assert len(trimmed) < len(quiet)
+
+
+def test_quiet_upload_is_still_transcribed(client):
+    quiet = np.concatenate([silence(0.5), tone(1.0, 0.008), silence(0.5)])
+
+    response = client.post("/listen", data={"audio_data": (io.BytesIO(wav_bytes(quiet)), "quiet.wav")})
+
+    assert response.status_code == 200
+    assert response.get_json()["transcript"] != ""
@@ -0,0 +1,40 @@
+from app.routes import ORDER_NOT_SAVED_MESSAGE, SESSION_COOKIE
+
+DETAILS = "My name is Bob. My phone is 555-123-4567. My address is 1 Main St"
+
+
+def ready_to_checkout(app, client):
+    client.get("/")
+    session_id = client.get_cookie(SESSION_COOKIE).value
+    store = app.extensions["order_sessions"]
+    state, version = store.get(session_id)
+    state.update(stage="awaiting_delivery_details", collected_special="no",
+                 structured_order={"items": [{"id": "HAWA", "name": "Hawaiian Pizza", "category": "pizzas", "quantity": 1, "size": "l"}]})
+    store.compare_and_set(session_id, version, state)
+    return session_id
+
+
+def test_order_the_journal_refuses_keeps_the_cart_for_a_retry(app, client, monkeypatch):
+    session_id = ready_to_checkout(app, client)
+    journal = app.extensions["order_journal"]
+
+    def refuse(order, wait=False):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(journal, "append", refuse)
+    response = client.post("/chat", json={"message": DETAILS})
+
+    assert response.get_json()["reply"] == ORDER_NOT_SAVED_MESSAGE
+    state, _ = app.extensions["order_sessions"].get(session_id)
+    assert state["stage"] == "awaiting_delivery_details"
+    assert state["structured_order"]["items"][0]["id"] == "HAWA"
+    assert not any("Thank you for your order" in message["bot"] for message in state["messages"])
+
+    monkeypatch.undo()
+    response = client.post("/chat", json={"message": DETAILS})
+
+    assert response.get_json()["reply"].startswith("Thank you for your order, Bob!")
+    journal.flush()
+    assert [record["name"] for record in journal.replay()] == ["Bob"]
+    state, _ = app.extensions["order_sessions"].get(session_id)
+    assert state["stage"] == "start"
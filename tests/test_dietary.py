@@ -0,0 +1,41 @@
+from app import agent
+from app.dietary import dietary_index
+
+
+def pizza(protein):
+    return {"id": "TERI", "name": "Teriyaki Pizza", "category": "pizzas", "quantity": 1, "size": "m", "protein": protein}
+
+
+def test_check_order_counts_the_chosen_addons():
+    index = dietary_index()
+    alfredo = {"id": "ALFR", "name": "Alfredo Fettuccine", "category": "pastas", "quantity": 1, "size": "m"}
+    order = {"items": [pizza("shrimp"), pizza("chicken"), alfredo, dict(alfredo, addons=["shrimp"])]}
+
+    conflicts = index.check_order(order, ["shellfish-free"])
+
+    assert [conflict["index"] for conflict in conflicts] == [0, 1, 3]
+
+
+def test_declared_allergens_apply_whatever_protein_is_chosen():
+    index = dietary_index()
+
+    for protein in ("chicken", "shrimp", None):
+        assert index.check_order({"items": [pizza(protein)]}, ["shellfish-free"]), protein
+    assert ("pizzas", "TERI") not in index.keys_in(index.matching(["shellfish-free"]))
+
+
+def test_dietary_request_at_special_requests_is_saved():
+    state = {"stage": "awaiting_special_requests", "structured_order": {"items": [pizza("chicken")]}, "clarification_index": 0,
+             "clarification_form": None, "collected_special": None}
+
+    result = agent.generate_response([{"user": "medium", "bot": agent.SPECIAL_REQUESTS_QUESTION}],
+                                     "can you make it gluten free?", state)
+
+    assert result["state"]["collected_special"] == "can you make it gluten free?"
+    assert result["state"]["stage"] == "awaiting_confirmation"
+
+
+def test_no_match_reply_names_the_category():
+    reply = agent._handle_dietary_question({"structured_order": {"items": []}}, "which drinks are halal?")
+
+    assert reply == "Sorry, none of our drinks are marked halal."
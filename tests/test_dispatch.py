@@ -0,0 +1,93 @@
+import json
+
+from app.dispatch import Dispatcher, TableGeocoder, create_dispatch_store
+from app.order_journal import OrderJournal
+
+ADDRESSES = {"1 main st": [40.0, -74.0], "3 main st": [40.001, -74.001]}
+
+
+def make_dispatcher(path, **kwargs):
+    return Dispatcher(geocoder=TableGeocoder(ADDRESSES), capacity=2, max_hold=300, tick_interval=None,
+                      store=create_dispatch_store(f"sqlite:///{path}"), **kwargs)
+
+
+def order(order_id, address, recorded_at=None):
+    record = {"order_id": order_id, "address": address, "items": [{"category": "drinks", "quantity": 1}]}
+    if recorded_at is not None:
+        record["recorded_at"] = recorded_at
+    return record
+
+
+def test_workers_sharing_a_store_see_the_same_batches(tmp_path):
+    path = tmp_path / "dispatch.db"
+    first, second = make_dispatcher(path), make_dispatcher(path)
+    first.submit(order("a", "1 main st"), now=0)
+    second.submit(order("b", "3 main st"), now=0)
+
+    assert [batch["order_ids"] for batch in first.tick(now=600)] == [["a", "b"]]
+    assert second.tick(now=600) == []  # the first dispatcher holds the lease
+
+    [batch] = second.batches(status="open")
+    assert first.batches() == [batch]
+    assert second.claim(batch["batch_id"], "dana")["driver"] == "dana"
+    assert first.claim(batch["batch_id"], "eli") is None
+    assert first.stats()["pending"] == 0
+    assert second.stats()["deadline_batches"] + second.stats()["full_batches"] == 1
+
+
+def journal_with(path, *records):
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    return OrderJournal(str(path))
+
+
+def test_restore_queues_journaled_orders_the_store_has_not_seen(tmp_path):
+    path = tmp_path / "dispatch.db"
+    make_dispatcher(path).submit(order("a", "1 main st"), now=1000)
+    journal = journal_with(tmp_path / "orders.jsonl", order("old", "1 main st", recorded_at=0),
+                           order("a", "1 main st", recorded_at=1000), order("b", "3 main st", recorded_at=1000))
+
+    restarted = make_dispatcher(path, retention=3600)
+    assert restarted.restore(journal, now=4000) == 1
+
+    [batch] = restarted.tick(now=4000)
+    assert sorted(batch["order_ids"]) == ["a", "b"]
+    journal.close()
+
+
+class ReadCountingJournal(OrderJournal):
+    def __init__(self, path):
+        super().__init__(path)
+        self.read = []
+
+    def read_from(self, position):
+        for position, record in super().read_from(position):
+            self.read.append(record["order_id"])
+            yield position, record
+
+
+def test_restore_reads_only_what_was_journaled_since_the_last_one(tmp_path):
+    path = tmp_path / "dispatch.db"
+    journal_path = tmp_path / "orders.jsonl"
+    journal_path.write_text(json.dumps(order("a", "1 main st", recorded_at=1000)) + "\n")
+    journal = ReadCountingJournal(str(journal_path))
+    assert make_dispatcher(path).restore(journal, now=1000) == 1
+
+    # A line still being written is left for the next restore.
+    with open(journal_path, "a") as f:
+        f.write(json.dumps(order("b", "3 main st", recorded_at=1000)) + "\n" + '{"order_id": "c", "addr')
+    assert make_dispatcher(path).restore(journal, now=1000) == 1
+    assert make_dispatcher(path).restore(journal, now=1000) == 0
+    assert journal.read == ["a", "b"]
+    assert journal.stats()["replay_skipped_lines"] == 0
+    journal.close()
+
+
+def test_replaced_journal_is_read_from_the_start(tmp_path):
+    path = tmp_path / "dispatch.db"
+    journal = journal_with(tmp_path / "orders.jsonl", *(order(f"old{i}", "1 main st", recorded_at=1000) for i in range(5)))
+    make_dispatcher(path).restore(journal, now=1000)
+    journal.close()
+
+    journal = journal_with(tmp_path / "orders.jsonl", order("new", "3 main st", recorded_at=1000))
+    assert make_dispatcher(path).restore(journal, now=1000) == 1
+    journal.close()
@@ -0,0 +1,53 @@
+from app import agent
+
+
+def item_details_state(*items):
+    return {"stage": "awaiting_item_details", "structured_order": {"items": list(items)}, "clarification_index": 0,
+            "clarification_form": None, "collected_special": None}
+
+
+def test_typed_size_still_asks_for_the_required_protein():
+    state = item_details_state({"id": "TERI", "name": "Teriyaki Pizza", "category": "pizzas", "quantity": 1})
+
+    reply, state = agent._handle_item_details(state, "large please")
+
+    assert state["structured_order"]["items"][0]["size"] == "l"
+    assert state["stage"] == "awaiting_item_details"
+    assert "protein" in reply.lower()
+    assert [field["name"] for field in state["clarification_form"]["items"][0]["fields"]] == ["crust", "protein"]
+
+    reply, state = agent._handle_item_details(state, "shrimp")
+
+    assert state["structured_order"]["items"][0]["protein"] == "shrimp"
+    assert state["stage"] == "awaiting_special_requests"
+    assert state["clarification_form"] is None
+    assert reply == agent.SPECIAL_REQUESTS_QUESTION
+
+
+def test_typed_options_are_asked_until_every_required_one_is_set():
+    state = item_details_state({"id": "RANCH", "name": "Ranch/BBQ Pizza", "category": "pizzas", "quantity": 1, "size": "m"})
+
+    reply, state = agent._handle_item_details(state, "chicken")
+
+    assert state["structured_order"]["items"][0]["protein"] == "chicken"
+    assert state["stage"] == "awaiting_item_details"
+    assert "sauce" in reply.lower()
+
+    reply, state = agent._handle_item_details(state, "bbq")
+
+    assert state["structured_order"]["items"][0]["sauce"] == "BBQ"
+    assert state["stage"] == "awaiting_special_requests"
+
+
+def test_handled_turns_count_as_avoided_llm_calls(client):
+    client.get("/")
+    client.post("/chat", json={"message": "BOT_RESTART_COMMAND"})
+    calls = agent.llm_client.backend.calls
+    avoided = agent.metrics.LLM_CALLS_AVOIDED.value(reason="handler")
+
+    turn = client.post("/chat", json={"message": "two large hawaiian"}).get_json()
+
+    assert "special requests" in turn["reply"].lower()
+    assert agent.llm_client.backend.calls == calls
+    assert agent.metrics.LLM_CALLS_AVOIDED.value(reason="handler") == avoided + 1
+    assert "mammamia_llm_calls_avoided_total" in client.get("/metrics").get_data(as_text=True)
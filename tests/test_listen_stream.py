@@ -0,0 +1,30 @@
+import json
+import threading
+
+import pytest
+
+simple_websocket = pytest.importorskip("simple_websocket")
+from werkzeug.serving import make_server
+
+
+@pytest.fixture
+def ws_url(app):
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"ws://127.0.0.1:{server.server_port}/listen/stream"
+    server.shutdown()
+
+
+def test_bad_frames_get_an_error_and_keep_the_socket_open(ws_url):
+    ws = simple_websocket.Client.connect(ws_url)
+    ws.send(b"\x00\x01\x02")
+    assert json.loads(ws.receive(timeout=5))["type"] == "error"
+    ws.send("not json")
+    assert json.loads(ws.receive(timeout=5))["type"] == "error"
+
+    # Still listening: the end of the stream closes it normally.
+    ws.send(b"\x00\x00" * 1600)
+    ws.send(json.dumps({"type": "end"}))
+    with pytest.raises(simple_websocket.ConnectionClosed):
+        while ws.receive(timeout=5) is not None:
+            pass
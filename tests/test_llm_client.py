@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from app.llm_client import CircuitBreaker, FakeBackend, LLMClient, LLMUnavailable
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def failing_first(failures, reply="Ciao!"):
+    """A reply callable that raises for the first `failures` calls."""
+    calls = []
+
+    def respond(contents):
+        calls.append(contents)
+        if len(calls) <= failures:
+            raise RuntimeError("upstream 503")
+        return reply
+    return respond
+
+
+class TimedBackend(FakeBackend):
+    """FakeBackend whose n-th call takes latencies[n] seconds."""
+
+    def __init__(self, latencies, **kwargs):
+        super().__init__(**kwargs)
+        self.latencies = list(latencies)
+        self._started = 0
+
+    def _delay(self):
+        delay = self.latencies[min(self._started, len(self.latencies) - 1)]
+        self._started += 1
+        return delay
+
+
+def test_failed_calls_are_retried_until_one_succeeds():
+    backend = FakeBackend(reply=failing_first(2))
+    client = LLMClient(backend, timeout=5, max_retries=2, backoff_base=0.001)
+
+    assert asyncio.run(client.generate(["hi"])) == "Ciao!"
+    assert backend.calls == 3
+    assert client.stats()["retries"] == 2
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_exhausted_retries_raise_llm_unavailable():
+    backend = FakeBackend(reply=failing_first(10))
+    client = LLMClient(backend, timeout=5, max_retries=1, backoff_base=0.001)
+
+    with pytest.raises(LLMUnavailable):
+        asyncio.run(client.generate(["hi"]))
+    assert backend.calls == 2
+    assert client.stats()["failures"] == 1
+
+
+def test_slow_call_times_out_at_the_deadline():
+    client = LLMClient(FakeBackend(latency=1.0), timeout=0.05, max_retries=0)
+
+    with pytest.raises(LLMUnavailable):
+        asyncio.run(client.generate(["hi"]))
+
+
+def test_hedged_request_wins_over_a_slow_primary():
+    backend = TimedBackend([1.0, 0.01])
+    client = LLMClient(backend, timeout=5, max_retries=0, hedge_after=0.05)
+
+    assert asyncio.run(client.generate(["hi"])) == backend.reply
+    assert backend.calls == 1  # the slow primary was cancelled before it replied
+    stats = client.stats()
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_fast_primary_sends_no_hedge():
+    client = LLMClient(TimedBackend([0.0]), timeout=5, max_retries=0, hedge_after=0.5)
+
+    asyncio.run(client.generate(["hi"]))
+    assert client.stats()["hedges"] == 0
+
+
+def test_breaker_opens_then_lets_one_trial_through():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+    clock.now += 30
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # only one trial at a time
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+
+def test_open_breaker_rejects_calls_without_reaching_the_backend():
+    clock = Clock()
+    backend = FakeBackend(reply=failing_first(2))
+    client = LLMClient(backend, timeout=5, max_retries=0,
+                       breaker=CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock))
+
+    for _ in range(2):
+        with pytest.raises(LLMUnavailable):
+            client.generate_sync(["hi"])
+    with pytest.raises(LLMUnavailable, match="circuit open"):
+        client.generate_sync(["hi"])
+    assert backend.calls == 2 and client.stats()["rejected"] == 1
+
+    clock.now += 30
+    assert client.generate_sync(["hi"]) == "Ciao!"
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_stream_counts_against_the_breaker():
+    client = LLMClient(FakeBackend(failure_rate=1.0), breaker=CircuitBreaker(failure_threshold=1))
+
+    with pytest.raises(LLMUnavailable):
+        list(client.stream(["hi"]))
+    assert client.breaker.state == CircuitBreaker.OPEN
+    assert "".join(LLMClient(FakeBackend(reply="Buon appetito!")).stream(["hi"])) == "Buon appetito!"
@@ -0,0 +1,90 @@
+import json
+import os
+
+import pytest
+
+from app.order_journal import OrderJournal
+
+
+def test_append_wait_returns_after_the_order_is_on_disk(tmp_path):
+    journal = OrderJournal(str(tmp_path / "orders.jsonl"), flush_interval=0.01)
+    order_id = journal.append({"items": []}, wait=True)
+
+    with open(journal.path) as f:
+        assert json.loads(f.readline())["order_id"] == order_id
+    journal.close()
+
+
+def test_forked_writers_do_not_interleave_records(tmp_path):
+    path = str(tmp_path / "orders.jsonl")
+    journal = OrderJournal(path, flush_interval=0.001)
+    padding = "x" * 5000  # records larger than a stdio buffer
+    children = []
+    for worker in range(4):
+        pid = os.fork()
+        if pid == 0:
+            for i in range(50):
+                journal.append({"worker": worker, "i": i, "note": padding})
+            journal.flush()
+            os._exit(0)
+        children.append(pid)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+    records = list(journal.replay())
+    assert len(records) == 200
+    assert journal.stats()["replay_skipped_lines"] == 0
+    journal.close()
+
+
+def test_replay_counts_skipped_lines(tmp_path):
+    path = tmp_path / "orders.jsonl"
+    path.write_text('{"order_id": "a"}\n[1, 2]\n{"order_id": "b"}\n{"order_id": "tor')
+    journal = OrderJournal(str(path))
+
+    assert [record["order_id"] for record in journal.replay()] == ["a", "b"]
+    assert journal.stats()["replay_skipped_lines"] == 2
+    journal.close()
+
+
+class FlakyJournal(OrderJournal):
+    """Writes the first `torn_bytes` of the next group, then fails once."""
+
+    def __init__(self, path, torn_bytes, **kwargs):
+        self.torn_bytes = torn_bytes
+        self.calls = 0
+        super().__init__(path, **kwargs)
+
+    def _write(self, fd, data):
+        self.calls += 1
+        if self.calls == 1:
+            return os.write(fd, data[:self.torn_bytes])
+        if self.calls == 2:
+            raise OSError(28, "No space left on device")
+        return os.write(fd, data)
+
+
+def test_failed_write_is_retried_on_a_new_line(tmp_path):
+    first = json.dumps({"order_id": "a", "recorded_at": 1}, separators=(",", ":"))
+    journal = FlakyJournal(str(tmp_path / "orders.jsonl"), torn_bytes=len(first) + 1 + 5,
+                           flush_interval=0.05, retry_interval=0.01)
+    journal.append({"order_id": "a", "recorded_at": 1})
+    journal.append({"order_id": "b", "recorded_at": 1})
+    journal.flush()
+
+    assert [record["order_id"] for record in journal.replay()] == ["a", "b"]
+    assert journal.stats()["replay_skipped_lines"] == 1  # the torn start of "b"
+    journal.close()
+
+
+def test_append_is_refused_while_writes_fail(tmp_path):
+    class BrokenJournal(OrderJournal):
+        def _write(self, fd, data):
+            raise OSError(5, "Input/output error")
+
+    journal = BrokenJournal(str(tmp_path / "orders.jsonl"), flush_interval=0.001, retry_interval=0.01)
+    with pytest.raises(OSError):
+        journal.append({"items": []}, wait=True)
+    with pytest.raises(OSError, match="not writable"):
+        journal.append({"items": []})
+    journal.close()
@@ -0,0 +1,55 @@
+import pytest
+
+from app.order_parser import order_parser, parse_order, parse_size
+
+
+def parsed(text):
+    return [(item["id"], item["quantity"], item.get("size")) for item in parse_order(text)]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("two large hawaiian and a limonata", [("HAWA", 2, "l"), ("LIMON", 1, None)]),
+    ("a hawaiian, large", [("HAWA", 1, "l")]),
+    ("3 medium alfredo", [("ALFR", 3, "m")]),
+    ("a dozen espressos", [("ESP", 12, None)]),
+    ("a margherita and another margherita", [("MARG", 2, None)]),
+    ("to large teriyaki pizzas", [("TERI", 2, "l")]),
+])
+def test_quantities_and_sizes(text, expected):
+    assert parsed(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("two hawaian pizzas and a limonada", [("HAWA", 2, None), ("LIMON", 1, None)]),
+    ("a large margarita", [("MARG", 1, "l")]),
+    ("one creamy trufle fettuccine", [("TRUF", 1, None)]),
+])
+def test_typos_snap_to_menu_words(text, expected):
+    assert parsed(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("I don't want the hawaiian", []),
+    ("no hawaiian or teriyaki, just two large margheritas", [("MARG", 2, "l")]),
+    ("a hawaiian, not a teriyaki", [("HAWA", 1, None)]),
+    ("i dont really want the pesto, a medium truffle instead", [("TRUF", 1, "m")]),
+    ("no thanks, two margheritas", [("MARG", 2, None)]),
+    ("no, I want a pesto", [("PEST", 1, None)]),
+    ("a margherita without onions", [("MARG", 1, None)]),
+])
+def test_negated_items_are_not_ordered(text, expected):
+    assert parsed(text) == expected
+
+
+def test_questions_still_mention_negated_items():
+    assert [item["id"] for item in order_parser().parse("is there no dairy in the alfredo", skip_negated=False)] == ["ALFR"]
+
+
+def test_questions_are_not_orders():
+    assert parse_order("is the pesto nut free?") == []
+
+
+def test_parse_size_takes_whole_words_only():
+    assert parse_size("large please", ["s", "m", "l"]) == "l"
+    assert parse_size("please", ["s", "m", "l"]) is None
+    assert parse_size("m", ["s", "m", "l"]) == "m"
@@ -0,0 +1,44 @@
+import pytest
+
+from app.pricing import MALFORMED_LINE, PRICE_OK, price_orders
+
+MARGARITA = {"id": "MARG", "category": "pizzas", "size": "L", "quantity": 2}
+
+
+@pytest.mark.parametrize("line", [
+    dict(MARGARITA, quantity="2"),
+    dict(MARGARITA, quantity=None),
+    dict(MARGARITA, quantity=0),
+    dict(MARGARITA, quantity=2**70),
+    {"id": "MARG", "name": None, "size": "L"},
+    {"id": "MARG", "size": "L"},
+    dict(MARGARITA, size=5),
+    dict(MARGARITA, protein=["shrimp"]),
+    {"id": "ALFR", "category": "pastas", "size": "M", "addons": 5},
+    "MARG",
+])
+def test_malformed_line_fails_only_its_order(line):
+    result = price_orders([[MARGARITA], [line]])
+
+    assert result.error_codes.tolist() == [PRICE_OK, MALFORMED_LINE]
+    assert result.totals[0] > 0
+    assert result.error_message(1).startswith("Malformed line item")
+
+
+def test_price_batch_reports_malformed_lines(client):
+    response = client.post("/price/batch", json={"orders": [
+        [MARGARITA],
+        [dict(MARGARITA, quantity="2")],
+        [dict(MARGARITA, quantity=None)],
+        [dict(MARGARITA, size=5)],
+        ["MARG"],
+        [dict(MARGARITA, protein=["shrimp"])],
+        [dict(MARGARITA, quantity=2**70)],
+        [{"id": "MARG", "name": None, "size": "L"}],
+    ]})
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["errors"][0] is None and data["totals"][0] > 0
+    assert [error["code"] for error in data["errors"][1:]] == [MALFORMED_LINE] * 7
+    assert data["totals"][1:] == [None] * 7
@@ -0,0 +1,14 @@
+from app.reply_cache import ReplyCache
+
+
+def test_key_depends_on_the_previous_reply():
+    cache = ReplyCache()
+    state = {"stage": "awaiting_order", "structured_order": {"items": []}}
+
+    after_drinks = cache.key(state, "yes", previous_reply="Would you like a drink with that?")
+    after_dessert = cache.key(state, "yes", previous_reply="Shall I list the pastas?")
+    cache.put(after_drinks, "Great, here are our drinks.")
+
+    assert after_drinks != after_dessert
+    assert cache.get(after_dessert) is None
+    assert cache.key(state, "Yes!", previous_reply="Would you like a drink with that?") == after_drinks
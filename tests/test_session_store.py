@@ -0,0 +1,111 @@
+import pytest
+
+from app.routes import CONFLICT_MESSAGE, RESET_ATTEMPTS
+from app.session_store import MemorySessionStore, SQLiteSessionStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store_and_clock(request, tmp_path):
+    clock = Clock()
+    if request.param == "memory":
+        return MemorySessionStore(ttl=60, clock=clock), clock
+    return SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl=60, clock=clock), clock
+
+
+def cart(*item_ids):
+    state, _ = MemorySessionStore().get("new")
+    state["structured_order"]["items"] = [{"id": item_id} for item_id in item_ids]
+    return state
+
+
+def test_unknown_session_starts_fresh_at_version_zero(store_and_clock):
+    store, _ = store_and_clock
+
+    state, version = store.get("s1")
+
+    assert version == 0
+    assert state["stage"] == "start" and state["structured_order"]["items"] == []
+
+
+def test_compare_and_set_rejects_a_stale_version(store_and_clock):
+    store, _ = store_and_clock
+    assert store.compare_and_set("s1", 0, cart("MARG")) == 1
+
+    assert store.compare_and_set("s1", 0, cart("HAWA")) is None  # a second insert of the same session
+    assert store.compare_and_set("s1", 1, cart("PEPP")) == 2
+    assert store.compare_and_set("s1", 1, cart("HAWA")) is None
+
+    state, version = store.get("s1")
+    assert version == 2
+    assert state["structured_order"]["items"] == [{"id": "PEPP"}]
+
+
+def test_stored_state_is_a_copy(store_and_clock):
+    store, _ = store_and_clock
+    state = cart("MARG")
+    store.compare_and_set("s1", 0, state)
+
+    state["structured_order"]["items"].append({"id": "HAWA"})
+
+    assert store.get("s1")[0]["structured_order"]["items"] == [{"id": "MARG"}]
+
+
+def test_idle_sessions_expire_and_can_be_started_over(store_and_clock):
+    store, clock = store_and_clock
+    store.compare_and_set("s1", 0, cart("MARG"))
+
+    clock.now += 61
+    state, version = store.get("s1")
+    assert version == 0 and state["structured_order"]["items"] == []
+
+    # A fresh insert replaces the expired row, but not a live one.
+    assert store.compare_and_set("s1", 0, cart("HAWA")) == 1
+    assert store.compare_and_set("s1", 0, cart("PEPP")) is None
+    assert store.get("s1")[0]["structured_order"]["items"] == [{"id": "HAWA"}]
+
+
+def test_reads_keep_a_memory_session_alive():
+    clock = Clock()
+    store = MemorySessionStore(ttl=60, clock=clock)
+    store.compare_and_set("s1", 0, cart("MARG"))
+
+    clock.now += 50
+    store.get("s1")
+    clock.now += 50
+
+    assert store.get("s1")[1] == 1
+
+
+def test_memory_store_evicts_the_least_recently_used_session():
+    store = MemorySessionStore(max_sessions=2)
+    for session_id in ("s1", "s2"):
+        store.compare_and_set(session_id, 0, cart())
+    store.get("s1")
+    store.compare_and_set("s3", 0, cart())
+
+    assert [store.get(session_id)[1] for session_id in ("s1", "s2", "s3")] == [1, 0, 1]
+
+
+def test_reset_reports_a_conflict_when_turns_keep_committing_first(app, client, monkeypatch):
+    client.get("/")
+    store = app.extensions["order_sessions"]
+    attempts = []
+
+    def always_behind(session_id, expected_version, new_state):
+        attempts.append(expected_version)
+        return None
+
+    monkeypatch.setattr(store, "compare_and_set", always_behind)
+    response = client.post("/chat", json={"message": "BOT_RESTART_COMMAND"})
+
+    assert response.status_code == 409
+    assert response.get_json()["reply"] == CONFLICT_MESSAGE
+    assert len(attempts) == RESET_ATTEMPTS
@@ -0,0 +1,65 @@
+from app.session_store import new_order_state
+from app.state_sync import capture, snapshot, state_update
+
+
+def started_state():
+    state = new_order_state()
+    state["messages"].append({"user": "Bot initialized", "bot": "Hello!"})
+    return state
+
+
+def test_patch_holds_only_changed_fields_and_new_messages():
+    state = started_state()
+    before = capture(state)
+    state["stage"] = "awaiting_item_details"
+    state["messages"].append({"user": "two hawaiian", "bot": "What size?"})
+
+    update = state_update(before, state, base_version=3, version=4, ack=3)
+
+    assert update == {"version": 4, "patch": {"base": 3, "state": {"stage": "awaiting_item_details"},
+                                              "messages": [{"user": "two hawaiian", "bot": "What size?"}]}}
+
+
+def test_stale_or_missing_ack_gets_a_full_snapshot():
+    state = started_state()
+    before = capture(state)
+    state["stage"] = "awaiting_item_details"
+
+    for ack in (2, None):
+        assert state_update(before, state, base_version=3, version=4, ack=ack) == snapshot(state, 4)
+
+
+def test_reset_history_gets_a_full_snapshot():
+    state = started_state()
+    state["messages"].append({"user": "yes", "bot": "Thank you for your order!"})
+    before = capture(state)
+    state.clear()
+    state.update(started_state())
+
+    assert "snapshot" in state_update(before, state, base_version=3, version=4, ack=3)
+
+
+def test_delivery_details_never_leave_the_server():
+    state = started_state()
+    state["collected_phone"] = "555-123-4567"
+
+    assert "collected_phone" not in snapshot(state, 1)["snapshot"]["state"]
+
+
+def test_chat_patches_from_the_acknowledged_version(client):
+    client.get("/")
+    restart = client.post("/chat", json={"message": "BOT_RESTART_COMMAND"}).get_json()
+    version = restart["version"]
+    assert restart["snapshot"]["state"]["stage"] == "start"
+
+    turn = client.post("/chat", json={"message": "two large hawaiian", "ack": version}).get_json()
+    assert turn["version"] == version + 1
+    assert turn["patch"]["base"] == version
+    assert turn["patch"]["state"]["stage"] == "awaiting_special_requests"
+    assert [message["user"] for message in turn["patch"]["messages"]] == ["two large hawaiian"]
+
+    # A client that missed that reply still acknowledges the older version.
+    stale = client.post("/chat", json={"message": "a limonata", "ack": version}).get_json()
+    assert stale["version"] == version + 2
+    assert "patch" not in stale
+    assert stale["snapshot"]["messages"][-1]["user"] == "a limonata"